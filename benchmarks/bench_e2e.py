@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+measure the whole farming protocol over the in-memory loopback transport.
+
+the uploader runs with uploader.main() and the first farmer with
+farmer.main().  other farmers are FarmerHandlers on their own telehash
+nodes, each getting its own file.  times of these stages are measured:
+
+  accept           seqAA_accept_request of the uploader, including encode
+  encode           hashing and encoding a file for heartbeat
+  transfer         from seqAB_send_file until the file arrives at the farmer
+  verify           verifying the downloaded file at the farmer
+  placement        from opening the farming channel until the contract
+  first_heartbeat  from the contract until its first valid proof
+
+then valid proofs are counted for --duration seconds to get steady
+heartbeat throughput.  a result is printed as one json line per run.
+
+usage: python benchmarks/bench_e2e.py [--sizes 1,16] [--farmers 1,10]
+           [--duration 5] [--interval 0.1] [--latency 0.001]
+           [--bandwidth bytes/sec] [--loss 0] [--output results.jsonl]
+           [--baseline old.jsonl] [--tolerance 0.2]
+
+with --baseline, p50 of stages and heartbeat throughput are compared with
+the run of the same size and farmers in the baseline, and the exit status
+is 1 if any of them is worse by more than --tolerance.
+
+sizes are in MB and files of size x farmers bytes are made in a
+temporary directory, so several GB x 1000 farmers needs the disk space.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from storjdemo import uploader
+from storjdemo import farmer
+from storjdemo import loopback
+from storjdemo import wire
+from storjdemo.contracts import ContractIndex
+from storjdemo.proofcache import ProofCache
+from storjdemo.scheduler import HeartbeatScheduler
+
+UPLOADER_PORT = 9999
+
+
+class Recorder(object):
+
+    """
+    class for recording times of stages.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.times = collections.defaultdict(list)
+            self.starts = {}
+            self.accepted = {}
+            self.proofs = []
+
+    def add(self, stage, secs):
+        with self.lock:
+            self.times[stage].append(secs)
+
+    def start(self, key):
+        with self.lock:
+            self.starts[key] = time.time()
+
+    def since(self, stage, key):
+        with self.lock:
+            start = self.starts.pop(key, None)
+            if start is not None:
+                self.times[stage].append(time.time() - start)
+
+    def summary(self):
+        with self.lock:
+            return dict((k, summarize(v)) for (k, v) in self.times.items())
+
+
+recorder = Recorder()
+
+
+def summarize(values):
+    """
+    get count, mean and percentiles of values.
+
+    :param list values: list of numbers
+    :return: dict
+    """
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return {'n': 0}
+
+    def percentile(p):
+        return values[min(n - 1, int(p * n))]
+
+    return {'n': n, 'mean': sum(values) / n, 'p50': percentile(0.5),
+            'p95': percentile(0.95), 'max': values[-1]}
+
+
+def timed(cls, name, stage):
+    """
+    record durations of a method as a stage.
+    """
+    func = getattr(cls, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recorder.add(stage, time.time() - start)
+    setattr(cls, name, wrapper)
+
+
+def hook(cls, name, before):
+    """
+    call before(self, *args) before a method.
+    """
+    func = getattr(cls, name)
+
+    def wrapper(self, *args):
+        before(self, *args)
+        return func(self, *args)
+    setattr(cls, name, wrapper)
+
+
+def on_download(self, hash, error):
+    if hash == self.file_hash:
+        recorder.since('transfer', hash)
+
+
+def on_contract(self):
+    recorder.since('placement', self)
+    with recorder.lock:
+        recorder.accepted[wire.JSON.hash(self.tag_hash)] = time.time()
+
+
+def on_result(self, packet):
+    codec = wire.detect(packet)
+    now = time.time()
+    for (k, valid) in codec.loads(packet)['results'].items():
+        k = wire.JSON.hash(codec.unhash(k))
+        with recorder.lock:
+            recorder.proofs.append((now, valid))
+            if valid and k in recorder.accepted:
+                recorder.times['first_heartbeat'].append(
+                    now - recorder.accepted.pop(k))
+
+
+def instrument():
+    """
+    wrap methods of the uploader and the farmer to record stages.
+    """
+    timed(uploader.UploaderHandler, 'seqAA_accept_request', 'accept')
+    timed(uploader, 'prepare_object', 'encode')
+    hook(uploader.UploaderHandler, 'seqAB_send_file',
+         lambda self, p: recorder.start(self.file_hash))
+    hook(farmer.FarmerHandler, 'seqAA_request',
+         lambda self, p: recorder.start(self))
+    hook(farmer.FarmerHandler, 'handler', on_download)
+    timed(farmer.FarmerHandler, 'verify_chunks', 'verify')
+    hook(farmer.FarmerHandler, 'accept_contract', on_contract)
+    hook(farmer.FarmerHeartbeatHandler, 'seqAB_get_result', on_result)
+
+
+def reset():
+    """
+    reset global states of the uploader and the farmer between runs.
+    """
+    uploader.set_stop_flag(False)
+    uploader.status = 0
+    uploader.sessions.clear()
+    uploader.scheduler = HeartbeatScheduler()
+    farmer.set_stop_flag(False)
+    farmer.status = 0
+    farmer.contracts.close()
+    farmer.contracts = ContractIndex(farmer.CONTRACTS_PATH)
+    farmer.proof_cache = ProofCache()
+    recorder.reset()
+
+
+def wait(cond, timeout):
+    """
+    wait until cond() is true.
+
+    :return: True if cond() became true before timeout
+    """
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def run(size, nfarmers, args):
+    """
+    run the protocol once.
+
+    :param int size: size of files in MB
+    :param int nfarmers: number of farmers
+    :return: dict of results
+    """
+    reset()
+    net = loopback.Network(args.latency, args.bandwidth, args.loss,
+                           args.seed)
+    uploader.set_transport(net)
+    farmer.set_transport(net)
+    files = []
+    for i in range(nfarmers):
+        fname = 'obj%d.dat' % i
+        with open(fname, 'wb') as f:
+            for j in range(size):
+                f.write(os.urandom(1024 * 1024))
+        files.append(fname)
+    dest = json.dumps({'paths': [{'type': 'udp4', 'ip': '127.0.0.1',
+                                  'port': UPLOADER_PORT}]})
+
+    start = time.time()
+    u = threading.Thread(target=uploader.main,
+                         args=(UPLOADER_PORT, files))
+    u.start()
+    f = threading.Thread(target=farmer.main, args=(dest,))
+    try:
+        wait(lambda: UPLOADER_PORT in net.nodes, args.timeout)
+        f.start()
+        for i in range(1, nfarmers):
+            node = net.telehash(0)
+            handler = farmer.FarmerHandler(node, dest)
+            node.add_channel_handler('heartbeat', handler.factory)
+            node.open_channel(dest, 'farming', handler)
+        placed = wait(lambda: len(farmer.contracts) == nfarmers,
+                      args.timeout)
+        placed_time = time.time() - start
+        wait(lambda: not recorder.accepted, args.timeout)
+        steady = time.time()
+        time.sleep(args.duration)
+        with recorder.lock:
+            proofs = [v for (t, v) in recorder.proofs if t >= steady]
+    finally:
+        uploader.set_stop_flag(True)
+        farmer.set_stop_flag(True)
+        u.join()
+        if f.is_alive():
+            f.join()
+    return {
+        'bench': 'e2e',
+        'size_mb': size,
+        'farmers': nfarmers,
+        'placed': len(farmer.contracts),
+        'all_placed': placed,
+        'placement_secs': placed_time,
+        'stages': recorder.summary(),
+        'heartbeat': {
+            'valid': sum(1 for v in proofs if v),
+            'failed': sum(1 for v in proofs if not v),
+            'per_sec': sum(1 for v in proofs if v) / args.duration,
+        },
+        'network': net.stats(),
+        'status': {'uploader': uploader.status, 'farmer': farmer.status},
+    }
+
+
+def regressions(result, baseline, tolerance):
+    """
+    compare a result with a baseline result.
+
+    :param dict result: result of run()
+    :param dict baseline: result of run() of an older release
+    :param float tolerance: allowed ratio of getting worse
+    :return: list of str describing regressions
+    """
+    found = []
+    for (stage, old) in baseline['stages'].items():
+        new = result['stages'].get(stage, {})
+        if old.get('p50') and new.get('p50', 0) > old['p50'] * (1 + tolerance):
+            found.append('%s p50 %.4f -> %.4f sec' %
+                         (stage, old['p50'], new['p50']))
+    old = baseline['heartbeat']['per_sec']
+    new = result['heartbeat']['per_sec']
+    if new < old * (1 - tolerance):
+        found.append('heartbeat %.1f -> %.1f per sec' % (old, new))
+    return found
+
+
+def load_baseline(fname):
+    """
+    load results keyed by size and farmers.
+    """
+    with open(fname) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    return dict(((r['size_mb'], r['farmers']), r) for r in results)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='benchmark the farming protocol end to end.')
+    parser.add_argument('--sizes', default='1,16',
+                        help='comma separated sizes of files in MB')
+    parser.add_argument('--farmers', default='1,10',
+                        help='comma separated numbers of farmers')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds to count steady heartbeats')
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help='seconds between heartbeats of a contract')
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='one way delay of a packet in seconds')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second of a stream')
+    parser.add_argument('--loss', type=float, default=0,
+                        help='probability of losing a packet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='seconds to wait for all contracts')
+    parser.add_argument('--output', default=None,
+                        help='file to append json lines to')
+    parser.add_argument('--baseline', default=None,
+                        help='json lines of results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed ratio of getting worse')
+    args = parser.parse_args(argv)
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    failed = False
+
+    logging.disable(logging.INFO)
+    instrument()
+    uploader.HEARBEAT_INTARVAL = args.interval
+    uploader.FIRST_HEARTBEAT_DELAY = 0
+    uploader.BATCH_WINDOW = 0
+    uploader.POLL_INTERVAL = 0.05
+    farmer.POLL_INTERVAL = 0.05
+    out = open(args.output, 'a') if args.output else sys.stdout
+    cwd = os.getcwd()
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            for n in [int(s) for s in args.farmers.split(',')]:
+                tmp = tempfile.mkdtemp()
+                os.chdir(tmp)
+                try:
+                    result = run(size, n, args)
+                finally:
+                    farmer.contracts.close()
+                    os.chdir(cwd)
+                    shutil.rmtree(tmp)
+                result['python'] = platform.python_version()
+                result['args'] = vars(args)
+                result['time'] = time.time()
+                out.write(json.dumps(result, sort_keys=True) + '\n')
+                out.flush()
+                if (size, n) in baseline:
+                    for r in regressions(result, baseline[(size, n)],
+                                         args.tolerance):
+                        sys.stderr.write('regression %d MB x %d: %s\n' %
+                                         (size, n, r))
+                        failed = True
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
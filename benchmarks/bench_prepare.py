@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+compare disk reads of preparing a file for farming.
+
+usage: python benchmarks/bench_prepare.py [size in MB]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from storjdemo import uploader
+from storjdemo.stream import HashingReader
+
+
+class CountingFile(object):
+
+    """
+    file wrapper counting bytes read.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        b = self.file.read(size)
+        self.bytes_read += len(b)
+        return b
+
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+
+def two_pass(filename):
+    """
+    hash and encode as they were done before, reading the file twice.
+    """
+    with open(filename, 'rb') as f:
+        b = f.read()
+        uploader.get_hash(b)
+        n = len(b)
+    with open(filename, 'rb') as f:
+        c = CountingFile(f)
+        uploader.beat.encode(c)
+    return n + c.bytes_read
+
+
+def one_pass(filename):
+    """
+    hash and encode in one pass.
+    """
+    with open(filename, 'rb') as f:
+        reader = HashingReader(f)
+        uploader.beat.encode(reader)
+        reader.digest()
+    return reader.bytes_read
+
+
+def main(size):
+    fd, filename = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        for i in range(size):
+            f.write(os.urandom(1024 * 1024))
+    try:
+        for func in (two_pass, one_pass):
+            start = time.time()
+            n = func(filename)
+            print('%-8s %8.3f sec %12d bytes read' %
+                  (func.__name__, time.time() - start, n))
+    finally:
+        os.remove(filename)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(64)
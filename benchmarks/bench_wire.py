@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+compare sizes and encode/decode times of channel packets in JSON and
+in the binary format.
+
+usage: python benchmarks/bench_wire.py [number of contracts in a batch]
+"""
+
+import os
+import sys
+import time
+import base64
+
+from storjdemo import wire
+
+
+class Blob(object):
+
+    """
+    stand-in for a heartbeat object serialized as base64 by todict().
+    """
+
+    def __init__(self, size):
+        self.b = os.urandom(size)
+
+    def todict(self):
+        return base64.b64encode(self.b).decode()
+
+
+def accept_request(codec):
+    """
+    packet of seqAA_accept_request for a 1 GiB file.
+    """
+    return {'file_hash': codec.hash(os.urandom(32)),
+            'tag_hash': codec.hash(os.urandom(32)),
+            'file_size': 1024 ** 3,
+            'chunk_size': 1024 ** 2,
+            'chunks': codec.blob(os.urandom(32 * 1024)),
+            'merkle_root': codec.hash(os.urandom(32))}
+
+
+def proofs(codec, n):
+    """
+    packet of seqAA_make_proof for n contracts.
+    """
+    return {'proofs': dict((codec.hash(os.urandom(32)),
+                            codec.swizzle(Blob(256))) for i in range(n))}
+
+
+def measure(codec, p, rounds=200):
+    """
+    measure size, encoding time and decoding time of a packet.
+    """
+    start = time.time()
+    for i in range(rounds):
+        packet = codec.dumps(p)
+    encode = (time.time() - start) / rounds
+    start = time.time()
+    for i in range(rounds):
+        codec.loads(packet)
+    decode = (time.time() - start) / rounds
+    return (len(packet), encode, decode)
+
+
+def main(n):
+    print('%-16s %-5s %10s %12s %12s' %
+          ('packet', 'codec', 'bytes', 'encode usec', 'decode usec'))
+    for (name, make) in (('accept_request', accept_request),
+                         ('proofs x%d' % n, lambda c: proofs(c, n))):
+        for codec in (wire.JSON, wire.BINARY):
+            (size, encode, decode) = measure(codec, make(codec))
+            print('%-16s %-5s %10d %12.1f %12.1f' %
+                  (name, codec.name, size, encode * 1e6, decode * 1e6))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(100)
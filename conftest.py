@@ -0,0 +1,7 @@
+import sys
+
+collect_ignore = []
+# the asyncio runtime needs async/await of python 3.5.
+if sys.version_info < (3, 5):
+    collect_ignore += ['storjdemo/aio.py', 'storjdemo/aio_uploader.py',
+                       'storjdemo/aio_farmer.py', 'tests/test_aio.py']
@@ -30,7 +30,7 @@
 
 from setuptools.command.test import test as TestCommand
 import os
-from distutils.core import setup, Extension
+from setuptools import setup
 
 LONG_DESCRIPTION = open('README.md').read()
 VERSION = '1.0'
@@ -89,5 +89,10 @@ setup(
     install_requires=install_requirements,
     tests_require=test_requirements,
     keywords=['storj', 'storj platform','Demo'],
+    entry_points={
+        'console_scripts': [
+            'storjdemo-loadgen = storjdemo.loadgen:main',
+        ],
+    },
     dependency_links=dependency_links_
 )
@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+asyncio runtime for the uploader and the farmer.
+
+channel handlers of aio_uploader and aio_farmer have coroutine seq*
+methods, which are run by tasks on one event loop.  work that blocks,
+e.g. Swizzle operations and hashing files, is run in a bounded thread
+pool, so the number of threads doesn't grow with contracts.
+
+transports of this module are thread-safe.  open_channel(), send_file(),
+regist_hash() and stop_hash() can be called from any thread, and
+channel handlers and uTP handlers are called on the event loop.
+this module needs python 3.5 or later.
+"""
+
+import asyncio
+import binascii
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from storj.messaging import ChannelHandler
+from storj.messaging import StorjTelehash
+from storjutp.storjutp import Storjutp
+
+from storjdemo.loopback import Network, Dropped, seq_methods, BLOCK_SIZE
+
+log = logging.getLogger(__name__)
+
+# max number of threads running blocking work.
+BLOCKING_WORKERS = 8
+# seconds between checks of the stop flag.
+POLL_INTERVAL = 0.1
+executor = None
+
+
+def run_blocking(func, *args):
+    """
+    run a blocking function in the thread pool.
+
+    :param func: function to be called
+    :param args: arguments of func
+    :return: future of the result of func
+    """
+    global executor
+
+    if executor is None:
+        executor = ThreadPoolExecutor(BLOCKING_WORKERS)
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(executor, functools.partial(func, *args))
+
+
+async def call(method, packet):
+    """
+    call a seq* method, which may be a coroutine or not.
+
+    :param method: seq* method of a channel handler
+    :param packet: received packet
+    :return: packet to be sent, None to close the channel
+    """
+    r = method(packet)
+    if asyncio.iscoroutine(r):
+        r = await r
+    return r
+
+
+async def wait_stop(module):
+    """
+    wait for the stop flag or an error status of the uploader or
+    the farmer.
+
+    :param module: uploader or farmer module
+    """
+    while module.status == 0 and not module.stop:
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def run(*coros):
+    """
+    run coroutines on a new event loop until all of them finish.
+
+    :param coros: coroutines
+    :return: list of results of coros
+    """
+    async def gather():
+        return await asyncio.gather(*coros)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather())
+    finally:
+        loop.close()
+
+
+class LoopbackNetwork(Network):
+
+    """
+    class for connecting telehash nodes and uTP servers in memory on one
+    event loop, like storjdemo.loopback.Network but with tasks instead of
+    threads.  nodes must be made on the loop that runs the channels.
+    """
+
+    def __init__(self, latency=0, bandwidth=None, loss=0, seed=None):
+        """
+        init
+
+        :param float latency: one way delay of a packet in seconds
+        :param float bandwidth: bytes per second of a stream,
+                                None for unlimited
+        :param float loss: probability of losing a packet
+        :param seed: seed of random numbers to make loss reproducible
+        """
+        Network.__init__(self, latency, bandwidth, loss, seed)
+        self.loop = None
+
+    def telehash(self, port):
+        """
+        make a telehash node on the running event loop.
+
+        :param int port: port number, <= 0 or in use to pick a free one
+        :return: LoopbackTelehash instance
+        """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.get_event_loop()
+        return Network.telehash(self, port)
+
+    def new_node(self, port):
+        return LoopbackTelehash(self, port, self.loop)
+
+    def new_server(self, port):
+        return LoopbackUtp(self, port, self.loop)
+
+    async def send(self, size):
+        """
+        wait for a packet to arrive.
+
+        :param int size: bytes of the packet
+        :raise Dropped: if the packet was lost too many times
+        """
+        d = self.link.delay(size)
+        if d > 0:
+            await asyncio.sleep(d)
+
+
+class LoopbackTelehash(object):
+
+    """
+    class for a telehash node in memory. a channel runs as a task,
+    calling seq* methods of both ends by turns.
+    """
+
+    def __init__(self, network, port, loop):
+        """
+        init
+
+        :param LoopbackNetwork network: network the node is in
+        :param int port: port number of the node
+        :param loop: event loop running channels
+        """
+        self.network = network
+        self.port = port
+        self.loop = loop
+        self.handlers = {}
+
+    def get_my_location(self):
+        """
+        get location of the node.
+
+        :return: json str of location
+        """
+        return json.dumps({'hashname': 'loopback%d' % self.port,
+                           'paths': [{'type': 'udp4', 'ip': '127.0.0.1',
+                                      'port': self.port}]})
+
+    def add_channel_handler(self, name, factory):
+        """
+        register a factory of handlers for a channel.
+
+        :param str name: channel name
+        :param factory: function returning a ChannelHandler,
+                        or None to refuse the channel
+        """
+        self.handlers[name] = factory
+
+    def open_channel(self, destination, name, handler):
+        """
+        open a channel to a node.
+
+        :param str destination: json str of location of the node
+        :param str name: channel name
+        :param handler: ChannelHandler instance of this end
+        """
+        self.loop.call_soon_threadsafe(
+            asyncio.ensure_future, self._run(destination, name, handler))
+
+    async def _run(self, destination, name, handler):
+        """
+        run a channel until one of ends closes it.
+        """
+        net = self.network
+        try:
+            factory = net.node(destination).handlers.get(name)
+            other = factory() if factory is not None else None
+            if other is None:
+                log.info('channel %s was refused', name)
+                return
+            packet = None
+            for (mine, theirs) in zip(seq_methods(handler),
+                                      seq_methods(other)):
+                packet = await call(mine, packet)
+                if packet is None:
+                    return
+                await net.send(len(packet))
+                packet = await call(theirs, packet)
+                if packet is None:
+                    return
+                await net.send(len(packet))
+        except Dropped:
+            log.error('channel %s was dropped', name)
+        except Exception:
+            log.exception('channel %s failed', name)
+
+
+class LoopbackUtp(object):
+
+    """
+    class for a uTP server in memory. a file is copied block by block
+    in a task into the directory registered for its hash, and blocks are
+    read and written by run_blocking().
+    """
+
+    def __init__(self, network, port, loop):
+        """
+        init
+
+        :param LoopbackNetwork network: network the server is in
+        :param int port: port number of the server
+        :param loop: event loop running transfers
+        """
+        self.network = network
+        self.port = port
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.hashes = {}
+
+    def get_serverport(self):
+        """
+        get port number of the server.
+
+        :return: port number
+        """
+        return self.port
+
+    def regist_hash(self, hash, handler, dir):
+        """
+        accept a file with a hash.
+
+        :param bytes hash: hash of the file
+        :param handler: function called on the loop with hash and
+                        error info when the file was received
+        :param str dir: directory where the file is saved
+        """
+        with self.lock:
+            self.hashes[hash] = (handler, dir)
+
+    def stop_hash(self, hash):
+        """
+        stop accepting a file with a hash.
+
+        :param bytes hash: hash of the file
+        """
+        with self.lock:
+            self.hashes.pop(hash, None)
+
+    def stop(self):
+        """
+        stop the server, which is removed from the network with
+        handlers of files it accepted.
+        """
+        self.network.remove_server(self.port)
+        with self.lock:
+            self.hashes.clear()
+
+    def send_file(self, ip, port, filename, hash, handler):
+        """
+        send a file to a server.
+
+        :param str ip: ip address of the server, not used
+        :param int port: port number of the server
+        :param str filename: name of the file to be sent
+        :param bytes hash: hash of the file
+        :param handler: function called on the loop with hash and
+                        error info when the file was sent
+        """
+        self.loop.call_soon_threadsafe(
+            asyncio.ensure_future,
+            self._send(port, filename, hash, handler))
+
+    async def _send(self, port, filename, hash, handler):
+        """
+        copy a file to a server and call handlers of both ends.
+        """
+        error = None
+        receiver = None
+        try:
+            server = self.network.server(port)
+            with server.lock:
+                receiver = server.hashes.get(hash)
+            if receiver is None:
+                raise Dropped('hash is not registered')
+            await self._copy(filename, receiver[1], hash)
+        except Exception as e:
+            log.error('failed to send %s: %s', filename, e)
+            error = str(e)
+        if receiver is not None:
+            receiver[0](hash, error)
+        handler(hash, error)
+
+    async def _copy(self, filename, dir, hash):
+        """
+        copy a file into a temporary file, and rename it to the hex of
+        its hash when finished.
+        """
+        dest = os.path.join(dir, binascii.hexlify(hash).decode().upper())
+        (fd, tmp) = await run_blocking(tempfile.mkstemp, None, None, dir)
+        dst = os.fdopen(fd, 'wb')
+        try:
+            src = await run_blocking(open, filename, 'rb')
+            try:
+                while True:
+                    block = await run_blocking(src.read, BLOCK_SIZE)
+                    if not block:
+                        break
+                    await self.network.send(len(block))
+                    await run_blocking(dst.write, block)
+            finally:
+                src.close()
+            await run_blocking(dst.close)
+            await run_blocking(os.rename, tmp, dest)
+        except Exception:
+            dst.close()
+            await run_blocking(os.remove, tmp)
+            raise
+
+
+class UDPTransport(object):
+
+    """
+    class for using StorjTelehash and Storjutp from an event loop.
+    they run in their own threads, and call channel handlers and uTP
+    handlers of this process on the event loop.
+    """
+
+    def __init__(self):
+        """
+        init
+        """
+        self.loop = None
+
+    def telehash(self, port):
+        """
+        make a telehash node on the running event loop.
+
+        :param int port: port number to listen
+        :return: ThreadedTelehash instance
+        """
+        self.loop = asyncio.get_event_loop()
+        return ThreadedTelehash(StorjTelehash(port), self.loop)
+
+    def utp(self):
+        """
+        make a uTP server on the loop of the nodes.
+
+        :return: ThreadedUtp instance
+        """
+        return ThreadedUtp(Storjutp(), self.loop)
+
+
+def bridge(handler, loop):
+    """
+    wrap a channel handler with coroutine seq* methods into a
+    ChannelHandler whose seq* methods wait for them on the loop.
+
+    :param handler: channel handler
+    :param loop: event loop to run seq* methods
+    :return: ChannelHandler instance
+    """
+    def wrap(method):
+        def seq(self, packet):
+            return asyncio.run_coroutine_threadsafe(
+                call(method, packet), loop).result()
+        return seq
+
+    methods = dict((m.__name__, wrap(m)) for m in seq_methods(handler))
+    return type('Bridged' + type(handler).__name__, (ChannelHandler,),
+                methods)()
+
+
+class ThreadedTelehash(object):
+
+    """
+    class for using a StorjTelehash node from an event loop.
+    """
+
+    def __init__(self, node, loop):
+        self.node = node
+        self.loop = loop
+
+    def get_my_location(self):
+        return self.node.get_my_location()
+
+    def add_channel_handler(self, name, factory):
+        def bridged():
+            handler = factory()
+            if handler is None:
+                return None
+            return bridge(handler, self.loop)
+        self.node.add_channel_handler(name, bridged)
+
+    def open_channel(self, destination, name, handler):
+        self.node.open_channel(destination, name,
+                               bridge(handler, self.loop))
+
+
+class ThreadedUtp(object):
+
+    """
+    class for using a Storjutp server from an event loop.
+    """
+
+    def __init__(self, utp, loop):
+        self.utp = utp
+        self.loop = loop
+
+    def _wrap(self, handler):
+        return lambda hash, error: self.loop.call_soon_threadsafe(
+            handler, hash, error)
+
+    def get_serverport(self):
+        return self.utp.get_serverport()
+
+    def regist_hash(self, hash, handler, dir):
+        self.utp.regist_hash(hash, self._wrap(handler), dir)
+
+    def stop_hash(self, hash):
+        self.utp.stop_hash(hash)
+
+    def stop(self):
+        self.utp.stop()
+
+    def send_file(self, ip, port, filename, hash, handler):
+        self.utp.send_file(ip, port, filename, hash, self._wrap(handler))
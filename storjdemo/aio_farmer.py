@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+farmer running on an asyncio event loop.
+waiting for downloads doesn't block a thread, and hashing downloaded
+files and making proofs are run by storjdemo.aio.run_blocking() and
+the worker processes of the farmer if PROOF_WORKERS is set.
+global states, e.g. contracts, are shared with storjdemo.farmer.
+
+usage: python -m storjdemo.aio_farmer <destination>
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from storjdemo import aio
+from storjdemo import logger
+from storjdemo import farmer
+from storjdemo.farmer import Downloads
+from storjdemo.farmer import FarmerHandler
+from storjdemo.farmer import FarmerHeartbeatHandler
+
+log = logging.getLogger(__name__)
+
+transport = aio.UDPTransport()
+loop = None
+
+
+def set_transport(transport_):
+    """
+    set the factory of telehash nodes and uTP servers.
+
+    :param transport_: aio.UDPTransport or aio.LoopbackNetwork instance
+    """
+    global transport
+    transport = transport_
+    farmer.set_transport(transport_)
+
+
+def set_stop_flag(flag):
+    farmer.set_stop_flag(flag)
+
+
+class AsyncDownloads(Downloads):
+
+    """
+    Downloads which can be waited for on the loop.
+    finish() can be called from any thread.
+    """
+
+    def __init__(self, hashes, loop):
+        """
+        init
+
+        :param list hashes: hashes of files to be downloaded
+        :param loop: event loop of waiters
+        """
+        Downloads.__init__(self, hashes)
+        self.loop = loop
+        self.waiter = None
+
+    def finished(self):
+        """
+        :return: True if all downloads finished or any of them failed
+        """
+        with self.cond:
+            return not self.pending or bool(self.errors)
+
+    def finish(self, hash, error=None):
+        Downloads.finish(self, hash, error)
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done() and \
+                self.finished():
+            self.waiter.set_result(None)
+
+    async def wait_async(self, timeout):
+        """
+        wait for all downloads to finish or any of them to fail on the loop.
+        downloads not finished in time are marked as failed.
+
+        :param float timeout: seconds to wait
+        :return: dict of hex hash and error info of failed downloads.
+        """
+        if not self.finished():
+            self.waiter = self.loop.create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.wait(0)
+
+
+class AsyncFarmerHandler(FarmerHandler):
+
+    """
+    FarmerHandler with coroutine seq* methods.
+    """
+
+    def new_downloads(self, hashes):
+        return AsyncDownloads(hashes, loop)
+
+    async def seqAA_request(self, packet):
+        return FarmerHandler.seqAA_request(self, packet)
+
+    async def seqAB_accept_file(self, packet):
+        return FarmerHandler.seqAB_accept_file(self, packet)
+
+    async def seqAC_report_downloaded(self, packet):
+        await self.downloads.wait_async(farmer.DOWNLOAD_TIMEOUT)
+        return await aio.run_blocking(FarmerHandler.seqAC_report_downloaded,
+                                      self, packet)
+
+    async def seqAD_report_repaired(self, packet):
+        await self.repairs.wait_async(farmer.DOWNLOAD_TIMEOUT)
+        return await aio.run_blocking(FarmerHandler.seqAD_report_repaired,
+                                      self, packet)
+
+    def verify_later(self, hash, fname, downloads):
+        """
+        verify a downloaded file in the thread pool.
+        """
+        aio.run_blocking(self.verify_download, hash, fname, downloads,
+                         time.time())
+
+    def factory(self):
+        if len(self.get_contracts()):
+            return AsyncFarmerHeartbeatHandler(self.index)
+        return None
+
+
+class AsyncFarmerHeartbeatHandler(FarmerHeartbeatHandler):
+
+    """
+    FarmerHeartbeatHandler with coroutine seq* methods.
+    """
+
+    async def seqAA_make_proof(self, packet):
+        return await aio.run_blocking(FarmerHeartbeatHandler.seqAA_make_proof,
+                                      self, packet)
+
+    async def seqAB_get_result(self, packet):
+        return FarmerHeartbeatHandler.seqAB_get_result(self, packet)
+
+
+async def serve(destination):
+    """
+    run the farmer on the running loop until it is stopped.
+
+    :param str destination: telehash location of the uploader
+    :return: 0 if no error, otherwise 1
+    """
+    global loop
+
+    loop = asyncio.get_event_loop()
+    farmer.init(threads=False)
+    farmer.telehash = transport.telehash(-9999)
+    f = AsyncFarmerHandler(uploader=destination)
+    log.info('starting to open a farming channel at %s',
+             farmer.telehash.get_my_location())
+    farmer.telehash.open_channel(destination, 'farming', f)
+    log.info('starting to listen heartbeat channel')
+    farmer.telehash.add_channel_handler('heartbeat', f.factory)
+    await aio.wait_stop(farmer)
+    farmer.cleanup()
+
+    if farmer.status == farmer.ERROR:
+        log.error("something wrong")
+        return 1
+
+    return 0
+
+
+def main(destination):
+    """
+    start the farmer on a new event loop.
+
+    :param str destination: telehash location of the uploader
+    """
+    return aio.run(serve(destination))[0]
+
+if __name__ == '__main__':
+    logger.setup()
+    main(sys.argv[1])
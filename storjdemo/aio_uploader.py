@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+uploader running on an asyncio event loop.
+channels, uTP transfers and heartbeat timers of all contracts are handled
+on one loop, and Swizzle operations are run by storjdemo.aio.run_blocking()
+and the worker processes of the uploader if SWIZZLE_WORKERS is set.
+files to be sent wait for free slots in tasks on the loop.
+global states, e.g. the catalogue, are shared with storjdemo.uploader.
+
+usage: python -m storjdemo.aio_uploader [port [files...]]
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+
+from storjdemo import aio
+from storjdemo import logger
+from storjdemo import uploader
+from storjdemo.uploader import Contract
+from storjdemo.uploader import HeartbeatSession
+from storjdemo.uploader import UploaderHandler
+from storjdemo.uploader import UploaderHeartbeatHandler
+from storjdemo.logger import Hex, heartbeat_log
+
+log = logging.getLogger(__name__)
+
+transport = aio.UDPTransport()
+loop = None
+sessions = {}
+sessions_lock = threading.Lock()
+# timers of heartbeats and sessions, only used on the loop.
+timers = {}
+# slots of files sent at once, which are waited for on the loop.
+send_slots = None
+
+
+def set_transport(transport_):
+    """
+    set the factory of telehash nodes and uTP servers.
+
+    :param transport_: aio.UDPTransport or aio.LoopbackNetwork instance
+    """
+    global transport
+    transport = transport_
+    uploader.set_transport(transport_)
+
+
+def set_stop_flag(flag):
+    uploader.set_stop_flag(flag)
+
+
+def call_later(key, delay, func, *args):
+    """
+    call a function on the loop after delay seconds.
+    a call already scheduled with the same key is replaced.
+    this can be called from any thread.
+
+    :param key: key of the call, e.g. a contract
+    :param float delay: seconds to wait
+    :param func: function to be called
+    :param args: arguments of func
+    """
+    loop.call_soon_threadsafe(_call_later, key, delay, func, args)
+
+
+def _call_later(key, delay, func, args):
+    old = timers.pop(key, None)
+    if old is not None:
+        old.cancel()
+    timers[key] = loop.call_later(delay, _fire, key, func, args)
+
+
+def cancel(key):
+    """
+    cancel a call scheduled by call_later.
+    this can be called from any thread.
+
+    :param key: key of the call
+    """
+    loop.call_soon_threadsafe(_cancel, key)
+
+
+def _cancel(key):
+    old = timers.pop(key, None)
+    if old is not None:
+        old.cancel()
+
+
+def _fire(key, func, args):
+    timers.pop(key, None)
+    try:
+        func(*args)
+    except Exception:
+        log.exception('heartbeat job failed')
+
+
+class AsyncHeartbeatSession(HeartbeatSession):
+
+    """
+    HeartbeatSession opening channels with timers on the loop.
+    """
+
+    def call_later(self, key, delay, func, *args):
+        call_later(key, delay, func, *args)
+
+    def cancel(self, key):
+        cancel(key)
+
+    def handler(self, channel):
+        return AsyncUploaderHeartbeatHandler(self, channel)
+
+
+def get_session(destination):
+    """
+    get a heartbeat session for a farmer.
+
+    :param str destination: telehash destination of the farmer
+    :return: AsyncHeartbeatSession
+    """
+    with sessions_lock:
+        if destination not in sessions:
+            sessions[destination] = AsyncHeartbeatSession(destination)
+        return sessions[destination]
+
+
+class AsyncUploaderHandler(UploaderHandler):
+
+    """
+    UploaderHandler with coroutine seq* methods.
+    """
+
+    async def seqAA_accept_request(self, packet):
+        return await aio.run_blocking(UploaderHandler.seqAA_accept_request,
+                                      self, packet)
+
+    async def seqAB_send_file(self, packet):
+        return await aio.run_blocking(UploaderHandler.seqAB_send_file,
+                                      self, packet)
+
+    async def seqAC_first_heartbeat(self, packet):
+        return await aio.run_blocking(UploaderHandler.seqAC_first_heartbeat,
+                                      self, packet)
+
+    async def seqAD_first_heartbeat_after_repair(self, packet):
+        return await aio.run_blocking(
+            UploaderHandler.seqAD_first_heartbeat_after_repair, self, packet)
+
+    def call_later(self, key, delay, func, *args):
+        call_later(key, delay, func, *args)
+
+    def cancel(self, key):
+        cancel(key)
+
+    def send_file(self, utp, filename, hash, wait=None):
+        """
+        send a file in a task on the loop, which waits for a free slot
+        without blocking a thread. this can be called from any thread.
+        """
+        loop.call_soon_threadsafe(asyncio.ensure_future,
+                                  self.send_file_async(utp, filename, hash))
+
+    async def send_file_async(self, utp, filename, hash):
+        """
+        wait for a free slot and send a file.
+        a slot taken after the channel expired is given back at once.
+
+        :param utp: uTP server
+        :param str filename: name of the file to be sent
+        :param bytes hash: hash of the file
+        """
+        slots = send_slots
+        if slots is not None and slots.locked():
+            log.info('waiting for a slot to send %s...', Hex(hash))
+        if slots is not None:
+            await slots.acquire()
+        self.start_send(utp, filename, hash, slots)
+
+    def schedule_contract(self, contract):
+        get_session(self.destination).codec = self.codec
+        AsyncUploaderHeartbeatHandler.schedule_heartbeat(
+            uploader.FIRST_HEARTBEAT_DELAY, contract)
+
+
+class AsyncUploaderHeartbeatHandler(UploaderHeartbeatHandler):
+
+    """
+    UploaderHeartbeatHandler with coroutine seq* methods.
+    """
+
+    @classmethod
+    def schedule_heartbeat(cls, sl, contract):
+        session = get_session(contract.destination)
+        call_later(contract.key, sl, session.beat, contract)
+
+    async def seqAA_send_challenge(self, packet):
+        return await aio.run_blocking(
+            UploaderHeartbeatHandler.seqAA_send_challenge, self, packet)
+
+    async def seqAB_verify(self, packet):
+        return await aio.run_blocking(UploaderHeartbeatHandler.seqAB_verify,
+                                      self, packet)
+
+
+async def serve(port, files=None):
+    """
+    run the uploader on the running loop until it is stopped.
+
+    :param int port: port number to listen channels
+    :param list files: file names to be added to the catalogue
+    :return: 0 if no error, otherwise 1
+    """
+    global loop
+    global send_slots
+
+    loop = asyncio.get_event_loop()
+    uploader.init(files)
+    if uploader.MAX_SENDS is not None:
+        send_slots = asyncio.BoundedSemaphore(uploader.MAX_SENDS)
+    uploader.telehash = transport.telehash(port)
+    log.info('starting to listen a farming channel at %s',
+             uploader.telehash.get_my_location())
+    uploader.telehash.add_channel_handler('farming', AsyncUploaderHandler)
+    contracts = uploader.saved_contracts()
+    for (contract, codec, delay) in contracts:
+        get_session(contract.destination).codec = codec
+        AsyncUploaderHeartbeatHandler.schedule_heartbeat(delay, contract)
+    log.info('resumed %d contracts', len(contracts))
+    await aio.wait_stop(uploader)
+    for t in timers.values():
+        t.cancel()
+    timers.clear()
+    uploader.cleanup()
+
+    if uploader.status == uploader.ERROR:
+        log.error("something wrong")
+        return 1
+
+    return 0
+
+
+def main(port, files=None):
+    """
+    start the uploader on a new event loop.
+
+    :param int port: port number to listen channels
+    :param list files: file names to be added to the catalogue
+    """
+    return aio.run(serve(port, files))[0]
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        port = sys.argv[1]
+    else:
+        port = 9999
+    logger.setup()
+    main(port, sys.argv[2:])
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import binascii
+import errno
+import os
+import tempfile
+
+# number of levels of directories, and hex digits of each directory name.
+LEVELS = 2
+WIDTH = 2
+# directory of files being written or downloaded, under the root.
+TEMP_DIR = 'tmp'
+
+
+class BlobStore(object):
+
+    """
+    content-addressed store of files named by their hashes.
+    files are fanned out into directories named by prefixes of
+    their upper hex hashes, so that no directory gets too large, and
+    the path of a file is computed from its hash without listing any
+    directory.  files are written to the temporary directory first and
+    renamed into place, so that a file in the store is always complete.
+
+    >>> BlobStore('blobs').path(b'\\xab\\xcd\\xef')
+    'blobs/AB/CD/ABCDEF'
+
+    directories are made when files are added, not when a store is made.
+    """
+
+    def __init__(self, root):
+        """
+        init
+
+        :param str root: root directory of the store
+        """
+        self.root = root
+        self.dirs = set()
+
+    def name(self, hash):
+        """
+        :param bytes hash: hash of a file
+        :return: upper hex of the hash, which is the file name
+        """
+        return binascii.hexlify(hash).upper().decode()
+
+    def path(self, hash):
+        """
+        :param bytes hash: hash of a file
+        :return: path of the file in the store
+        """
+        name = self.name(hash)
+        dirs = [name[i * WIDTH:(i + 1) * WIDTH] for i in range(LEVELS)]
+        return os.path.join(self.root, *(dirs + [name]))
+
+    def exists(self, hash):
+        """
+        :param bytes hash: hash of a file
+        :return: True if the file is in the store
+        """
+        return os.path.exists(self.path(hash))
+
+    __contains__ = exists
+
+    def _makedirs(self, path):
+        """
+        make a directory and its parents unless they were made before.
+
+        :param str path: directory
+        """
+        if path in self.dirs:
+            return
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.dirs.add(path)
+
+    def tempdir(self):
+        """
+        :return: temporary directory ending with a separator,
+                 where files are written or downloaded before they are added
+        """
+        path = os.path.join(self.root, TEMP_DIR, '')
+        self._makedirs(path)
+        return path
+
+    def mkdtemp(self):
+        """
+        make a new directory in the temporary directory, so that
+        the same file can be downloaded by channels at the same time.
+
+        :return: the directory ending with a separator
+        """
+        return os.path.join(tempfile.mkdtemp(dir=self.tempdir()), '')
+
+    def temp_path(self, hash, dir=None):
+        """
+        :param bytes hash: hash of a file
+        :param str dir: directory made by mkdtemp(), tempdir() if None
+        :return: path of the file in the temporary directory,
+                 where uTP downloads it to
+        """
+        return os.path.join(dir or self.tempdir(), self.name(hash))
+
+    def add(self, hash, fname):
+        """
+        move a file into the store. the file must be on the same file
+        system as the store, e.g. in tempdir().
+
+        :param bytes hash: hash of the file
+        :param str fname: file to be moved
+        :return: path of the file in the store
+        """
+        path = self.path(hash)
+        self._makedirs(os.path.dirname(path))
+        os.rename(fname, path)
+        return path
+
+    def put(self, hash, data):
+        """
+        write data into the store.
+
+        :param bytes hash: hash of the data
+        :param bytes data: data to be written
+        :return: path of the file in the store
+        """
+        (fd, fname) = tempfile.mkstemp(dir=self.tempdir())
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            return self.add(hash, fname)
+        except Exception:
+            if os.path.exists(fname):
+                os.remove(fname)
+            raise
+
+    def open(self, hash):
+        """
+        :param bytes hash: hash of a file
+        :return: the file opened for reading in binary mode
+        """
+        return open(self.path(hash), 'rb')
+
+    def remove(self, hash):
+        """
+        remove a file from the store if it exists.
+
+        :param bytes hash: hash of a file
+        """
+        try:
+            os.remove(self.path(hash))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import time
+import sqlite3
+import threading
+
+
+class HeartbeatCache(object):
+
+    """
+    on-disk cache of a file hash, a tag hash, a heartbeat state and
+    hashes of chunks of a file.
+    an entry is keyed by path of a file and is valid only while size,
+    mtime and inode of the file are unchanged.  States can only be used
+    with the keys which encoded them, so entries are separated by
+    namespace, which should identify the heartbeat keys.
+    """
+
+    def __init__(self, path, max_entries=1024):
+        """
+        init
+
+        :param str path: sqlite database file, ':memory:' for no file
+        :param int max_entries: max number of entries before evicting
+                                least recently used ones
+        """
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'path TEXT, namespace TEXT, size INTEGER, mtime REAL, '
+            'inode INTEGER, file_hash BLOB, tag_hash BLOB, state TEXT, '
+            'leaves BLOB, atime REAL, PRIMARY KEY (path, namespace))')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)')
+        self.db.commit()
+
+    @staticmethod
+    def identity(filename):
+        """
+        get an identity of a file.
+
+        :param str filename: file name
+        :return: absolute path, size, mtime and inode of the file
+        """
+        st = os.stat(filename)
+        return (os.path.abspath(filename), st.st_size, st.st_mtime,
+                st.st_ino)
+
+    def get(self, filename, namespace=''):
+        """
+        look up an entry.
+
+        :param str filename: file name
+        :param str namespace: namespace of the entry
+        :return: file hash, tag hash, state and concatenated hashes of
+                 chunks, or None if not cached
+        """
+        (path, size, mtime, inode) = self.identity(filename)
+        with self.lock:
+            row = self.db.execute(
+                'SELECT size, mtime, inode, file_hash, tag_hash, state, '
+                'leaves FROM cache WHERE path=? AND namespace=?',
+                (path, namespace)).fetchone()
+            if row is None:
+                return None
+            if tuple(row[:3]) != (size, mtime, inode):
+                self.db.execute(
+                    'DELETE FROM cache WHERE path=? AND namespace=?',
+                    (path, namespace))
+                self.db.commit()
+                return None
+            self.db.execute(
+                'UPDATE cache SET atime=? WHERE path=? AND namespace=?',
+                (time.time(), path, namespace))
+            self.db.commit()
+        return (bytes(row[3]), bytes(row[4]), row[5], bytes(row[6]))
+
+    def put(self, filename, file_hash, tag_hash, state, leaves=b'',
+            namespace='', identity=None):
+        """
+        add an entry, and evict least recently used entries
+        if there are too many.
+        the identity of the file should be taken by identity() before
+        the file is read, so that the entry is not valid if the file was
+        changed while it was read.
+
+        :param str filename: file name
+        :param bytes file_hash: hash of the file
+        :param bytes tag_hash: hash of the heartbeat tag
+        :param str state: serialized heartbeat state
+        :param bytes leaves: concatenated hashes of chunks
+        :param str namespace: namespace of the entry
+        :param tuple identity: identity of the file, taken now if None
+        """
+        (path, size, mtime, inode) = identity or self.identity(filename)
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?,?,?,?,?,?,?,?,?,?)',
+                (path, namespace, size, mtime, inode,
+                 sqlite3.Binary(file_hash), sqlite3.Binary(tag_hash),
+                 state, sqlite3.Binary(leaves), time.time()))
+            self.db.execute(
+                'DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache '
+                'ORDER BY atime DESC, rowid DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
+            self.db.commit()
+
+    def invalidate(self, filename):
+        """
+        remove entries of a file in all namespaces.
+
+        :param str filename: file name
+        """
+        with self.lock:
+            self.db.execute('DELETE FROM cache WHERE path=?',
+                            (os.path.abspath(filename),))
+            self.db.commit()
+
+    def clear(self):
+        """
+        remove all entries.
+        """
+        with self.lock:
+            self.db.execute('DELETE FROM cache')
+            self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
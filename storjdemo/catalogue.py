@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import time
+import sqlite3
+import threading
+
+FIELDS = ('id', 'path', 'file_hash', 'tag_hash', 'state', 'leaves',
+          'namespace', 'assigned', 'placed')
+
+
+class Catalogue(object):
+
+    """
+    indexed catalogue of objects to be uploaded.
+    an object has its hash, tag hash, heartbeat state and hashes of chunks
+    once it is prepared, and farmers where it is placed.
+    objects are handed out in order of the number of farmers where they
+    are placed and then of hand-outs in flight, which are indexed, so that
+    unplaced objects come first. their sum, the number of copies, is kept
+    in a column and indexed too, so that objects being replicated are
+    found without scanning the catalogue.
+    hand-outs in flight are kept only while the catalogue is open, and an
+    object is never handed out to a farmer twice at the same time.
+    """
+
+    def __init__(self, path):
+        """
+        init
+
+        :param str path: sqlite database file, ':memory:' for no file
+        """
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS objects ('
+            'id INTEGER PRIMARY KEY, path TEXT UNIQUE, file_hash BLOB, '
+            'tag_hash BLOB, state TEXT, leaves BLOB, namespace TEXT, '
+            'assigned INTEGER DEFAULT 0, placed INTEGER DEFAULT 0, '
+            'copies INTEGER DEFAULT 0)')
+        try:
+            self.db.execute('ALTER TABLE objects ADD COLUMN '
+                            'copies INTEGER DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass
+        self.db.execute('DROP INDEX IF EXISTS objects_assigned')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS objects_placed '
+            'ON objects (placed, assigned, id)')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS objects_copies '
+            'ON objects (copies DESC, id)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS placements ('
+            'object INTEGER, farmer TEXT, time REAL, '
+            'PRIMARY KEY (object, farmer))')
+        for column in ('codec TEXT', 'due REAL'):
+            try:
+                self.db.execute('ALTER TABLE placements ADD COLUMN ' +
+                                column)
+            except sqlite3.OperationalError:
+                pass
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS placements_farmer '
+            'ON placements (farmer, object)')
+        self.db.execute(
+            'CREATE TEMP TABLE handouts ('
+            'object INTEGER, farmer TEXT, PRIMARY KEY (farmer, object))')
+        # hand-outs of the last run are not in flight any more.
+        self.db.execute('UPDATE objects SET assigned=0, copies=placed '
+                        'WHERE copies<>placed OR assigned<>0')
+        self.db.commit()
+
+    def _row(self, row):
+        """
+        convert a row to a dict.
+
+        :param tuple row: row of objects table
+        :return: dict of the row, None if row is None
+        """
+        if row is None:
+            return None
+        obj = dict(zip(FIELDS, row))
+        for k in ('file_hash', 'tag_hash', 'leaves'):
+            if obj[k] is not None:
+                obj[k] = bytes(obj[k])
+        return obj
+
+    def add(self, paths):
+        """
+        add objects. objects already in the catalogue are ignored.
+
+        :param list paths: file names of objects
+        """
+        with self.lock:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO objects (path) VALUES (?)',
+                ((os.path.abspath(p),) for p in paths))
+            self.db.commit()
+
+    def get(self, id):
+        """
+        get an object.
+
+        :param int id: id of the object
+        :return: dict of the object, None if not found
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT %s FROM objects WHERE id=?' % ','.join(FIELDS),
+                (id,)).fetchone()
+        return self._row(row)
+
+    def next_object(self, replicas=1, farmer=None):
+        """
+        hand out an object which is placed on fewest farmers, and which
+        is not placed on or being handed out to the farmer.
+        if replicas is more than 1, an object which is placed or being
+        handed out but on less than replicas farmers is handed out first,
+        so that it is placed on farmers at the same time.
+        an object already placed on the farmer is handed out again only
+        if no other object is left.
+        the hand-out is in flight until it is placed or released.
+
+        :param int replicas: number of farmers an object is placed on
+        :param str farmer: telehash location of the farmer
+        :return: dict of the object, None if no object can be handed out
+        """
+        on_farmer = 'id NOT IN (SELECT object FROM %s WHERE farmer=?)'
+        queries = []
+        if replicas > 1:
+            queries.append((
+                'WHERE copies>0 AND copies<? AND %s AND %s '
+                'ORDER BY copies DESC, id'
+                % (on_farmer % 'handouts', on_farmer % 'placements'),
+                (replicas, farmer, farmer)))
+        queries.append((
+            'WHERE %s AND %s ORDER BY placed, assigned, id'
+            % (on_farmer % 'handouts', on_farmer % 'placements'),
+            (farmer, farmer)))
+        queries.append((
+            'WHERE %s ORDER BY placed, assigned, id'
+            % (on_farmer % 'handouts'), (farmer,)))
+        with self.lock:
+            for (where, args) in queries:
+                row = self.db.execute(
+                    'SELECT %s FROM objects %s LIMIT 1'
+                    % (','.join(FIELDS), where), args).fetchone()
+                if row is not None:
+                    break
+            else:
+                return None
+            self.db.execute(
+                'INSERT INTO handouts (object, farmer) VALUES (?,?)',
+                (row[0], farmer))
+            self.db.execute(
+                'UPDATE objects SET assigned=assigned+1, copies=copies+1 '
+                'WHERE id=?',
+                (row[0],))
+            self.db.commit()
+        return self._row(row)
+
+    def _finish(self, id, farmer):
+        """
+        finish a hand-out in flight. called with the lock held.
+
+        :param int id: id of the object
+        :param str farmer: telehash location of the farmer
+        """
+        cur = self.db.execute(
+            'DELETE FROM handouts WHERE rowid IN (SELECT rowid FROM handouts '
+            'WHERE farmer IS ? AND object=? LIMIT 1)', (farmer, id))
+        if cur.rowcount:
+            self.db.execute(
+                'UPDATE objects SET assigned=assigned-1, copies=copies-1 '
+                'WHERE id=?', (id,))
+
+    def release(self, id, farmer=None):
+        """
+        take back an object that was handed out to a farmer but not placed.
+        an object which is not in flight is ignored.
+
+        :param int id: id of the object
+        :param str farmer: telehash location of the farmer
+        """
+        with self.lock:
+            self._finish(id, farmer)
+            self.db.commit()
+
+    def set_prepared(self, id, file_hash, tag_hash, state, leaves,
+                     namespace):
+        """
+        save results of preparing an object.
+
+        :param int id: id of the object
+        :param bytes file_hash: hash of the file
+        :param bytes tag_hash: hash of the heartbeat tag
+        :param str state: serialized heartbeat state
+        :param bytes leaves: concatenated hashes of chunks
+        :param str namespace: id of heartbeat keys which encoded it
+        """
+        with self.lock:
+            self.db.execute(
+                'UPDATE objects SET file_hash=?, tag_hash=?, state=?, '
+                'leaves=?, namespace=? WHERE id=?',
+                (sqlite3.Binary(file_hash), sqlite3.Binary(tag_hash), state,
+                 sqlite3.Binary(leaves), namespace, id))
+            self.db.commit()
+
+    def set_placed(self, id, farmer, codec=None, due=None):
+        """
+        record that an object was placed on a farmer, which finishes
+        the hand-out to the farmer.
+
+        :param int id: id of the object
+        :param str farmer: telehash location of the farmer
+        :param str codec: name of the codec of heartbeats
+        :param float due: time of the next heartbeat, None if not audited
+        """
+        with self.lock:
+            self._finish(id, farmer)
+            cur = self.db.execute(
+                'INSERT OR IGNORE INTO placements '
+                '(object, farmer, time, codec, due) VALUES (?,?,?,?,?)',
+                (id, farmer, time.time(), codec, due))
+            if cur.rowcount:
+                self.db.execute(
+                    'UPDATE objects SET placed=placed+1, copies=copies+1 '
+                    'WHERE id=?', (id,))
+            else:
+                self.db.execute(
+                    'UPDATE placements SET codec=?, due=? '
+                    'WHERE object=? AND farmer=?', (codec, due, id, farmer))
+            self.db.commit()
+
+    def set_due(self, dues):
+        """
+        save times of the next heartbeats of placed objects.
+
+        :param list dues: list of tuples of id of an object,
+                          telehash location of a farmer and
+                          time of the next heartbeat, None to stop auditing
+        """
+        with self.lock:
+            self.db.executemany(
+                'UPDATE placements SET due=? WHERE object=? AND farmer=?',
+                ((due, id, farmer) for (id, farmer, due) in dues))
+            self.db.commit()
+
+    def audited(self, namespace):
+        """
+        get placed objects which are audited, and whose heartbeat states
+        were made by heartbeat keys of namespace.
+
+        :param str namespace: id of heartbeat keys
+        :return: list of tuples of dict of the object,
+                 telehash location of the farmer, name of the codec and
+                 time of the next heartbeat
+        """
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT %s, p.farmer, p.codec, p.due FROM placements p '
+                'JOIN objects o ON o.id=p.object '
+                'WHERE p.due IS NOT NULL AND o.namespace=? ORDER BY p.due'
+                % ','.join('o.' + f for f in FIELDS),
+                (namespace,)).fetchall()
+        n = len(FIELDS)
+        return [(self._row(r[:n]),) + tuple(r[n:]) for r in rows]
+
+    def placements(self, id):
+        """
+        get farmers where an object is placed.
+
+        :param int id: id of the object
+        :return: list of telehash locations of farmers
+        """
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT farmer FROM placements WHERE object=? ORDER BY time',
+                (id,)).fetchall()
+        return [r[0] for r in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute(
+                'SELECT COUNT(*) FROM objects').fetchone()[0]
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import sqlite3
+import threading
+import time
+
+from heartbeat import Swizzle
+
+
+class ContractIndex(object):
+
+    """
+    index of contracts of a farmer.
+    a contract is keyed by telehash location of the uploader and a hash
+    of the file, and has paths of the tag and the file and the public
+    beat of the uploader.  it is also indexed by a hash of the tag,
+    which identifies the contract in heartbeats.
+    public beats are parsed once per uploader and shared by contracts.
+    """
+
+    def __init__(self, path):
+        """
+        init
+
+        :param str path: sqlite database file, ':memory:' for no file
+        """
+        self.lock = threading.Lock()
+        self.beats = {}
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS contracts ('
+            'uploader TEXT, file_hash BLOB, tag_hash BLOB, tag TEXT, '
+            'file TEXT, public_beat TEXT, time REAL, '
+            'PRIMARY KEY (uploader, file_hash))')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS contracts_tag_hash '
+            'ON contracts (tag_hash)')
+        self.db.commit()
+        self.count = self.db.execute(
+            'SELECT COUNT(*) FROM contracts').fetchone()[0]
+
+    def _file_info(self, row):
+        """
+        convert a row to a contract.
+
+        :param tuple row: uploader, file_hash, tag_hash, tag, file and
+                          public_beat of a row
+        :return: dict of the contract, None if row is None
+        """
+        if row is None:
+            return None
+        public_beat = self.beats.get(row[5])
+        if public_beat is None:
+            public_beat = Swizzle.Swizzle.fromdict(json.loads(row[5]))
+            self.beats[row[5]] = public_beat
+        return {'uploader': row[0], 'file_hash': bytes(row[1]),
+                'tag_hash': bytes(row[2]), 'tag': row[3], 'file': row[4],
+                'public_beat': public_beat}
+
+    def put(self, uploader, file_hash, tag_hash, tag, file, public_beat):
+        """
+        add a contract, or replace one with the same uploader and file.
+
+        :param str uploader: telehash location of the uploader
+        :param bytes file_hash: hash of the file
+        :param bytes tag_hash: hash of the tag
+        :param str tag: path of the tag
+        :param str file: path of the file
+        :param object public_beat: public heartbeat of the uploader
+        :return: dict of the contract
+        """
+        row = (uploader, sqlite3.Binary(file_hash),
+               sqlite3.Binary(tag_hash), tag, file,
+               json.dumps(public_beat.todict(), sort_keys=True))
+        with self.lock:
+            cur = self.db.execute(
+                'INSERT OR IGNORE INTO contracts VALUES (?,?,?,?,?,?,?)',
+                row + (time.time(),))
+            if cur.rowcount:
+                self.count += 1
+            else:
+                self.db.execute(
+                    'UPDATE contracts SET tag_hash=?, tag=?, file=?, '
+                    'public_beat=?, time=? WHERE uploader=? AND file_hash=?',
+                    row[2:] + (time.time(),) + row[:2])
+            self.db.commit()
+            return self._file_info(row)
+
+    def get(self, uploader, file_hash):
+        """
+        get a contract.
+
+        :param str uploader: telehash location of the uploader
+        :param bytes file_hash: hash of the file
+        :return: dict of the contract, None if not found
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT uploader, file_hash, tag_hash, tag, file, '
+                'public_beat FROM contracts WHERE uploader=? AND file_hash=?',
+                (uploader, sqlite3.Binary(file_hash))).fetchone()
+            return self._file_info(row)
+
+    def find(self, tag_hash):
+        """
+        get a contract by a hash of its tag.
+
+        :param bytes tag_hash: hash of the tag
+        :return: dict of the contract, None if not found
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT uploader, file_hash, tag_hash, tag, file, '
+                'public_beat FROM contracts WHERE tag_hash=? LIMIT 1',
+                (sqlite3.Binary(tag_hash),)).fetchone()
+            return self._file_info(row)
+
+    def clear(self):
+        """
+        remove all contracts.
+        """
+        with self.lock:
+            self.db.execute('DELETE FROM contracts')
+            self.db.commit()
+            self.count = 0
+
+    def close(self):
+        """
+        close the database.
+        """
+        with self.lock:
+            self.db.close()
+
+    def __len__(self):
+        return self.count
@@ -28,6 +28,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import functools
 import logging
 import json
 import base64
@@ -38,20 +39,56 @@ import hashlib  # For SHA-256 Encoding
 import binascii
 import os
 import os.path
+import shutil
+import threading
 
 from heartbeat import Swizzle
 from storj.messaging import ChannelHandler
-from storj.messaging import StorjTelehash
-from storjutp.storjutp import Storjutp
 
-log_fmt = '%(filename)s:%(lineno)d %(funcName)s() %(message)s'
-logging.basicConfig(level=logging.DEBUG, format=log_fmt)
+from storjdemo.stream import get_file_hash
+from storjdemo import merkle
+from storjdemo import proofcache
+from storjdemo.proofcache import ProofCache
+from storjdemo.workers import ProcessPool
+from storjdemo.workers import ThreadPool
+from storjdemo.blobstore import BlobStore
+from storjdemo.contracts import ContractIndex
+from storjdemo import wire
+from storjdemo import metrics
+from storjdemo import profiling
+from storjdemo.transport import UDPTransport
+from storjdemo import logger
+from storjdemo.logger import Hex, heartbeat_log
+
+log = logging.getLogger(__name__)
 
 ERROR = -1
-FINISHED = 99
+# seconds to wait for downloads to finish.
+DOWNLOAD_TIMEOUT = 3600
+# seconds between checks of the stop flag in main().
+POLL_INTERVAL = 10
+# root of the store of downloaded files and tags.
 # Never be '.' if farmer.py and uploader.py run simultaneously.
 DOWNLOAD_PATH = './download/'
+# directory under the temporary directory of a channel, where chunks
+# to repair a broken download are saved.
+CHUNK_DIR = 'chunks'
+CONTRACTS_PATH = 'contracts.db'
+# number of processes to make proofs, 0 to make them in channel threads.
+PROOF_WORKERS = 0
+# number of threads to verify downloaded files,
+# 0 to verify them in the thread of uTP which finished downloading.
+VERIFY_WORKERS = 4
+# max number of downloaded files waiting to be verified.
+VERIFY_QUEUE = 256
+# makes telehash nodes and uTP servers, see set_transport().
+transport = UDPTransport()
 telehash = None
+blobs = BlobStore(DOWNLOAD_PATH)
+proof_cache = ProofCache()
+proof_pool = None
+verify_pool = None
+contracts = ContractIndex(':memory:')
 status = 0
 stop = False
 
@@ -68,6 +105,59 @@ def get_hash(f):
     return sha
 
 
+class Downloads(object):
+
+    """
+    class for waiting downloads to finish.
+    """
+
+    def __init__(self, hashes):
+        """
+        init
+
+        :param list hashes: hashes of files to be downloaded
+        """
+        self.cond = threading.Condition()
+        self.hashes = set(hashes)
+        self.pending = set(hashes)
+        self.errors = {}
+
+    def finish(self, hash, error=None):
+        """
+        mark a download as finished and wake up waiters.
+
+        :param bytes hash: hash of the downloaded file
+        :param str error: error info, None if no error.
+        """
+        with self.cond:
+            self.pending.discard(hash)
+            if error is not None:
+                self.errors[hash] = error
+            self.cond.notify_all()
+
+    def wait(self, timeout):
+        """
+        wait for all downloads to finish or any of them to fail.
+        downloads not finished in time are marked as failed.
+
+        :param float timeout: seconds to wait
+        :return: dict of hex hash and error info of failed downloads.
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.pending and not self.errors:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    for h in self.pending:
+                        self.errors[h] = 'timeout'
+                    break
+                self.cond.wait(remaining)
+            return dict((binascii.hexlify(h).upper().decode(), e)
+                        for (h, e) in self.errors.items())
+
+
+@metrics.instrument
+@profiling.instrument
 class FarmerHandler(ChannelHandler):
 
     """
@@ -75,24 +165,37 @@ class FarmerHandler(ChannelHandler):
     for farming.
     """
 
-    def __init__(self):
+    def __init__(self, node=None, uploader=None, store=None, index=None):
         """
         init
+
+        :param node: telehash node of this farmer, the module telehash
+                     if None.
+        :param str uploader: telehash location of the uploader, which
+                             identifies contracts with hashes of files.
+        :param BlobStore store: store of downloaded files, the module blobs
+                                if None.
+        :param ContractIndex index: index of contracts, the module
+                                    contracts if None.
         """
         ChannelHandler.__init__(self)
-        self.file_info = {}
+        self.node = node
+        self.uploader = uploader or ''
+        self.store = store
+        self.index = index
 
     def seqAA_request(self, packet):
         """
-        request a file. send a telehash location.
+        request a file. send a telehash location and codecs supported
+        for following packets.
 
         :param str packet: recieved packet, None due to opening.
         :return: telehash location
         """
-        global telehash
-        logging.info("requesting a file...")
+        log.info("requesting a file...")
         rpacket = {}
-        rpacket['telehash_location'] = telehash.get_my_location()
+        rpacket['telehash_location'] = self.get_node().get_my_location()
+        rpacket['codecs'] = wire.SUPPORTED
         return json.dumps(rpacket)
 
     def seqAB_accept_file(self, packet):
@@ -100,137 +203,412 @@ class FarmerHandler(ChannelHandler):
         accept a file information.
         register file hash, tag hash for heartbeat, and send acceptable
         utp ip address and port number, and start downloading.
-
-        :param str packet: recieved packet, including hash of file and
-                           hash of heartbeat tag.
+        the file and the tag which are already in the store are not
+        downloaded again, and told to the uploader not to be sent.
+        if hashes of chunks of the file are informed, they are used to
+        verify the file chunk by chunk.
+
+        :param str packet: recieved packet, including hash of file,
+                           hash of heartbeat tag, and Merkle root and
+                           hashes of chunks of the file.
         :return: json str, including utp ip address and
-                  utp port.
+                  utp port, and hashes of the file and the tag
+                  which are already stored.
         """
-        logging.info("accepting file hashes...")
+        log.info("accepting file hashes...")
         rpacket = {}
 
-        p = json.loads(packet)
-        self.file_finished = 0
-        self.file_hash = binascii.unhexlify(p['file_hash'])
-        self.tag_hash = binascii.unhexlify(p['tag_hash'])
-        logging.info('accepting file %s and tag_hash %s'
-                     % (self.file_hash, self.tag_hash))
-        self.utp = Storjutp()
-        self.utp.regist_hash(self.file_hash, self.handler, DOWNLOAD_PATH)
-        self.utp.regist_hash(self.tag_hash, self.handler, DOWNLOAD_PATH)
-        loc = json.loads(telehash.get_my_location())
+        self.codec = wire.detect(packet)
+        p = self.codec.loads(packet)
+        self.file_hash = self.codec.unhash(p['file_hash'])
+        self.tag_hash = self.codec.unhash(p['tag_hash'])
+        log.debug('accepting file %s and tag_hash %s',
+                  Hex(self.file_hash), Hex(self.tag_hash))
+        self.leaves = None
+        self.bad_chunks = []
+        self.repairs = None
+        self.verified = set()
+        if 'chunks' in p:
+            leaves = merkle.unpack_leaves(self.codec.unblob(p['chunks']))
+            root = self.codec.unhash(p['merkle_root'])
+            if merkle.merkle_root(leaves) == root:
+                self.leaves = leaves
+                self.file_size = p['file_size']
+                self.chunk_size = p['chunk_size']
+            else:
+                log.error("hashes of chunks don't match Merkle root...")
+        self.have = set(h for h in (self.file_hash, self.tag_hash)
+                        if self.get_blobs().exists(h))
+        if self.have:
+            log.info("already have %d of file and tag...", len(self.have))
+        missing = [h for h in (self.file_hash, self.tag_hash)
+                   if h not in self.have]
+        self.downloads = self.new_downloads(missing)
+        self.utp = transport.utp()
+        self.tmp = self.get_blobs().mkdtemp()
+        for h in missing:
+            self.utp.regist_hash(h, self.handler, self.tmp)
+        loc = json.loads(self.get_node().get_my_location())
         rpacket['utp_ip'] = loc['paths'][0]['ip']
         rpacket['utp_port'] = self.utp.get_serverport()
-        return json.dumps(rpacket)
+        rpacket['have'] = [self.codec.hash(h) for h in self.have]
+        return self.codec.dumps(rpacket)
 
     def seqAC_report_downloaded(self, packet):
         """
         wait finishing it and report of finishing it.
+        if some chunks of the file are broken, register hashes of them
+        to download them again.
 
         :param str packet: recieved packet, including public beat
-        :return: json str, only including success or not
+        :return: json str, including success or not, errors of
+                 failed downloads and indices of broken chunks.
         """
-        logging.info("reoprt that downloaded a file...")
+        log.info("reoprt that downloaded a file...")
         rpacket = {}
-        p = json.loads(packet)
-        public_beat = Swizzle.Swizzle.fromdict(p['public_beat'])
-        while self.file_finished != FINISHED and\
-                self.file_finished != ERROR:
-            time.sleep(1)
-        logging.info("finished downloading...")
-        self.utp.stop_hash(self.file_hash)
-        self.utp.stop_hash(self.tag_hash)
-        if self.file_finished == FINISHED:
-            self.file_info['public_beat'] = public_beat
-            self.file_info['tag'] = DOWNLOAD_PATH +\
-                binascii.hexlify(self.tag_hash).decode().upper()
-            self.file_info['file'] = DOWNLOAD_PATH +\
-                binascii.hexlify(self.file_hash).decode().upper()
-            return '{"success":1}'
-        return '{"success":0}'
+        p = self.codec.loads(packet)
+        self.public_beat = self.codec.unswizzle(Swizzle.Swizzle,
+                                                p['public_beat'])
+        errors = self.downloads.wait(DOWNLOAD_TIMEOUT)
+        log.info("finished downloading...")
+        for h in self.downloads.hashes:
+            self.utp.stop_hash(h)
+        if not errors and not self.bad_chunks:
+            errors = self.accept_contract()
+            if not errors:
+                self.utp.stop()
+                return self.codec.dumps({'success': 1})
+        for (h, e) in errors.items():
+            log.error('failed to download %s: %s', h, e)
+        rpacket['success'] = 0
+        rpacket['errors'] = errors
+        if errors:
+            self.utp.stop()
+            shutil.rmtree(self.tmp, ignore_errors=True)
+        else:
+            log.info("requesting %d broken chunks...",
+                     len(self.bad_chunks))
+            hashes = set(self.leaves[i] for i in self.bad_chunks)
+            self.repairs = self.new_downloads(hashes)
+            chunks = os.path.join(self.tmp, CHUNK_DIR, '')
+            os.mkdir(chunks)
+            for h in hashes:
+                self.utp.regist_hash(h, self.handler, chunks)
+            rpacket['bad_chunks'] = self.bad_chunks
+        return self.codec.dumps(rpacket)
+
+    def seqAD_report_repaired(self, packet):
+        """
+        wait finishing downloading broken chunks, write them into the file
+        and report of finishing it.
+
+        :param str packet: recieved packet, including indices of chunks
+                           that were sent again.
+        :return: json str, including success or not and errors of
+                 failed downloads.
+        """
+        log.info("report that repaired a file...")
+        rpacket = {}
+        p = self.codec.loads(packet)
+        errors = self.repairs.wait(DOWNLOAD_TIMEOUT)
+        for h in self.repairs.hashes:
+            self.utp.stop_hash(h)
+        self.utp.stop()
+        resent = set(p['resent'])
+        if not errors and resent.issuperset(self.bad_chunks):
+            self.repair(self.bad_chunks)
+            errors = self.accept_contract()
+            if not errors:
+                return self.codec.dumps({'success': 1})
+        for (h, e) in errors.items():
+            log.error('failed to download chunk %s: %s', h, e)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        rpacket['success'] = 0
+        rpacket['errors'] = errors
+        return self.codec.dumps(rpacket)
+
+    def new_downloads(self, hashes):
+        """
+        make an object for waiting downloads to finish.
+
+        :param list hashes: hashes of files to be downloaded
+        :return: Downloads instance
+        """
+        return Downloads(hashes)
+
+    def get_node(self):
+        """
+        get telehash node of this farmer.
+
+        :return: telehash node
+        """
+        if self.node is not None:
+            return self.node
+        return telehash
+
+    def get_blobs(self):
+        """
+        get the store of downloaded files of this farmer.
+
+        :return: BlobStore
+        """
+        if self.store is not None:
+            return self.store
+        return blobs
+
+    def get_contracts(self):
+        """
+        get the index of contracts of this farmer.
+
+        :return: ContractIndex
+        """
+        if self.index is not None:
+            return self.index
+        return contracts
+
+    def accept_contract(self):
+        """
+        move the downloaded file and tag into the store, and
+        save the contract in the index for heartbeat.
+        nothing is stored if any of them does not match its hash.
+
+        :return: dict of hex hash and error info of files which
+                 do not match their hashes.
+        """
+        errors = dict((binascii.hexlify(h).upper().decode(), 'corrupted')
+                      for h in (self.tag_hash, self.file_hash)
+                      if h not in self.have and h not in self.verified)
+        if errors:
+            log.error("downloaded files don't match their hashes...")
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            return errors
+        store = self.get_blobs()
+        (tag, file) = [store.path(h) if h in self.have
+                       else store.add(h, store.temp_path(h, self.tmp))
+                       for h in (self.tag_hash, self.file_hash)]
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.get_contracts().put(self.uploader, self.file_hash,
+                                 self.tag_hash, tag, file, self.public_beat)
+        return {}
+
+    def verify_chunks(self, fname):
+        """
+        verify a downloaded file chunk by chunk, and cut off extra bytes.
+        the whole file is hashed in the same pass.
+
+        :param str fname: downloaded file name
+        :return: list of indices of broken chunks and a hash of the file
+        """
+        digest = hashlib.sha256()
+        with open(fname, 'r+b') as f:
+            bad = merkle.verify_chunks(f, self.leaves, self.file_size,
+                                       self.chunk_size, digest)
+            if os.path.getsize(fname) > self.file_size:
+                f.truncate(self.file_size)
+        return (bad, digest.digest())
+
+    def repair(self, indices):
+        """
+        write downloaded chunks into the file, and hash the file again.
+
+        :param list indices: indices of chunks to be written
+        """
+        fname = self.get_blobs().temp_path(self.file_hash, self.tmp)
+        with open(fname, 'r+b') as f:
+            for i in indices:
+                with open(self.chunk_path(self.leaves[i]), 'rb') as c:
+                    f.seek(i * self.chunk_size)
+                    f.write(c.read())
+            f.truncate(self.file_size)
+        shutil.rmtree(os.path.join(self.tmp, CHUNK_DIR), ignore_errors=True)
+        if get_file_hash(fname) == self.file_hash:
+            self.verified.add(self.file_hash)
+
+    def chunk_path(self, hash):
+        """
+        :param bytes hash: hash of a chunk
+        :return: path of the chunk downloaded to repair the file,
+                 in the temporary directory of this channel.
+        """
+        return self.get_blobs().temp_path(
+            hash, os.path.join(self.tmp, CHUNK_DIR))
 
     def handler(self, hash, error):
         """
         handler when finishng downloading.
-        check a file hash is same as one informed from uploader.
+        the file is verified by verify_later(), so that the thread of uTP
+        is not blocked by hashing.
 
         :param byte hash: file hash that was finished downloading.
         :param str err: error info , None if no error.
         """
+        if self.repairs is not None and hash in self.repairs.hashes:
+            # the only chunk of a small file has the hash of the file.
+            downloads = self.repairs
+            fname = self.chunk_path(hash)
+        else:
+            downloads = self.downloads
+            fname = self.get_blobs().temp_path(hash, self.tmp)
         if error is not None:
-            logging.error("downloaded failed..." + error)
+            log.error("downloaded failed...%s", error)
+            downloads.finish(hash, error)
+            return
+        self.verify_later(hash, fname, downloads)
+
+    def verify_later(self, hash, fname, downloads):
+        """
+        verify a downloaded file in verify_pool if it is set,
+        otherwise in the calling thread.
+
+        :param byte hash: file hash that was finished downloading.
+        :param str fname: downloaded file name
+        :param Downloads downloads: downloads which the file belongs to
+        """
+        if verify_pool is not None:
+            verify_pool.submit(self.verify_download, hash, fname, downloads,
+                               time.time())
         else:
-            fname = DOWNLOAD_PATH + binascii.hexlify(hash).upper().decode()
-            with open(fname, 'rb') as f:
-                b = f.read()
-                hash_ = get_hash(b)
-            if hash_ != hash:
-                logging.error("downloaded file is corrupted...")
-                self.file_finished = ERROR
-                return
-            self.file_finished += 1
-            if self.file_finished < 2:
+            self.verify_download(hash, fname, downloads)
+
+    @metrics.timed('download_check')
+    def verify_download(self, hash, fname, downloads, queued=None):
+        """
+        check a file hash is same as one informed from uploader.
+        if hashes of chunks of the file were informed, check them instead
+        and remember broken chunks.
+
+        :param byte hash: file hash that was finished downloading.
+        :param str fname: downloaded file name
+        :param Downloads downloads: downloads which the file belongs to
+        :param float queued: time when it was queued, None if not queued
+        """
+        if queued is not None:
+            metrics.observe_stage('verify_queue', time.time() - queued)
+        try:
+            if metrics.enabled:
+                metrics.count_bytes('utp', 'received',
+                                    os.path.getsize(fname))
+            if hash == self.file_hash and self.leaves is not None:
+                (bad, digest) = self.verify_chunks(fname)
+                if bad:
+                    log.error("%d chunks of downloaded file are broken...",
+                              len(bad))
+                    self.bad_chunks = bad
+                elif digest != hash:
+                    log.error("downloaded file is corrupted...")
+                    downloads.finish(hash, 'corrupted')
+                    return
+                else:
+                    self.verified.add(hash)
+            elif get_file_hash(fname) != hash:
+                log.error("downloaded file is corrupted...")
+                downloads.finish(hash, 'corrupted')
                 return
-            self.file_finished = FINISHED
+            else:
+                self.verified.add(hash)
+        except Exception as e:
+            log.exception("failed to verify downloaded file...")
+            downloads.finish(hash, str(e))
+            return
+        downloads.finish(hash)
 
     def factory(self):
         """
         factory for accepting a heart beat channel.
         """
-        if self.file_info != {}:
-            return FarmerHeartbeatHandler(self.file_info)
+        if len(self.get_contracts()):
+            return FarmerHeartbeatHandler(self.index)
         return None
 
 
+@metrics.instrument
+@profiling.instrument
 class FarmerHeartbeatHandler(ChannelHandler):
 
     """
     class for accepting heartbeat channel.
+    a channel can be used for any contract, which is told by
+    the challenge packet.
     """
 
-    def __init__(self, file_info):
+    def __init__(self, index=None):
         """
         init
+
+        :param ContractIndex index: index of contracts, the module
+                                    contracts if None.
         """
         ChannelHandler.__init__(self)
-        self.file_info = file_info
-        pass
+        self.index = index
 
-    def seqAA_make_proof(self, packet):
+    def get_contracts(self):
         """
-        make a proof.
-        accept chanlleng, make a tag from the downloaded file, and make
-        a proof.
+        get the index of contracts of this farmer.
 
-        :param str packet: received json str, including challenge.
-        :return: return json str, including proof
+        :return: ContractIndex
         """
-        logging.info("making proof...")
-        rpacket = {}
-        p = json.loads(packet)
-        cha = Swizzle.Swizzle.challenge_type().fromdict(p['challenge'])
-        with open(self.file_info['tag'], 'rb') as file:
-            decoded = base64.b64encode(file.read()).decode('ascii')
-        tag = Swizzle.Swizzle.tag_type().fromdict(decoded)
-        with open(self.file_info['file'], 'rb') as file:
-            proof = self.file_info['public_beat'].prove(file, cha, tag)
-        rpacket['proof'] = proof.todict()
-        return json.dumps(rpacket)
+        if self.index is not None:
+            return self.index
+        return contracts
+
+    def seqAA_make_proof(self, packet):
+        """
+        make proofs.
+        accept chanllenges of contracts, and make proofs from
+        the downloaded files and their tags, which are kept open and
+        parsed in proof_cache.
+        if proof_pool is set, the proofs are made in worker processes.
+
+        :param str packet: received json str, including challenges keyed
+                           by contracts.
+        :return: return json str, including proofs keyed by contracts,
+                 which are None for unknown contracts.
+        """
+        heartbeat_log.info("making proof...")
+        rpacket = {'proofs': {}}
+        codec = wire.detect(packet)
+        p = codec.loads(packet)
+        keys = []
+        argss = []
+        for (k, c) in p['challenges'].items():
+            tag_hash = codec.unhash(k)
+            file_info = self.get_contracts().find(tag_hash)
+            if file_info is None:
+                heartbeat_log.error("unknown contract %s...", Hex(tag_hash))
+                rpacket['proofs'][k] = None
+                continue
+            cha = codec.unswizzle(Swizzle.Swizzle.challenge_type(), c)
+            keys.append(k)
+            argss.append((file_info, cha))
+        start = time.time()
+        if proof_pool is not None:
+            proofs = proof_pool.map(proofcache.prove_in_worker, argss)
+        else:
+            proofs = [proof_cache.prove(*args) for args in argss]
+        metrics.observe_stage('prove', time.time() - start)
+        for (k, proof) in zip(keys, proofs):
+            rpacket['proofs'][k] = codec.swizzle(proof)
+        return codec.dumps(rpacket)
 
     def seqAB_get_result(self, packet):
         """
-        receive a verification result.
+        receive verification results.
 
-        :param str packet: received json str, including verification result.
+        :param str packet: received json str, including verification
+                           results keyed by contracts.
         :return: None to close channel.
         """
-        logging.info("receiving result...")
-        p = json.loads(packet)
-        if not p['valid']:
-            logging.info("proof failed...")
-            status = ERROR
-        else:
-            logging.info("proof succeed....")
+        heartbeat_log.info("receiving result...")
+        codec = wire.detect(packet)
+        p = codec.loads(packet)
+        for (k, valid) in p['results'].items():
+            k = wire.JSON.hash(codec.unhash(k))
+            metrics.count_heartbeat('farmer', valid)
+            if not valid:
+                heartbeat_log.error("proof of %s failed...", k)
+                status = ERROR
+            else:
+                heartbeat_log.info("proof of %s succeed....", k)
         return None
 
 
@@ -239,30 +617,98 @@ def set_stop_flag(flag):
     stop = flag
 
 
-def main(destination):
-    global telehash
-    global stop
-    global status
+def set_transport(transport_):
+    """
+    set the factory of telehash nodes and uTP servers.
+
+    :param transport_: UDPTransport or storjdemo.loopback.Network instance
+    """
+    global transport
+    transport = transport_
+
 
+def proof_cache_stat(cache, name):
+    """
+    get a counter of proof_cache for metrics.
+    proofs made in proof_pool are not counted.
+
+    :param str cache: 'tags' or 'files'
+    :param str name: name of the counter, e.g. 'hits'
+    :return: value of the counter
+    """
+    return proof_cache.stats()[cache][name]
+
+
+def init(threads=True):
+    """
+    make the worker pools, the store and directories for downloads,
+    and open the contract index.
+
+    :param bool threads: False not to make verify_pool, e.g. when files
+                         are verified in the thread pool of asyncio.
+    """
+    global blobs
+    global contracts
+    global proof_pool
+    global verify_pool
+
+    metrics.setup()
+    profiling.setup()
+    if PROOF_WORKERS > 0:
+        proof_pool = ProcessPool(PROOF_WORKERS, proofcache.init_worker)
+    if threads and VERIFY_WORKERS > 0 and verify_pool is None:
+        verify_pool = ThreadPool(VERIFY_WORKERS, VERIFY_QUEUE)
+        metrics.queue_depth.set_function(verify_pool.depth, 'verify')
+    for cache in ('tags', 'files'):
+        for result in ('hits', 'misses'):
+            metrics.cache_lookups.set_function(
+                functools.partial(proof_cache_stat, cache, result),
+                'proof_' + cache, result)
     if not os.path.exists(DOWNLOAD_PATH):
         os.mkdir(DOWNLOAD_PATH)
-    telehash = StorjTelehash(-9999)
+    blobs = BlobStore(DOWNLOAD_PATH)
+    contracts = ContractIndex(CONTRACTS_PATH)
+
+
+def cleanup():
+    """
+    close the worker pools, and write profiles if profiling.
+    """
+    global proof_pool
+    global verify_pool
+
+    profiling.report()
+    if proof_pool is not None:
+        proof_pool.close()
+        proof_pool = None
+    if verify_pool is not None:
+        verify_pool.close()
+        verify_pool = None
+
+
+def main(destination):
+    global telehash
+
+    init()
+    telehash = transport.telehash(-9999)
 
-    f = FarmerHandler()
-    logging.info('starting to open a farming channel at ' +
-                 telehash.get_my_location())
+    f = FarmerHandler(uploader=destination)
+    log.info('starting to open a farming channel at %s',
+             telehash.get_my_location())
     telehash.open_channel(destination, 'farming', f)
-    logging.info('starting to listen heartbeat channel')
+    log.info('starting to listen heartbeat channel')
     telehash.add_channel_handler('heartbeat', f.factory)
 
     while status == 0 and not stop:
-        time.sleep(10)
+        time.sleep(POLL_INTERVAL)
+    cleanup()
 
     if status == ERROR:
-        logging.error("something wrong")
+        log.error("something wrong")
         return 1
 
     return 0
 
 if __name__ == '__main__':
+    logger.setup()
     main(sys.argv[1])
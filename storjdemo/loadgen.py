@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+load generator simulating many farmers against one uploader.
+
+farmers are FarmerHandlers on their own telehash nodes in this process,
+each storing files and contracts in its own directory.
+they open farming channels at --rate per second, download files and
+answer heartbeats.  while running, a json line is printed every
+--sample seconds with CPU and memory of the uploader, and a summary
+with latency percentiles and heartbeat success rate is printed at the end.
+
+by default the uploader runs in this process over the loopback network,
+so CPU and memory are of the whole process.  with --uploader, farmers
+connect to a real uploader over UDP, and --pid tells which process to
+watch.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from storjdemo import farmer
+from storjdemo import uploader
+from storjdemo import loopback
+from storjdemo import wire
+from storjdemo import profiling
+from storjdemo import logger
+from storjdemo.blobstore import BlobStore
+from storjdemo.contracts import ContractIndex
+from storjdemo.transport import UDPTransport
+
+UPLOADER_PORT = 9999
+
+
+def percentiles(values, ps=(0.5, 0.9, 0.99)):
+    """
+    get percentiles of values.
+
+    >>> sorted(percentiles([3, 1, 2, 4], (0.5, 0.99)).items())
+    [('p50', 3), ('p99', 4)]
+
+    :param list values: list of numbers
+    :param tuple ps: percentiles between 0 and 1
+    :return: dict of percentiles named like p50, empty if no value
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+    n = len(values)
+    return dict(('p%g' % (p * 100), values[min(n - 1, int(p * n))])
+                for p in ps)
+
+
+class Stats(object):
+
+    """
+    class for counting results of simulated farmers.
+    """
+
+    def __init__(self):
+        """
+        init
+        """
+        self.lock = threading.Lock()
+        self.started = 0
+        self.placed = 0
+        self.farming = []
+        self.heartbeats = []
+        self.valid = 0
+        self.failed = 0
+
+    def start(self):
+        with self.lock:
+            self.started += 1
+
+    def place(self, secs):
+        with self.lock:
+            self.placed += 1
+            self.farming.append(secs)
+
+    def beat(self, secs, results):
+        with self.lock:
+            self.heartbeats.append(secs)
+            for valid in results:
+                if valid:
+                    self.valid += 1
+                else:
+                    self.failed += 1
+
+    def summary(self):
+        """
+        get counters and latency percentiles.
+
+        :return: dict
+        """
+        with self.lock:
+            total = self.valid + self.failed
+            return {
+                'farmers': self.started,
+                'placed': self.placed,
+                'farming_latency': percentiles(self.farming),
+                'heartbeat_latency': percentiles(self.heartbeats),
+                'heartbeats': total,
+                'heartbeat_success': self.valid / float(total)
+                if total else None,
+            }
+
+
+stats = Stats()
+
+
+class LoadFarmerHandler(farmer.FarmerHandler):
+
+    """
+    FarmerHandler measuring time from requesting a file to
+    accepting the contract.
+    """
+
+    def seqAA_request(self, packet):
+        stats.start()
+        self.started = time.time()
+        return farmer.FarmerHandler.seqAA_request(self, packet)
+
+    def accept_contract(self):
+        errors = farmer.FarmerHandler.accept_contract(self)
+        if not errors:
+            stats.place(time.time() - self.started)
+        return errors
+
+    def factory(self):
+        if len(self.get_contracts()):
+            return LoadHeartbeatHandler(self.index)
+        return None
+
+
+class LoadHeartbeatHandler(farmer.FarmerHeartbeatHandler):
+
+    """
+    FarmerHeartbeatHandler measuring time from receiving challenges
+    to receiving their results.
+    """
+
+    def seqAA_make_proof(self, packet):
+        self.started = time.time()
+        return farmer.FarmerHeartbeatHandler.seqAA_make_proof(self, packet)
+
+    def seqAB_get_result(self, packet):
+        codec = wire.detect(packet)
+        results = codec.loads(packet)['results'].values()
+        stats.beat(time.time() - self.started, results)
+        return farmer.FarmerHeartbeatHandler.seqAB_get_result(self, packet)
+
+
+def usage(pid):
+    """
+    get CPU seconds and resident memory of a process.
+
+    :param int pid: process id
+    :return: tuple of CPU seconds and bytes, bytes is None if unknown
+    """
+    if psutil is not None:
+        p = psutil.Process(pid)
+        t = p.cpu_times()
+        return (t.user + t.system, p.memory_info().rss)
+    if os.path.exists('/proc/%d/stat' % pid):
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        with open('/proc/%d/statm' % pid) as f:
+            pages = int(f.read().split()[1])
+        return ((int(fields[11]) + int(fields[12])) / float(ticks),
+                pages * os.sysconf('SC_PAGE_SIZE'))
+    if pid == os.getpid():
+        t = os.times()
+        return (t[0] + t[1], None)
+    raise ValueError('cannot watch process %d without psutil' % pid)
+
+
+def sample(pid, interval, out, done):
+    """
+    print CPU and memory of a process every interval seconds.
+
+    :param int pid: process id
+    :param float interval: seconds between samples
+    :param out: file to write json lines to
+    :param threading.Event done: set to stop sampling
+    """
+    start = time.time()
+    (last_cpu, rss) = usage(pid)
+    last = start
+    while not done.wait(interval):
+        (cpu, rss) = usage(pid)
+        now = time.time()
+        line = {'type': 'sample', 'time': now - start,
+                'cpu_percent': 100 * (cpu - last_cpu) / (now - last),
+                'rss': rss}
+        line.update(stats.summary())
+        out.write(json.dumps(line, sort_keys=True) + '\n')
+        out.flush()
+        (last_cpu, last) = (cpu, now)
+
+
+def start_uploader(net, args):
+    """
+    run an uploader in this process over a loopback network.
+
+    :return: tuple of location of the uploader and its thread
+    """
+    files = []
+    for i in range(args.objects):
+        fname = 'obj%d.dat' % i
+        with open(fname, 'wb') as f:
+            for j in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+        files.append(fname)
+    uploader.HEARBEAT_INTARVAL = args.interval
+    uploader.REPLICAS = args.replicas
+    uploader.POLL_INTERVAL = 0.1
+    uploader.set_transport(net)
+    uploader.set_stop_flag(False)
+    t = threading.Thread(target=uploader.main, args=(UPLOADER_PORT, files))
+    t.daemon = True
+    t.start()
+    while UPLOADER_PORT not in net.nodes:
+        time.sleep(0.01)
+    return (net.nodes[UPLOADER_PORT].get_my_location(), t)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='storjdemo-loadgen',
+        description='simulate many farmers against one uploader.')
+    parser.add_argument('--farmers', type=int, default=100,
+                        help='number of simulated farmers')
+    parser.add_argument('--rate', type=float, default=10,
+                        help='farmers started per second')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to run after all farmers started')
+    parser.add_argument('--sample', type=float, default=1,
+                        help='seconds between samples of CPU and memory')
+    parser.add_argument('--uploader', default=None,
+                        help='location of a real uploader to use over UDP')
+    parser.add_argument('--pid', type=int, default=None,
+                        help='process id of the real uploader')
+    parser.add_argument('--objects', type=int, default=10,
+                        help='number of files of the local uploader')
+    parser.add_argument('--size', type=int, default=1,
+                        help='size of the files in MB')
+    parser.add_argument('--replicas', type=int, default=1,
+                        help='number of farmers each object is placed on')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='heartbeat interval of the local uploader')
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='one way delay of the loopback network')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second of a loopback stream')
+    parser.add_argument('--loss', type=float, default=0,
+                        help='packet loss of the loopback network')
+    parser.add_argument('--workdir', default=None,
+                        help='directory for files, a temporary one if None')
+    parser.add_argument('--profile', default=None,
+                        help='directory to write profiles of handlers to')
+    parser.add_argument('--profile-mode', default=profiling.CPROFILE,
+                        choices=[profiling.CPROFILE, profiling.SAMPLING])
+    parser.add_argument('--log-level', default='WARNING',
+                        help='level of log messages of the simulated peers')
+    args = parser.parse_args(argv)
+    if args.profile is not None:
+        profiling.enable(os.path.abspath(args.profile), args.profile_mode)
+
+    logger.setup(level=args.log_level)
+    cwd = os.getcwd()
+    workdir = args.workdir or tempfile.mkdtemp()
+    os.chdir(workdir)
+    t = None
+    indexes = []
+    try:
+        farmer.init()
+        if args.uploader is not None:
+            transport = UDPTransport()
+            destination = args.uploader
+            pid = args.pid or os.getpid()
+        else:
+            transport = loopback.Network(args.latency, args.bandwidth,
+                                         args.loss)
+            (destination, t) = start_uploader(transport, args)
+            pid = os.getpid()
+        farmer.set_transport(transport)
+        start = time.time()
+        run(args, transport, destination, pid, indexes)
+        line = {'type': 'summary', 'time': time.time() - start}
+        line.update(stats.summary())
+        sys.stdout.write(json.dumps(line, sort_keys=True) + '\n')
+    finally:
+        uploader.set_stop_flag(True)
+        if t is not None:
+            t.join()
+        farmer.cleanup()
+        for index in indexes:
+            index.close()
+        os.chdir(cwd)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    logger.shutdown()
+    return 0
+
+
+def run(args, transport, destination, pid, indexes):
+    """
+    start simulated farmers at args.rate per second, and let them run
+    for args.duration seconds while sampling the uploader.
+
+    :param args: parsed arguments
+    :param transport: loopback.Network or UDPTransport
+    :param str destination: location of the uploader
+    :param int pid: process id of the uploader
+    :param list indexes: list which contract indexes of farmers are
+                         appended to, to be closed by the caller
+    """
+    done = threading.Event()
+    sampler = threading.Thread(target=sample,
+                               args=(pid, args.sample, sys.stdout, done))
+    sampler.daemon = True
+    sampler.start()
+    start = time.time()
+    try:
+        for i in range(args.farmers):
+            wait = start + i / args.rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            node = transport.telehash(-9999)
+            root = 'farmer%d' % i
+            os.makedirs(root)
+            index = ContractIndex(os.path.join(root, 'contracts.db'))
+            indexes.append(index)
+            handler = LoadFarmerHandler(
+                node, destination,
+                BlobStore(os.path.join(root, 'download') + os.sep), index)
+            node.add_channel_handler('heartbeat', handler.factory)
+            node.open_channel(destination, 'farming', handler)
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        done.set()
+        sampler.join()
+
+if __name__ == '__main__':
+    sys.exit(main())
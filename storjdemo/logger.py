@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+logging configuration of the uploader and the farmer.
+
+modules of storjdemo only log to their own loggers, and importing them
+doesn't configure logging.  setup() is called when they run as scripts.
+it writes log records from a background thread, so threads handling
+channels only put records into a queue, and messages are formatted in
+the background thread.  args of log calls must not be changed after
+they are logged.
+
+setup() reads these environment variables:
+
+  STORJDEMO_LOG_LEVEL   level name, e.g. DEBUG, INFO by default
+  STORJDEMO_LOG_SAMPLE  log one of every n per-heartbeat messages, 1
+
+per-heartbeat messages are logged to the storjdemo.heartbeat logger.
+warnings and errors of them are never dropped by sampling.
+"""
+
+import atexit
+import binascii
+import logging
+import os
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+FORMAT = '%(filename)s:%(lineno)d %(funcName)s() %(message)s'
+# max number of records waiting for the writer.
+QUEUE_SIZE = 10000
+heartbeat_log = logging.getLogger('storjdemo.heartbeat')
+writer = None
+
+
+class Hex(object):
+
+    """
+    class for formatting bytes as upper hex only when a message is
+    formatted.
+
+    >>> '%s' % Hex(b'\\x01\\xab')
+    '01AB'
+    """
+
+    def __init__(self, b):
+        self.b = b
+
+    def __str__(self):
+        return binascii.hexlify(self.b).upper().decode()
+
+
+class SampleFilter(logging.Filter):
+
+    """
+    filter passing one of every n records below WARNING.
+    """
+
+    def __init__(self, n):
+        """
+        init
+
+        :param int n: one of every n records is passed
+        """
+        logging.Filter.__init__(self)
+        self.n = n
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            self.count += 1
+            return self.count % self.n == 1 or self.n == 1
+
+
+class QueueHandler(logging.Handler):
+
+    """
+    handler putting records into a queue for the writer.
+    when the queue is full, records below WARNING are dropped and
+    counted, and others wait for room.
+    """
+
+    def __init__(self, queue_):
+        logging.Handler.__init__(self)
+        self.queue = queue_
+        self.dropped = 0
+
+    def emit(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Writer(object):
+
+    """
+    class for writing records from a queue to handlers in a thread.
+    """
+
+    def __init__(self, handlers, size=QUEUE_SIZE):
+        """
+        init
+
+        :param list handlers: handlers to write records
+        :param int size: max number of records waiting
+        """
+        self.handlers = handlers
+        self.queue = queue.Queue(size)
+        self.handler = QueueHandler(self.queue)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _write(self, record):
+        for h in self.handlers:
+            if record.levelno >= h.level:
+                h.handle(record)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            self._write(record)
+            dropped = self.handler.dropped
+            if dropped and self.queue.empty():
+                self.handler.dropped -= dropped
+                self._write(logging.makeLogRecord({
+                    'name': 'storjdemo', 'levelno': logging.WARNING,
+                    'levelname': 'WARNING', 'filename': 'logger.py',
+                    'funcName': '_run', 'lineno': 0,
+                    'msg': 'dropped %d log records', 'args': (dropped,)}))
+
+    def stop(self):
+        """
+        write records in the queue and stop the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+def setup(level=None, sample=None, stream=None):
+    """
+    write log records to a stream from a background thread.
+    calling it again replaces the previous configuration.
+
+    :param level: level name or number, STORJDEMO_LOG_LEVEL or INFO if None
+    :param int sample: log one of every n per-heartbeat messages,
+                       STORJDEMO_LOG_SAMPLE or 1 if None
+    :param stream: stream to write to, stderr if None
+    :return: Writer instance
+    """
+    global writer
+
+    if level is None:
+        level = os.environ.get('STORJDEMO_LOG_LEVEL', 'INFO')
+    if sample is None:
+        sample = int(os.environ.get('STORJDEMO_LOG_SAMPLE', 1))
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    shutdown()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    writer = Writer([handler])
+    root = logging.getLogger()
+    root.addHandler(writer.handler)
+    root.setLevel(level)
+    for f in list(heartbeat_log.filters):
+        heartbeat_log.removeFilter(f)
+    if sample > 1:
+        heartbeat_log.addFilter(SampleFilter(sample))
+    return writer
+
+
+def shutdown():
+    """
+    stop the writer after writing queued records.
+    """
+    global writer
+
+    if writer is None:
+        return
+    logging.getLogger().removeHandler(writer.handler)
+    writer.stop()
+    writer = None
+
+
+atexit.register(shutdown)
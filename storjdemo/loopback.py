@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import binascii
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# bytes sent in one simulated uTP packet.
+BLOCK_SIZE = 64 * 1024
+# seconds to wait before resending a lost packet.
+RETRANSMIT_TIMEOUT = 0.2
+# max number of times to resend a packet before giving up.
+MAX_RETRIES = 5
+
+
+class Dropped(Exception):
+
+    """
+    raised when a packet was lost more than MAX_RETRIES times.
+    """
+
+
+class Link(object):
+
+    """
+    class for a simulated network path with fixed latency, bandwidth
+    and random packet loss. lost packets are resent after
+    RETRANSMIT_TIMEOUT, like the reliable telehash channels and uTP do,
+    so loss shows up as delay until MAX_RETRIES is exceeded.
+    """
+
+    def __init__(self, latency=0, bandwidth=None, loss=0, seed=None):
+        """
+        init
+
+        :param float latency: one way delay of a packet in seconds
+        :param float bandwidth: bytes per second of a stream,
+                                None for unlimited
+        :param float loss: probability of losing a packet
+        :param seed: seed of random numbers to make loss reproducible
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.packets = 0
+        self.bytes = 0
+        self.lost = 0
+
+    def delay(self, size):
+        """
+        get seconds for a packet to arrive, counting retransmissions.
+
+        :param int size: bytes of the packet
+        :return: seconds
+        :raise Dropped: if the packet was lost too many times
+        """
+        d = self.latency
+        if self.bandwidth:
+            d += float(size) / self.bandwidth
+        with self.lock:
+            self.packets += 1
+            self.bytes += size
+            for i in range(MAX_RETRIES + 1):
+                if self.loss <= 0 or self.random.random() >= self.loss:
+                    return d
+                self.lost += 1
+                d += RETRANSMIT_TIMEOUT
+        raise Dropped('lost %d times' % (MAX_RETRIES + 1))
+
+    def send(self, size):
+        """
+        wait for a packet to arrive.
+
+        :param int size: bytes of the packet
+        :raise Dropped: if the packet was lost too many times
+        """
+        d = self.delay(size)
+        if d > 0:
+            time.sleep(d)
+
+    def stats(self):
+        """
+        get counters of sent packets.
+
+        :return: dict of packets, bytes and lost
+        """
+        with self.lock:
+            return {'packets': self.packets, 'bytes': self.bytes,
+                    'lost': self.lost}
+
+
+class Network(object):
+
+    """
+    class for connecting telehash nodes and uTP servers in memory.
+    it has the same factory methods as storjdemo.transport.UDPTransport,
+    so it can be given to set_transport() of the uploader and the farmer.
+    channel packets and file blocks share one Link.
+    """
+
+    def __init__(self, latency=0, bandwidth=None, loss=0, seed=None):
+        """
+        init
+
+        :param float latency: one way delay of a packet in seconds
+        :param float bandwidth: bytes per second of a stream,
+                                None for unlimited
+        :param float loss: probability of losing a packet
+        :param seed: seed of random numbers to make loss reproducible
+        """
+        self.link = Link(latency, bandwidth, loss, seed)
+        self.lock = threading.Lock()
+        self.ports = itertools.count(40000)
+        self.nodes = {}
+        self.servers = {}
+
+    def telehash(self, port):
+        """
+        make a telehash node.
+
+        :param int port: port number, <= 0 or in use to pick a free one
+        :return: LoopbackTelehash instance
+        """
+        with self.lock:
+            port = int(port)
+            while port <= 0 or port in self.nodes:
+                port = next(self.ports)
+            node = self.new_node(port)
+            self.nodes[port] = node
+        return node
+
+    def new_node(self, port):
+        """
+        make a telehash node of this network.
+
+        :param int port: port number of the node
+        :return: LoopbackTelehash instance
+        """
+        return LoopbackTelehash(self, port)
+
+    def utp(self):
+        """
+        make a uTP server.
+
+        :return: LoopbackUtp instance
+        """
+        with self.lock:
+            port = next(self.ports)
+            while port in self.servers:
+                port = next(self.ports)
+            server = self.new_server(port)
+            self.servers[port] = server
+        return server
+
+    def new_server(self, port):
+        """
+        make a uTP server of this network.
+
+        :param int port: port number of the server
+        :return: LoopbackUtp instance
+        """
+        return LoopbackUtp(self, port)
+
+    def node(self, location):
+        """
+        find a telehash node.
+
+        :param str location: json str of location of the node
+        :return: LoopbackTelehash instance
+        """
+        port = json.loads(location)['paths'][0]['port']
+        with self.lock:
+            return self.nodes[port]
+
+    def server(self, port):
+        """
+        find a uTP server.
+
+        :param int port: port number of the server
+        :return: LoopbackUtp instance
+        """
+        with self.lock:
+            return self.servers[port]
+
+    def remove_server(self, port):
+        """
+        remove a stopped uTP server, so that its port can't be reached.
+
+        :param int port: port number of the server
+        """
+        with self.lock:
+            self.servers.pop(port, None)
+
+    def stats(self):
+        """
+        get counters of packets sent over the network.
+
+        :return: dict of packets, bytes and lost
+        """
+        return self.link.stats()
+
+
+def seq_methods(handler):
+    """
+    get seq* methods of a channel handler in the order to be called.
+
+    :param handler: ChannelHandler instance
+    :return: list of methods
+    """
+    return [getattr(handler, n) for n in sorted(dir(handler))
+            if n.startswith('seq')]
+
+
+class LoopbackTelehash(object):
+
+    """
+    class for a telehash node in memory. a channel runs in its own
+    thread, calling seq* methods of both ends by turns, and ends when
+    a method returns None or a packet is dropped.
+    """
+
+    def __init__(self, network, port):
+        """
+        init
+
+        :param Network network: network the node is in
+        :param int port: port number of the node
+        """
+        self.network = network
+        self.port = port
+        self.handlers = {}
+
+    def get_my_location(self):
+        """
+        get location of the node.
+
+        :return: json str of location
+        """
+        return json.dumps({'hashname': 'loopback%d' % self.port,
+                           'paths': [{'type': 'udp4', 'ip': '127.0.0.1',
+                                      'port': self.port}]})
+
+    def add_channel_handler(self, name, factory):
+        """
+        register a factory of handlers for a channel.
+
+        :param str name: channel name
+        :param factory: function returning a ChannelHandler,
+                        or None to refuse the channel
+        """
+        self.handlers[name] = factory
+
+    def open_channel(self, destination, name, handler):
+        """
+        open a channel to a node.
+
+        :param str destination: json str of location of the node
+        :param str name: channel name
+        :param handler: ChannelHandler instance of this end
+        """
+        t = threading.Thread(target=self._run,
+                             args=(destination, name, handler))
+        t.daemon = True
+        t.start()
+
+    def _run(self, destination, name, handler):
+        """
+        run a channel until one of ends closes it.
+        """
+        link = self.network.link
+        try:
+            factory = self.network.node(destination).handlers.get(name)
+            other = factory() if factory is not None else None
+            if other is None:
+                log.info('channel %s was refused', name)
+                return
+            packet = None
+            for (mine, theirs) in zip(seq_methods(handler),
+                                      seq_methods(other)):
+                packet = mine(packet)
+                if packet is None:
+                    return
+                link.send(len(packet))
+                packet = theirs(packet)
+                if packet is None:
+                    return
+                link.send(len(packet))
+        except Dropped:
+            log.error('channel %s was dropped', name)
+        except Exception:
+            log.exception('channel %s failed', name)
+
+
+class LoopbackUtp(object):
+
+    """
+    class for a uTP server in memory. a file is copied block by block
+    over the Link of the network into the directory registered for its
+    hash, named by the hex of the hash.
+    """
+
+    def __init__(self, network, port):
+        """
+        init
+
+        :param Network network: network the server is in
+        :param int port: port number of the server
+        """
+        self.network = network
+        self.port = port
+        self.lock = threading.Lock()
+        self.hashes = {}
+
+    def get_serverport(self):
+        """
+        get port number of the server.
+
+        :return: port number
+        """
+        return self.port
+
+    def regist_hash(self, hash, handler, dir):
+        """
+        accept a file with a hash.
+
+        :param bytes hash: hash of the file
+        :param handler: function called with hash and error info
+                        when the file was received
+        :param str dir: directory where the file is saved
+        """
+        with self.lock:
+            self.hashes[hash] = (handler, dir)
+
+    def stop_hash(self, hash):
+        """
+        stop accepting a file with a hash.
+
+        :param bytes hash: hash of the file
+        """
+        with self.lock:
+            self.hashes.pop(hash, None)
+
+    def stop(self):
+        """
+        stop the server, which is removed from the network with
+        handlers of files it accepted.
+        """
+        self.network.remove_server(self.port)
+        with self.lock:
+            self.hashes.clear()
+
+    def send_file(self, ip, port, filename, hash, handler):
+        """
+        send a file to a server.
+
+        :param str ip: ip address of the server, not used
+        :param int port: port number of the server
+        :param str filename: name of the file to be sent
+        :param bytes hash: hash of the file
+        :param handler: function called with hash and error info
+                        when the file was sent
+        """
+        t = threading.Thread(target=self._send,
+                             args=(port, filename, hash, handler))
+        t.daemon = True
+        t.start()
+
+    def _send(self, port, filename, hash, handler):
+        """
+        copy a file to a server and call handlers of both ends.
+        """
+        error = None
+        receiver = None
+        try:
+            server = self.network.server(port)
+            with server.lock:
+                receiver = server.hashes.get(hash)
+            if receiver is None:
+                raise Dropped('hash is not registered')
+            copy(self.network.link, filename, receiver[1], hash)
+        except Exception as e:
+            log.error('failed to send %s: %s', filename, e)
+            error = str(e)
+        if receiver is not None:
+            receiver[0](hash, error)
+        handler(hash, error)
+
+
+def copy(link, filename, dir, hash):
+    """
+    copy a file over a link into a temporary file, and rename it
+    to the hex of its hash when finished.
+
+    :param Link link: link to send blocks over
+    :param str filename: name of the file to be sent
+    :param str dir: directory where the file is saved
+    :param bytes hash: hash of the file
+    """
+    dest = os.path.join(dir, binascii.hexlify(hash).decode().upper())
+    (fd, tmp) = tempfile.mkstemp(dir=dir)
+    try:
+        with open(filename, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            while True:
+                block = src.read(BLOCK_SIZE)
+                if not block:
+                    break
+                link.send(len(block))
+                dst.write(block)
+        shutil.move(tmp, dest)
+    except Exception:
+        os.remove(tmp)
+        raise
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    """
+    thread-safe LRU cache bounded by total weight of values.
+    """
+
+    def __init__(self, max_weight, on_evict=None):
+        """
+        init
+
+        :param int max_weight: max total weight of values
+        :param on_evict: function called with key and value when
+                         a value is evicted or popped, or None.
+        """
+        self.max_weight = max_weight
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        get a value and mark it as recently used.
+
+        :param key: key of the value
+        :return: value, None if not cached
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, weight=1):
+        """
+        add a value, and evict least recently used values if total weight
+        exceeds max_weight.
+
+        :param key: key of the value
+        :param value: value
+        :param int weight: weight of the value, e.g. bytes or fds.
+        """
+        evicted = []
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.weight -= old[1]
+                evicted.append((key, old[0]))
+            self.entries[key] = (value, weight)
+            self.weight += weight
+            while self.weight > self.max_weight and len(self.entries) > 1:
+                (k, (v, w)) = self.entries.popitem(last=False)
+                self.weight -= w
+                self.evictions += 1
+                evicted.append((k, v))
+        self._evicted(evicted)
+
+    def pop(self, key):
+        """
+        remove a value.
+
+        :param key: key of the value
+        :return: value, None if not cached
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            self.weight -= entry[1]
+        self._evicted([(key, entry[0])])
+        return entry[0]
+
+    def clear(self):
+        """
+        remove all values.
+        """
+        with self.lock:
+            evicted = [(k, v) for (k, (v, w)) in self.entries.items()]
+            self.entries.clear()
+            self.weight = 0
+        self._evicted(evicted)
+
+    def _evicted(self, evicted):
+        """
+        call on_evict outside of the lock.
+
+        :param list evicted: list of evicted keys and values
+        """
+        if self.on_evict is not None:
+            for (k, v) in evicted:
+                self.on_evict(k, v)
+
+    def stats(self):
+        """
+        get counters of the cache.
+
+        :return: dict of hits, misses, hit_rate, evictions, entries and
+                 weight.
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / total if total else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'weight': self.weight,
+            }
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import hashlib
+
+from storjdemo.stream import CHUNK_SIZE
+
+
+def merkle_root(leaves):
+    """
+    get a Merkle root of hashes of chunks.
+    a node is a hash of its two children, and a node without a sibling
+    is carried up to the next level as it is.
+
+    :param list leaves: hashes of chunks
+    :return: Merkle root
+    """
+    if not leaves:
+        return hashlib.sha256(b'').digest()
+    level = list(leaves)
+    while len(level) > 1:
+        nxt = []
+        for i in range(0, len(level) - 1, 2):
+            nxt.append(hashlib.sha256(level[i] + level[i + 1]).digest())
+        if len(level) % 2 == 1:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+
+def pack_leaves(leaves):
+    """
+    concatenate hashes of chunks.
+
+    :param list leaves: hashes of chunks
+    :return: concatenated bytes
+    """
+    return b''.join(leaves)
+
+
+def unpack_leaves(b):
+    """
+    split concatenated hashes of chunks.
+
+    :param bytes b: concatenated bytes
+    :return: list of hashes of chunks
+    """
+    return [b[i:i + 32] for i in range(0, len(b), 32)]
+
+
+def chunk_length(i, size, chunk_size=CHUNK_SIZE):
+    """
+    get a length of a chunk.
+
+    :param int i: index of the chunk
+    :param int size: size of the whole file
+    :param int chunk_size: size of chunks
+    :return: length of the chunk
+    """
+    return min(chunk_size, size - i * chunk_size)
+
+
+def verify_chunks(file, leaves, size, chunk_size=CHUNK_SIZE, digest=None):
+    """
+    verify a file chunk by chunk while reading it only once.
+    bytes beyond size are not checked.
+
+    :param file file: file object opened in binary mode
+    :param list leaves: hashes of chunks
+    :param int size: expected size of the file
+    :param int chunk_size: size of chunks
+    :param digest: hash object, e.g. hashlib.sha256(), updated with
+                   the checked bytes to hash the whole file in the same pass
+    :return: list of indices of bad chunks
+    """
+    bad = []
+    file.seek(0)
+    for (i, leaf) in enumerate(leaves):
+        b = file.read(chunk_length(i, size, chunk_size))
+        if digest is not None:
+            digest.update(b)
+        if hashlib.sha256(b).digest() != leaf:
+            bad.append(i)
+    return bad
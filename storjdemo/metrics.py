@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+latency histograms and counters of the protocol in Prometheus text format.
+
+recording is disabled by default, and then instrumented functions cost
+only one check of a global flag.  enable() or setup() turns it on.
+setup() reads these environment variables:
+
+  STORJDEMO_METRICS_PORT      port to serve /metrics on 127.0.0.1
+  STORJDEMO_METRICS_FILE      file to write metrics to periodically
+  STORJDEMO_METRICS_INTERVAL  seconds between writes of the file, 10
+
+>>> h = Histogram('demo_seconds', 'demo latency', ['stage'], [0.1, 1])
+>>> h.observe(0.5, 'encode')
+>>> print(h.render())
+# HELP demo_seconds demo latency
+# TYPE demo_seconds histogram
+demo_seconds_bucket{stage="encode",le="0.1"} 0
+demo_seconds_bucket{stage="encode",le="1"} 1
+demo_seconds_bucket{stage="encode",le="+Inf"} 1
+demo_seconds_sum{stage="encode"} 0.5
+demo_seconds_count{stage="encode"} 1
+"""
+
+import bisect
+import functools
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# seconds
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10, 30, 60]
+enabled = False
+# True if setup() has started exporters.
+started = False
+
+
+def format_value(v):
+    """
+    format a number for Prometheus.
+
+    :param v: int or float
+    :return: str
+    """
+    if isinstance(v, float):
+        if v == float('inf'):
+            return '+Inf'
+        return repr(v)
+    return str(v)
+
+
+def format_labels(names, values, extra=''):
+    """
+    format labels for Prometheus.
+
+    :param list names: label names
+    :param tuple values: label values
+    :param str extra: formatted label appended, e.g. le="1"
+    :return: str like {stage="encode"}
+    """
+    labels = ['%s="%s"' % (n, str(v).replace('\\', '\\\\')
+                           .replace('"', '\\"').replace('\n', '\\n'))
+              for (n, v) in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(labels) + '}'
+
+
+class Counter(object):
+
+    """
+    class for counters with labels, whose values are incremented or
+    read from functions of running totals when they are rendered.
+    """
+
+    def __init__(self, name, help, labels=()):
+        """
+        init
+
+        :param str name: metric name
+        :param str help: description
+        :param list labels: label names
+        """
+        self.name = name
+        self.help = help
+        self.labels = list(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        self.functions = {}
+
+    def inc(self, amount=1, *labels):
+        """
+        increment a counter.
+
+        :param amount: amount to be added
+        :param labels: label values
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        """
+        :param labels: label values
+        :return: value of a counter
+        """
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def set_function(self, func, *labels):
+        """
+        read a value from a function whenever it is rendered.
+
+        :param func: function returning the value
+        :param labels: label values
+        """
+        with self.lock:
+            self.functions[labels] = func
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def render(self):
+        """
+        :return: str in Prometheus text format
+        """
+        with self.lock:
+            functions = list(self.functions.items())
+        values = [(labels, func()) for (labels, func) in functions]
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s counter' % self.name]
+        with self.lock:
+            self.values.update(values)
+            for (labels, v) in sorted(self.values.items()):
+                lines.append('%s%s %s' % (
+                    self.name, format_labels(self.labels, labels),
+                    format_value(v)))
+        return '\n'.join(lines)
+
+
+class Gauge(Counter):
+
+    """
+    class for gauges with labels, whose values are set or
+    read from functions when they are rendered.
+    """
+
+    def set(self, value, *labels):
+        """
+        set a gauge.
+
+        :param value: value
+        :param labels: label values
+        """
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self):
+        """
+        :return: str in Prometheus text format
+        """
+        return Counter.render(self).replace(
+            '# TYPE %s counter' % self.name, '# TYPE %s gauge' % self.name)
+
+
+class Histogram(object):
+
+    """
+    class for histograms with labels and fixed buckets.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        """
+        init
+
+        :param str name: metric name
+        :param str help: description
+        :param list labels: label names
+        :param list buckets: sorted upper bounds of buckets
+        """
+        self.name = name
+        self.help = help
+        self.labels = list(labels)
+        self.buckets = list(buckets)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, *labels):
+        """
+        record a value.
+
+        :param float value: value to be recorded
+        :param labels: label values
+        """
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            v = self.values.get(labels)
+            if v is None:
+                v = self.values[labels] = \
+                    [[0] * (len(self.buckets) + 1), 0, 0]
+            v[0][i] += 1
+            v[1] += value
+            v[2] += 1
+
+    def count(self, *labels):
+        """
+        :param labels: label values
+        :return: number of recorded values
+        """
+        with self.lock:
+            v = self.values.get(labels)
+            return v[2] if v is not None else 0
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def render(self):
+        """
+        :return: str in Prometheus text format
+        """
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        with self.lock:
+            for (labels, (counts, total, n)) in sorted(self.values.items()):
+                cumulative = 0
+                for (le, c) in zip(self.buckets + [float('inf')], counts):
+                    cumulative += c
+                    lines.append('%s_bucket%s %d' % (
+                        self.name,
+                        format_labels(self.labels, labels,
+                                      'le="%s"' % format_value(le)),
+                        cumulative))
+                lines.append('%s_sum%s %s' % (
+                    self.name, format_labels(self.labels, labels),
+                    format_value(total)))
+                lines.append('%s_count%s %d' % (
+                    self.name, format_labels(self.labels, labels), n))
+        return '\n'.join(lines)
+
+
+stage_seconds = Histogram('storjdemo_stage_seconds',
+                          'latency of protocol stages', ['stage'])
+handler_seconds = Histogram('storjdemo_handler_seconds',
+                            'latency of seq* channel handlers', ['handler'])
+handler_errors = Counter('storjdemo_handler_errors_total',
+                         'exceptions raised by seq* channel handlers',
+                         ['handler'])
+bytes_total = Counter('storjdemo_bytes_total', 'bytes transferred',
+                      ['transport', 'direction'])
+heartbeats = Counter('storjdemo_heartbeats_total',
+                     'results of heartbeats', ['role', 'result'])
+queue_depth = Gauge('storjdemo_queue_depth',
+                    'number of jobs waiting in a worker queue', ['queue'])
+cache_lookups = Counter('storjdemo_cache_lookups_total',
+                        'hits and misses of caches', ['cache', 'result'])
+registry = [stage_seconds, handler_seconds, handler_errors, bytes_total,
+            heartbeats, queue_depth, cache_lookups]
+
+
+def enable(flag=True):
+    """
+    turn recording on or off.
+
+    :param bool flag: True to record
+    """
+    global enabled
+    enabled = flag
+
+
+def reset():
+    """
+    clear all recorded values.
+    """
+    for m in registry:
+        m.reset()
+
+
+def render():
+    """
+    :return: all metrics in Prometheus text format
+    """
+    return '\n'.join(m.render() for m in registry) + '\n'
+
+
+def observe_stage(stage, secs):
+    """
+    record latency of a stage if enabled.
+
+    :param str stage: stage name
+    :param float secs: seconds
+    """
+    if enabled:
+        stage_seconds.observe(secs, stage)
+
+
+def count_bytes(transport, direction, size):
+    """
+    count bytes transferred if enabled.
+
+    :param str transport: 'channel' or 'utp'
+    :param str direction: 'sent', 'received' or 'skipped' for files
+                          the farmer already has
+    :param int size: bytes
+    """
+    if enabled:
+        bytes_total.inc(size, transport, direction)
+
+
+def count_heartbeat(role, valid):
+    """
+    count a heartbeat result if enabled.
+
+    :param str role: 'uploader' or 'farmer'
+    :param bool valid: True if the proof was valid
+    """
+    if enabled:
+        heartbeats.inc(1, role, 'pass' if valid else 'fail')
+
+
+def call(stage, func, *args):
+    """
+    call a function and record its latency as a stage if enabled.
+
+    :param str stage: stage name
+    :param func: function to be called
+    :param args: arguments of func
+    :return: result of func
+    """
+    if not enabled:
+        return func(*args)
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        stage_seconds.observe(time.time() - start, stage)
+
+
+def timed(stage):
+    """
+    decorator recording latency of a function as a stage if enabled.
+
+    :param str stage: stage name
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stage_seconds.observe(time.time() - start, stage)
+        return wrapper
+    return decorate
+
+
+def instrument(cls):
+    """
+    class decorator recording latency, exceptions and packet sizes of
+    seq* methods of a channel handler if enabled.
+
+    :param cls: ChannelHandler class
+    :return: cls
+    """
+    for (name, method) in list(cls.__dict__.items()):
+        if name.startswith('seq') and callable(method):
+            setattr(cls, name, _instrument_seq(
+                method, '%s.%s' % (cls.__name__, name)))
+    return cls
+
+
+def _instrument_seq(method, label):
+    @functools.wraps(method)
+    def wrapper(self, packet):
+        if not enabled:
+            return method(self, packet)
+        if packet is not None:
+            bytes_total.inc(len(packet), 'channel', 'received')
+        start = time.time()
+        try:
+            r = method(self, packet)
+        except Exception:
+            handler_errors.inc(1, label)
+            raise
+        finally:
+            handler_seconds.observe(time.time() - start, label)
+        if r is not None:
+            bytes_total.inc(len(r), 'channel', 'sent')
+        return r
+    return wrapper
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    """
+    class for serving metrics over HTTP.
+    """
+
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, address='127.0.0.1'):
+    """
+    serve metrics over HTTP in a thread, and enable recording.
+
+    :param int port: port number, 0 to pick a free one
+    :param str address: address to listen
+    :return: HTTPServer instance, shutdown() to stop it
+    """
+    server = HTTPServer((address, port), MetricsHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    enable()
+    return server
+
+
+def write(path):
+    """
+    write metrics into a file atomically.
+
+    :param str path: file name
+    """
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'w') as f:
+        f.write(render())
+    os.rename(tmp, path)
+
+
+def write_periodically(path, interval):
+    """
+    write metrics into a file every interval seconds in a thread,
+    and enable recording.
+
+    :param str path: file name
+    :param float interval: seconds between writes
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write(path)
+            except Exception:
+                log.exception('failed to write metrics')
+    t = threading.Thread(target=run)
+    t.daemon = True
+    t.start()
+    enable()
+
+
+def setup():
+    """
+    start exporting metrics as told by environment variables.
+    exporters are started only once in a process.
+    """
+    global started
+
+    if started:
+        return
+    started = True
+    port = os.environ.get('STORJDEMO_METRICS_PORT')
+    if port:
+        serve(int(port))
+    path = os.environ.get('STORJDEMO_METRICS_FILE')
+    if path:
+        write_periodically(
+            path, float(os.environ.get('STORJDEMO_METRICS_INTERVAL', 10)))
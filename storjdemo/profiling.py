@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+opt-in profiling of seq* methods of channel handlers.
+
+profiling is disabled by default, and then instrumented methods cost
+only one check of a global flag.  enable() or setup() turns it on.
+setup() reads these environment variables:
+
+  STORJDEMO_PROFILE           directory to write profiles to
+  STORJDEMO_PROFILE_MODE      'cprofile' (default) or 'sampling'
+  STORJDEMO_PROFILE_INTERVAL  seconds between samples, 0.005
+  STORJDEMO_PROFILE_TOP       number of lines of the summary, 20
+
+in cprofile mode each call is run under cProfile, and stats are
+accumulated per handler, e.g. UploaderHandler.seqAA_accept_request.prof,
+which can be read by pstats or snakeviz.
+since python 3.12 only one cProfile can be active in a process, so a call
+overlapping another profiled call is run unprofiled and only counted.
+in sampling mode a thread samples stacks of threads running handlers,
+and counts them per handler in the collapsed format of flamegraph.pl and
+speedscope, e.g. UploaderHandler.seqAA_accept_request.folded.
+report() writes them and a top-N summary.txt, and is called at shutdown.
+"""
+
+import atexit
+import cProfile
+import collections
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sampling'
+enabled = False
+mode = CPROFILE
+directory = None
+interval = 0.005
+top = 20
+# True if setup() has been called.
+started = False
+lock = threading.Lock()
+local = threading.local()
+# stats of cProfile keyed by handler.
+stats = {}
+# numbers of calls run unprofiled keyed by handler.
+skipped = collections.Counter()
+# counts of collapsed stacks keyed by handler.
+stacks = collections.defaultdict(collections.Counter)
+# handlers being run keyed by thread ident, for sampling.
+active = {}
+sampler = None
+dirty = False
+
+
+def instrument(cls):
+    """
+    class decorator profiling seq* methods of a channel handler if enabled.
+
+    :param cls: ChannelHandler class
+    :return: cls
+    """
+    for (name, method) in list(cls.__dict__.items()):
+        if name.startswith('seq') and callable(method):
+            setattr(cls, name, _profile_seq(
+                method, '%s.%s' % (cls.__name__, name)))
+    return cls
+
+
+def _profile_seq(method, label):
+    @functools.wraps(method)
+    def wrapper(self, packet):
+        if not enabled or getattr(local, 'label', None) is not None:
+            return method(self, packet)
+        local.label = label
+        try:
+            if mode == SAMPLING:
+                return _sample_call(label, method, self, packet)
+            return _profile_call(label, method, self, packet)
+        finally:
+            local.label = None
+    return wrapper
+
+
+def _profile_call(label, method, *args):
+    global dirty
+
+    p = cProfile.Profile()
+    try:
+        p.enable()
+    except ValueError:
+        # another profiler is active.
+        with lock:
+            skipped[label] += 1
+            dirty = True
+        return method(*args)
+    try:
+        return method(*args)
+    finally:
+        p.disable()
+        with lock:
+            if label in stats:
+                stats[label].add(p)
+            else:
+                stats[label] = pstats.Stats(p)
+            dirty = True
+
+
+def _sample_call(label, method, *args):
+    ident = threading.current_thread().ident
+    active[ident] = label
+    try:
+        return method(*args)
+    finally:
+        active.pop(ident, None)
+
+
+def frame_name(code):
+    """
+    get a name of a function for collapsed stacks.
+
+    :param code: code object of the function
+    :return: str like encode_file (uploader.py:150)
+    """
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+def collapse(frame):
+    """
+    get a collapsed stack of a frame running a handler.
+    frames outside of the handler are omitted.
+
+    :param frame: innermost frame
+    :return: str of function names joined by ';' from the outermost,
+             None if the frame is not in a handler.
+    """
+    names = []
+    while frame is not None:
+        if frame.f_code is _sample_call.__code__:
+            return ';'.join(reversed(names))
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return None
+
+
+def _sample():
+    """
+    sample stacks of threads running handlers until disabled.
+    """
+    global dirty
+
+    me = threading.current_thread().ident
+    while enabled and mode == SAMPLING:
+        time.sleep(interval)
+        frames = sys._current_frames()
+        for (ident, label) in list(active.items()):
+            frame = frames.get(ident)
+            if ident == me or frame is None:
+                continue
+            stack = collapse(frame)
+            if stack:
+                with lock:
+                    stacks[label][stack] += 1
+                    dirty = True
+
+
+def enable(directory_, mode_=CPROFILE, interval_=0.005, top_=20):
+    """
+    start profiling.
+
+    :param str directory_: directory to write profiles to
+    :param str mode_: 'cprofile' or 'sampling'
+    :param float interval_: seconds between samples
+    :param int top_: number of lines of the summary
+    """
+    global enabled, mode, directory, interval, top, sampler
+
+    if mode_ not in (CPROFILE, SAMPLING):
+        raise ValueError('unknown profiling mode %s' % mode_)
+    (mode, directory, interval, top) = (mode_, directory_, interval_, top_)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    enabled = True
+    if mode == SAMPLING and (sampler is None or not sampler.is_alive()):
+        sampler = threading.Thread(target=_sample)
+        sampler.daemon = True
+        sampler.start()
+
+
+def disable():
+    """
+    stop profiling. recorded profiles are kept.
+    """
+    global enabled
+    enabled = False
+
+
+def reset():
+    """
+    clear recorded profiles.
+    """
+    global dirty
+
+    with lock:
+        stats.clear()
+        skipped.clear()
+        stacks.clear()
+        dirty = False
+
+
+def summary():
+    """
+    get a top-N summary of recorded profiles.
+
+    :return: str
+    """
+    out = StringIO()
+    with lock:
+        if stats:
+            total = pstats.Stats(stream=out)
+            for s in stats.values():
+                total.add(s)
+            out.write('top %d functions by cumulative time of %s\n' %
+                      (top, ', '.join(sorted(stats))))
+            total.sort_stats('cumulative').print_stats(top)
+        for (label, n) in sorted(skipped.items()):
+            out.write('%d calls of %s were not profiled while another '
+                      'profiler was active\n' % (n, label))
+        for (label, counts) in sorted(stacks.items()):
+            leaves = collections.Counter()
+            for (stack, n) in counts.items():
+                leaves[stack.rsplit(';', 1)[-1]] += n
+            total = sum(counts.values())
+            out.write('top %d functions by samples of %s, %d samples\n' %
+                      (top, label, total))
+            for (name, n) in leaves.most_common(top):
+                out.write('%6.1f%% %s\n' % (100.0 * n / total, name))
+    return out.getvalue()
+
+
+def report():
+    """
+    write recorded profiles and a summary to the directory,
+    and log the summary.
+    """
+    global dirty
+
+    if directory is None or not dirty:
+        return
+    text = summary()
+    with lock:
+        for (label, s) in stats.items():
+            s.dump_stats(os.path.join(directory, label + '.prof'))
+        for (label, counts) in stacks.items():
+            with open(os.path.join(directory, label + '.folded'), 'w') as f:
+                for (stack, n) in sorted(counts.items()):
+                    f.write('%s %d\n' % (stack, n))
+        dirty = False
+    with open(os.path.join(directory, 'summary.txt'), 'w') as f:
+        f.write(text)
+    log.info('profile summary\n%s', text)
+
+
+def setup():
+    """
+    start profiling as told by environment variables, and report
+    at exit. it is done only once in a process.
+    """
+    global started
+
+    if started:
+        return
+    started = True
+    path = os.environ.get('STORJDEMO_PROFILE')
+    if not path:
+        return
+    enable(path, os.environ.get('STORJDEMO_PROFILE_MODE', CPROFILE),
+           float(os.environ.get('STORJDEMO_PROFILE_INTERVAL', 0.005)),
+           int(os.environ.get('STORJDEMO_PROFILE_TOP', 20)))
+    atexit.register(report)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import base64
+import mmap
+import threading
+
+from heartbeat import Swizzle
+
+from storjdemo.lru import LRUCache
+
+# max bytes of tags kept parsed.
+TAG_CACHE_BYTES = 64 * 1024 * 1024
+# max number of data files kept open.
+MAX_OPEN_FILES = 64
+
+
+class OpenFile(object):
+
+    """
+    class for a data file kept open for proofs.
+    the file is mapped to memory if possible. use it by ``with``, which
+    locks it and rewinds it, since proofs read it from the head.
+    users pin it by acquire() and release(), so that a file evicted from
+    a cache is closed only when nobody uses it, and is never opened again.
+    """
+
+    def __init__(self, fname):
+        """
+        init
+
+        :param str fname: data file name
+        """
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.file = None
+        self.map = None
+        self.users_lock = threading.Lock()
+        self.users = 0
+        self.evicted = False
+
+    def _open(self):
+        """
+        open the file and map it if it is not empty.
+        """
+        self.file = open(self.fname, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self.map = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            if self.file is None:
+                self._open()
+            f = self.map if self.map is not None else self.file
+            f.seek(0)
+        except Exception:
+            self.lock.release()
+            raise
+        return f
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+    def acquire(self):
+        """
+        pin the file while it is used.
+
+        :return: False if the file was evicted and must not be used
+        """
+        with self.users_lock:
+            if self.evicted:
+                return False
+            self.users += 1
+            return True
+
+    def release(self):
+        """
+        unpin the file, and close it if it was evicted meanwhile.
+        """
+        with self.users_lock:
+            self.users -= 1
+            close = self.evicted and self.users == 0
+        if close:
+            self.close()
+
+    def evict(self):
+        """
+        close the file now or when the last user releases it.
+        """
+        with self.users_lock:
+            self.evicted = True
+            close = self.users == 0
+        if close:
+            self.close()
+
+    def close(self):
+        """
+        close the file. it is opened again when used.
+        """
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class ProofCache(object):
+
+    """
+    class for keeping parsed tags and open data files of contracts
+    to make proofs, bounded by bytes of tags and number of open files.
+    files evicted while proofs read them are closed after the proofs,
+    so up to one file per concurrent proof can be open beyond the bound.
+    """
+
+    def __init__(self, tag_bytes=TAG_CACHE_BYTES, open_files=MAX_OPEN_FILES):
+        """
+        init
+
+        :param int tag_bytes: max bytes of tags kept parsed
+        :param int open_files: max number of data files kept open
+        """
+        self.tags = LRUCache(tag_bytes)
+        self.files = LRUCache(open_files, lambda k, v: v.evict())
+
+    def get_tag(self, fname):
+        """
+        get a parsed tag.
+
+        :param str fname: tag file name
+        :return: tag
+        """
+        tag = self.tags.get(fname)
+        if tag is None:
+            with open(fname, 'rb') as file:
+                b = file.read()
+            decoded = base64.b64encode(b).decode('ascii')
+            tag = Swizzle.Swizzle.tag_type().fromdict(decoded)
+            self.tags.put(fname, tag, len(b))
+        return tag
+
+    def get_file(self, fname):
+        """
+        get an open data file, which is pinned until it is released.
+
+        :param str fname: data file name
+        :return: OpenFile
+        """
+        while True:
+            f = self.files.get(fname)
+            if f is None:
+                f = OpenFile(fname)
+                self.files.put(fname, f)
+            if f.acquire():
+                return f
+
+    def prove(self, file_info, cha):
+        """
+        make a proof.
+
+        :param dict file_info: contract, including public beat, tag file
+                               name and data file name.
+        :param object cha: challenge
+        :return: proof
+        """
+        tag = self.get_tag(file_info['tag'])
+        f = self.get_file(file_info['file'])
+        try:
+            with f as file:
+                return file_info['public_beat'].prove(file, cha, tag)
+        finally:
+            f.release()
+
+    def forget(self, file_info):
+        """
+        drop a contract from the cache, e.g. when its files are removed.
+
+        :param dict file_info: contract
+        """
+        self.tags.pop(file_info['tag'])
+        self.files.pop(file_info['file'])
+
+    def stats(self):
+        """
+        get counters of the cache.
+
+        :return: dict of counters of tags and files.
+        """
+        return {'tags': self.tags.stats(), 'files': self.files.stats()}
+
+
+worker_cache = None
+
+
+def init_worker():
+    """
+    initialize a worker process for proofs.
+    a worker needs its own cache, since file objects inherited from
+    the parent share their offsets.
+    """
+    global worker_cache
+    worker_cache = ProofCache()
+
+
+def prove_in_worker(file_info, cha):
+    """
+    make a proof in a worker process.
+
+    :param dict file_info: contract, including public beat, tag file
+                           name and data file name.
+    :param object cha: challenge
+    :return: proof
+    """
+    return worker_cache.prove(file_info, cha)
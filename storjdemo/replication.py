@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# states of a replica, in the order they are reached.
+ACCEPTED = 'accepted'
+SENDING = 'sending'
+SENT = 'sent'
+PLACED = 'placed'
+FAILED = 'failed'
+# event sent when an object is placed on enough farmers.
+COMPLETE = 'complete'
+
+
+class Replicas(object):
+
+    """
+    class for tracking replicas of objects, each of which is a copy of
+    an object being placed or placed on a farmer.
+    listeners are called with an event dict whenever a replica changes
+    its state, and when an object is placed on enough farmers.
+    replicas of an object are forgotten once it is placed on enough
+    farmers, or once all of them failed, so that only objects being
+    placed are tracked.
+
+    >>> r = Replicas(2)
+    >>> events = []
+    >>> r.add_listener(lambda e: events.append((e['farmer'], e['state'])))
+    >>> r.update(1, 'farmer1', PLACED)
+    >>> r.progress(1)
+    {'farmer1': 'placed'}
+    >>> r.update(1, 'farmer2', PLACED)
+    >>> events
+    [('farmer1', 'placed'), ('farmer2', 'placed'), (None, 'complete')]
+    >>> r.progress(1)
+    {}
+    """
+
+    def __init__(self, replicas=1):
+        """
+        init
+
+        :param int replicas: number of farmers an object is placed on
+        """
+        self.replicas = replicas
+        self.lock = threading.Lock()
+        self.states = {}
+        self.done = {}
+        self.listeners = []
+
+    def add_listener(self, func):
+        """
+        add a function called with events.
+        it is called in the thread which changed the state,
+        so it must not block.
+
+        :param func: function taking an event dict, which has
+                     object, farmer, state and time, and other info
+        """
+        self.listeners.append(func)
+
+    def _emit(self, event):
+        for func in self.listeners:
+            try:
+                func(event)
+            except Exception:
+                log.exception('replica listener failed')
+
+    def update(self, object_id, farmer, state, **info):
+        """
+        change the state of a replica.
+
+        :param int object_id: id of the object in the catalogue
+        :param str farmer: telehash location of the farmer
+        :param str state: new state of the replica
+        :param info: other info of the event, e.g. error
+        """
+        with self.lock:
+            states = self.states.setdefault(object_id, {})
+            states[farmer] = state
+            placed = sum(1 for s in states.values() if s == PLACED)
+            complete = state == PLACED and placed >= self.replicas
+            if complete or all(s == FAILED for s in states.values()):
+                del self.states[object_id]
+            if complete and object_id in self.done:
+                self.done.pop(object_id)[0].set()
+        event = {'object': object_id, 'farmer': farmer, 'state': state,
+                 'time': time.time()}
+        event.update(info)
+        self._emit(event)
+        if complete:
+            self._emit({'object': object_id, 'farmer': None,
+                        'state': COMPLETE, 'time': time.time(),
+                        'placed': placed})
+
+    def progress(self, object_id):
+        """
+        :param int object_id: id of the object in the catalogue
+        :return: dict of states of replicas keyed by farmers
+        """
+        with self.lock:
+            return dict(self.states.get(object_id, {}))
+
+    def wait(self, object_id, timeout=None):
+        """
+        wait for an object to be placed on enough farmers.
+        it must be called before the object is placed on enough farmers,
+        which are not remembered afterwards.
+
+        :param int object_id: id of the object in the catalogue
+        :param float timeout: seconds to wait, None to wait forever
+        :return: True if the object was placed on enough farmers
+        """
+        with self.lock:
+            # an event and the number of threads waiting for it.
+            done = self.done.setdefault(object_id, [threading.Event(), 0])
+            done[1] += 1
+        done[0].wait(timeout)
+        with self.lock:
+            done[1] -= 1
+            if not done[1] and self.done.get(object_id) is done:
+                del self.done[object_id]
+        return done[0].is_set()
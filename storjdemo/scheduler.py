@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import heapq
+import logging
+import itertools
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class HeartbeatScheduler(object):
+
+    """
+    class for running heartbeats of all contracts from one thread.
+    due jobs are kept in a heap, so scheduling and cancelling cost
+    O(log n) and no thread sleeps per contract.
+    """
+
+    def __init__(self):
+        """
+        init
+        """
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        """
+        start the scheduler thread.
+        """
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.stopped = False
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """
+        stop the scheduler thread. pending jobs are kept.
+        """
+        with self.cond:
+            if self.thread is None:
+                return
+            self.stopped = True
+            self.cond.notify()
+            t = self.thread
+            self.thread = None
+        if t is not threading.current_thread():
+            t.join()
+
+    def schedule(self, key, delay, func, *args):
+        """
+        schedule a job. a job already scheduled with the same key
+        is replaced.
+
+        :param key: key of a job, e.g. a contract
+        :param float delay: seconds to wait before calling func
+        :param func: function to be called
+        :param args: arguments of func
+        """
+        with self.cond:
+            seq = next(self.counter)
+            due = time.time() + delay
+            self.jobs[key] = (due, seq, func, args)
+            heapq.heappush(self.heap, (due, seq, key))
+            if self.heap[0][1] == seq:
+                self.cond.notify()
+
+    def cancel(self, key):
+        """
+        cancel a job.
+
+        :param key: key of a job
+        :return: True if the job was pending
+        """
+        with self.cond:
+            return self.jobs.pop(key, None) is not None
+
+    def pending(self):
+        """
+        get pending jobs.
+
+        :return: list of (key, seconds until due), ordered by due time
+        """
+        now = time.time()
+        with self.cond:
+            jobs = sorted((v[0], v[1], k) for k, v in self.jobs.items())
+        return [(k, max(0, due - now)) for (due, seq, k) in jobs]
+
+    def __len__(self):
+        with self.cond:
+            return len(self.jobs)
+
+    def _pop_due(self):
+        """
+        wait for a due job and pop it.
+
+        :return: function and its arguments, or None when stopped
+        """
+        with self.cond:
+            while not self.stopped:
+                while self.heap:
+                    (due, seq, key) = self.heap[0]
+                    job = self.jobs.get(key)
+                    if job is not None and job[1] == seq:
+                        break
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                wait = due - time.time()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.heap)
+                del self.jobs[key]
+                return job[2:]
+        return None
+
+    def _run(self):
+        """
+        call due jobs until stopped.
+        """
+        while True:
+            job = self._pop_due()
+            if job is None:
+                return
+            (func, args) = job
+            try:
+                func(*args)
+            except Exception:
+                log.exception('heartbeat job failed')
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_file_hash(filename, chunk_size=CHUNK_SIZE):
+    """
+    get a hash of a file without reading it into memory at once.
+
+    :param str filename: file name to be hashed
+    :param int chunk_size: bytes to be read at a time
+    :return: hash
+    """
+    m = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            b = f.read(chunk_size)
+            if not b:
+                break
+            m.update(b)
+    return m.digest()
+
+
+class HashingReader(object):
+
+    """
+    file-like wrapper which hashes bytes while someone else reads them.
+
+    Swizzle.encode() reads a file through read(), seek() and tell(),
+    so wrapping the file lets the SHA-256 digest be computed in the
+    same pass.  Only the contiguous prefix of the file is fed to the
+    digest, so out-of-order reads cannot corrupt it; whatever encode()
+    did not read is hashed by digest().  Hashes of every chunk_size
+    bytes are collected as well, as leaves of a Merkle tree.
+    """
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        """
+        init
+
+        :param file file: file object opened in binary mode
+        :param int chunk_size: size of chunks for leaves and
+                               bytes to be read at a time in digest()
+        """
+        self.file = file
+        self.chunk_size = chunk_size
+        self.sha = hashlib.sha256()
+        self.hashed = 0
+        self.bytes_read = 0
+        self.leaves = []
+        self.leaf = hashlib.sha256()
+        self.leaf_size = 0
+
+    def _update(self, pos, b):
+        """
+        feed bytes read at pos to the digest if they extend the prefix.
+
+        :param int pos: file offset where b was read
+        :param bytes b: read bytes
+        """
+        end = pos + len(b)
+        if pos <= self.hashed < end:
+            b = b[self.hashed - pos:]
+            self.sha.update(b)
+            self.hashed = end
+            while b:
+                n = self.chunk_size - self.leaf_size
+                self.leaf.update(b[:n])
+                self.leaf_size += len(b[:n])
+                b = b[n:]
+                if self.leaf_size == self.chunk_size:
+                    self.leaves.append(self.leaf.digest())
+                    self.leaf = hashlib.sha256()
+                    self.leaf_size = 0
+
+    def read(self, size=-1):
+        """
+        read bytes from the wrapped file and hash them.
+
+        :param int size: bytes to be read, -1 to read all
+        :return: read bytes
+        """
+        pos = self.file.tell()
+        b = self.file.read(size)
+        self.bytes_read += len(b)
+        self._update(pos, b)
+        return b
+
+    def seek(self, offset, whence=0):
+        """
+        seek the wrapped file.
+        """
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        """
+        tell the position of the wrapped file.
+        """
+        return self.file.tell()
+
+    def digest(self):
+        """
+        hash the rest of the file that was not read and return the hash.
+        leaves are complete after this is called.
+
+        :return: hash of the whole file
+        """
+        self.file.seek(self.hashed)
+        while True:
+            b = self.file.read(self.chunk_size)
+            if not b:
+                break
+            self.bytes_read += len(b)
+            self._update(self.hashed, b)
+        if self.leaf_size > 0:
+            self.leaves.append(self.leaf.digest())
+            self.leaf = hashlib.sha256()
+            self.leaf_size = 0
+        return self.sha.digest()
@@ -36,21 +36,85 @@ import sys
 import time
 import hashlib
 import binascii
+import os
+import tempfile
 import threading
+import collections
 
 from heartbeat import Swizzle
 from storj.messaging import ChannelHandler
-from storj.messaging import StorjTelehash
-from storjutp.storjutp import Storjutp
 
-log_fmt = '%(filename)s:%(lineno)d %(funcName)s() %(message)s'
-logging.basicConfig(level=logging.DEBUG, format=log_fmt)
+from storjdemo.stream import HashingReader
+from storjdemo.cache import HeartbeatCache
+from storjdemo.scheduler import HeartbeatScheduler
+from storjdemo import merkle
+from storjdemo.workers import ProcessPool
+from storjdemo.catalogue import Catalogue
+from storjdemo.blobstore import BlobStore
+from storjdemo import replication
+from storjdemo.replication import Replicas
+from storjdemo import wire
+from storjdemo import metrics
+from storjdemo import profiling
+from storjdemo.transport import UDPTransport
+from storjdemo import logger
+from storjdemo.logger import Hex, heartbeat_log
 
+log = logging.getLogger(__name__)
+
+# uploaded if no file is given and the catalogue is empty.
 FILENAME = 'storjdemo/rand.dat'
 ERROR = -1
 FINISHED = 99
 HEARBEAT_INTARVAL = 10
+# seconds to wait before the first heartbeat of a contract.
+FIRST_HEARTBEAT_DELAY = 1
+# seconds to give up a heartbeat channel that is not finished.
+CHANNEL_TIMEOUT = 60
+# seconds to give up a farming channel that is not finished, which must
+# be longer than a farmer waits for a file and then for its repaired
+# chunks, 2 * farmer.DOWNLOAD_TIMEOUT, so that files still being sent
+# keep their slots and the object is not handed out again meanwhile.
+FARMING_TIMEOUT = 7800
+# max number of contracts challenged in one heartbeat packet.
+MAX_BATCH = 100
+# seconds to wait for other contracts before challenging a due contract.
+BATCH_WINDOW = 1
+CACHE_PATH = 'heartbeat_cache.db'
+# seconds between checks of the stop flag in main().
+POLL_INTERVAL = 10
+CATALOGUE_PATH = 'catalogue.db'
+# where heartbeat tags are stored.
+TAG_PATH = './tags/'
+# file of heartbeat keys, None not to keep keys across restarts.
+KEYS_PATH = 'heartbeat_keys.json'
+# number of processes to encode files and verify proofs,
+# 0 to do them in channel threads.
+SWIZZLE_WORKERS = 0
+# max number of encodings and verifications waiting for the workers.
+SWIZZLE_QUEUE = 256
+# number of farmers each object is placed on at the same time
+# before other objects are handed out.
+REPLICAS = 1
+# max number of files sent over uTP at once, None for no limit.
+MAX_SENDS = 8
+# seconds to wait for a free send slot before trying again later.
+SEND_WAIT = 10
+# locks to encode an object only once while it is handed out to
+# farmers at the same time, picked by id of the object.
+prepare_locks = [threading.Lock() for i in range(64)]
 beat = Swizzle.Swizzle()
+cache = None
+catalogue = None
+tags = BlobStore(TAG_PATH)
+replicas = Replicas(REPLICAS)
+send_slots = None
+swizzle_pool = None
+scheduler = HeartbeatScheduler()
+sessions = {}
+sessions_lock = threading.Lock()
+# makes telehash nodes and uTP servers, see set_transport().
+transport = UDPTransport()
 telehash = None
 status = 0
 stop = False
@@ -68,24 +132,191 @@ def get_hash(f):
     return sha
 
 
+def save_tag(tag_):
+    """
+    save a tag to the tag store.
+
+    :param object tag_: heartbeat tag
+    :return: a hash of tag
+    """
+    tag = base64.b64decode(tag_.todict())
+    h = get_hash(tag)
+    tags.put(h, tag)
+    return h
+
+
+def load_keys(path):
+    """
+    load heartbeat keys from a file, or make new keys and save them
+    if the file doesn't exist.
+    the file is readable only by the owner.
+
+    :param str path: file of heartbeat keys
+    :return: heartbeat
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            return Swizzle.Swizzle.fromdict(json.load(f))
+    beat_ = Swizzle.Swizzle()
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(beat_.todict(), f)
+    os.rename(tmp, path)
+    return beat_
+
+
+def get_beat_id():
+    """
+    get an id of heartbeat keys, which tells states encoded by them.
+
+    :return: hex str of a hash of the heartbeat
+    """
+    d = json.dumps(beat.todict(), sort_keys=True).encode()
+    return binascii.hexlify(get_hash(d)).decode()
+
+
+def init_worker(beat_):
+    """
+    initialize a worker process for Swizzle operations.
+
+    :param object beat_: heartbeat with keys of the parent.
+    """
+    global beat
+    beat = beat_
+
+
+def run_swizzle(func, *args):
+    """
+    run a Swizzle operation in swizzle_pool if it is set,
+    otherwise in the calling thread.
+
+    :param func: function to be called
+    :param args: arguments of func
+    :return: result of func
+    """
+    if swizzle_pool is not None:
+        return swizzle_pool.run(func, *args)
+    return func(*args)
+
+
+def map_swizzle(func, argss):
+    """
+    run a Swizzle operation for each arguments in swizzle_pool in parallel
+    if it is set, otherwise in the calling thread.
+
+    :param func: function to be called
+    :param list argss: list of tuples of arguments of func
+    :return: list of results of func
+    """
+    if swizzle_pool is not None:
+        return swizzle_pool.map(func, argss)
+    return [func(*args) for args in argss]
+
+
+def encode_file(filename):
+    """
+    hash a file and its chunks and encode it for heartbeat while reading
+    it only once.
+
+    :param str filename: target filename
+    :return: a hash of the file, tag, state and list of hashes of chunks
+    """
+    with open(filename, 'rb') as file:
+        reader = HashingReader(file)
+        (tag_, state) = beat.encode(reader)
+        file_hash = reader.digest()
+    return (file_hash, tag_, state, reader.leaves)
+
+
+def verify_proof(proof, cha, state):
+    """
+    verify a proof.
+
+    :param object proof: proof
+    :param object cha: challenge
+    :param object state: heartbeat state
+    :return: True if the proof is valid
+    """
+    return beat.verify(proof, cha, state)
+
+
+def prepare_file(filename):
+    """
+    prepare a file for farming.
+    hash a file and its chunks and encode it for heartbeat by
+    encode_file(), save tag to the tag store,
+    and return a hash of the file, state, a hash of tag and hashes of
+    chunks of the file.
+    results are looked up from and stored to the cache if it is set.
+
+    :param str filename: target filename
+    :return: a hash of the file, state, a hash of tag and list of hashes
+             of chunks
+    """
+    if cache is not None:
+        beat_id = get_beat_id()
+        c = cache.get(filename, beat_id)
+        if c is not None and tags.exists(c[1]):
+            log.debug('cache hit for %s', filename)
+            state = Swizzle.Swizzle.state_type().fromdict(json.loads(c[2]))
+            return (c[0], state, c[1], merkle.unpack_leaves(c[3]))
+        identity = cache.identity(filename)
+    (file_hash, tag_, state, leaves) = metrics.call('encode', run_swizzle,
+                                                    encode_file, filename)
+    h = save_tag(tag_)
+    if cache is not None:
+        cache.put(filename, file_hash, h, json.dumps(state.todict()),
+                  merkle.pack_leaves(leaves), beat_id, identity)
+    return (file_hash, state, h, leaves)
+
+
 def prepare_heartbeat(filename):
     """
     prepare heartbeat.
-    encode a file , save tag to a file named by tag hash,
+    encode a file , save tag to the tag store,
     and return state and a hash of tag.
     :param str filename: heartbeat target filename
     :return: state and a hash of tag
     """
-    global beat
-    with open(filename, 'rb') as file:
-        (tag_, state) = beat.encode(file)
-    tag = base64.b64decode(tag_.todict())
-    h = get_hash(tag)
-    with open(binascii.hexlify(h).upper(), 'wb') as f:
-        f.write(tag)
+    (file_hash, state, h, leaves) = prepare_file(filename)
     return (state, h)
 
 
+@metrics.timed('prepare')
+def prepare_object(obj):
+    """
+    prepare an object in the catalogue.
+    results saved in the catalogue are used if they were made by
+    the current heartbeat keys, otherwise the object is prepared by
+    prepare_file() and results are saved.
+    objects must not be modified once added to the catalogue.
+    an object handed out to farmers at the same time is prepared once,
+    and the others wait for it.
+
+    :param dict obj: object in the catalogue
+    :return: a hash of the file, state, a hash of tag and list of hashes
+             of chunks
+    """
+    beat_id = get_beat_id()
+    with prepare_locks[obj['id'] % len(prepare_locks)]:
+        if obj['namespace'] != beat_id or obj['state'] is None:
+            obj = catalogue.get(obj['id']) or obj
+        if obj['state'] is not None and obj['namespace'] == beat_id and \
+                tags.exists(obj['tag_hash']):
+            state = Swizzle.Swizzle.state_type().fromdict(
+                json.loads(obj['state']))
+            return (obj['file_hash'], state, obj['tag_hash'],
+                    merkle.unpack_leaves(obj['leaves']))
+        (file_hash, state, h, leaves) = prepare_file(obj['path'])
+        catalogue.set_prepared(obj['id'], file_hash, h,
+                               json.dumps(state.todict()),
+                               merkle.pack_leaves(leaves), beat_id)
+        return (file_hash, state, h, leaves)
+
+
+@metrics.instrument
+@profiling.instrument
 class UploaderHandler(ChannelHandler):
 
     """
@@ -97,145 +328,567 @@ class UploaderHandler(ChannelHandler):
         init
         """
         ChannelHandler.__init__(self)
+        self.chunk_files = {}
+        self.sending = {}
+        self.expired = False
+        self.utp = None
 
     def seqAA_accept_request(self, packet):
         """
         accept a file request.
+        pick a file from the catalogue, and
         send information about a hash of a file and a hearbeat tag,
         and public beat.
 
+        the packet is encoded by a codec chosen from ones the farmer
+        supports, which is used in the rest of the channel.
+
         :param str packet: received json packet, including
-                           telehash location.
-        :return: sending json packet, including hash of file and heartbeat
-                  and tag to be sent.
+                           telehash location and supported codecs.
+        :return: sending packet, including hash of file and heartbeat
+                  and tag to be sent, and Merkle root and hashes of chunks
+                  of the file. None to close the channel if there is no
+                  file to be sent.
         """
-        logging.info("accepting request a file...")
+        log.info("accepting request a file...")
         rpacket = {}
-        p = json.loads(packet)
+        p = wire.detect(packet).loads(packet)
         self.destination = p['telehash_location']
-        with open(FILENAME, 'rb') as f:
-            self.file_hash = get_hash(f.read())
-        rpacket['file_hash'] = \
-            binascii.hexlify(self.file_hash).upper().decode()
-        (self.state, self.tag_hash) = prepare_heartbeat(FILENAME)
+        self.codec = wire.negotiate(p.get('codecs', []))
+        self.object = catalogue.next_object(REPLICAS, self.destination)
+        if self.object is None:
+            log.error("no file to be sent...")
+            return None
+        self.call_later(('farming', self.destination, self.object['id']),
+                        FARMING_TIMEOUT, self.expire)
+        self.filename = self.object['path']
+        try:
+            (self.file_hash, self.state, self.tag_hash, self.leaves) = \
+                prepare_object(self.object)
+        except Exception:
+            self.cancel(('farming', self.destination, self.object['id']))
+            catalogue.release(self.object['id'], self.destination)
+            raise
+        replicas.update(self.object['id'], self.destination,
+                        replication.ACCEPTED)
         self.tag_hash_hex =\
             binascii.hexlify(self.tag_hash).upper().decode()
-        rpacket['tag_hash'] = self.tag_hash_hex
-        logging.info('sending file %s and tag_hash %s'
-                     % (rpacket['file_hash'], rpacket['tag_hash']))
-        return json.dumps(rpacket)
+        rpacket['file_hash'] = self.codec.hash(self.file_hash)
+        rpacket['tag_hash'] = self.codec.hash(self.tag_hash)
+        rpacket['file_size'] = os.path.getsize(self.filename)
+        rpacket['chunk_size'] = merkle.CHUNK_SIZE
+        rpacket['chunks'] = self.codec.blob(merkle.pack_leaves(self.leaves))
+        rpacket['merkle_root'] = \
+            self.codec.hash(merkle.merkle_root(self.leaves))
+        log.debug('sending file %s and tag_hash %s',
+                  Hex(self.file_hash), self.tag_hash_hex)
+        return self.codec.dumps(rpacket)
 
     def seqAB_send_file(self, packet):
         """
         send a file.
-        send a file and a hearbeat tag,
+        send a file and a hearbeat tag, except ones the farmer already has.
 
         :param str packet: received json packet, including
-                          utp ip address and port number.
+                          utp ip address and port number, and hashes
+                          the farmer already has.
         :return: sending json packet, including public heartbeat.
         """
-        logging.info("sending file...")
+        log.info("sending file...")
         rpacket = {}
-        p = json.loads(packet)
-        dest_utp_ip = p['utp_ip']
-        dest_utp_port = p['utp_port']
-        utp = Storjutp()
-        utp.send_file(dest_utp_ip, dest_utp_port,
-                      self.tag_hash_hex,
-                      self.tag_hash, self.handler)
-        utp.send_file(dest_utp_ip, dest_utp_port, FILENAME,
-                      self.file_hash, self.handler)
-        rpacket['public_beat'] = beat.get_public().todict()
-        return json.dumps(rpacket)
+        p = self.codec.loads(packet)
+        self.dest_utp_ip = p['utp_ip']
+        self.dest_utp_port = p['utp_port']
+        have = set(self.codec.unhash(h) for h in p.get('have', []))
+        replicas.update(self.object['id'], self.destination,
+                        replication.SENDING,
+                        size=os.path.getsize(self.filename),
+                        skipped=self.file_hash in have)
+        self.utp = transport.utp()
+        for (fname, h) in ((tags.path(self.tag_hash), self.tag_hash),
+                           (self.filename, self.file_hash)):
+            if h in have:
+                log.info("farmer already has %s...", Hex(h))
+                if metrics.enabled:
+                    metrics.count_bytes('utp', 'skipped',
+                                        os.path.getsize(fname))
+                continue
+            self.send_file(self.utp, fname, h)
+        rpacket['public_beat'] = self.codec.swizzle(beat.get_public())
+        return self.codec.dumps(rpacket)
 
     def seqAC_first_heartbeat(self, packet):
         """
-        accept a file downloaded report and prepare a haertbeat in a thread.
+        accept a file downloaded report and prepare a haertbeat.
+        if the report says some chunks are broken, resend them.
 
         :param str packet: received json packet, including
-                           success flag..
-        :return: sending json packet, None to close the channel.
+                           success flag and indices of broken chunks.
+        :return: sending json packet including indices of resent chunks,
+                 None to close the channel.
         """
-        logging.info("preparing heartbeat...")
+        log.info("preparing heartbeat...")
         rpacket = {}
-        p = json.loads(packet)
-        if p['success']:
-            logging.info("threading heartbeat...")
-            t = threading.Thread(
-                target=UploaderHeartbeatHandler.schedule_heartbeat,
-                args=(1, self.state, self.destination))
-            t.start()
+        p = self.codec.loads(packet)
+        if not p['success'] and p.get('bad_chunks'):
+            rpacket['resent'] = self.resend_chunks(p['bad_chunks'])
+            return self.codec.dumps(rpacket)
+        self.first_heartbeat(p)
+        return None
+
+    def seqAD_first_heartbeat_after_repair(self, packet):
+        """
+        accept a report after resending chunks and prepare a haertbeat.
 
+        :param str packet: received json packet, including
+                           success flag.
+        :return: None to close the channel.
+        """
+        log.info("preparing heartbeat after repair...")
+        self.first_heartbeat(self.codec.loads(packet))
         return None
 
+    def first_heartbeat(self, p):
+        """
+        schedule a first heartbeat if a file was downloaded,
+        and record the placement in the catalogue.
+
+        :param dict p: received packet, including success flag.
+        """
+        self.cancel(('farming', self.destination, self.object['id']))
+        self.stop_sending()
+        if p['success']:
+            replicas.update(self.object['id'], self.destination,
+                            replication.PLACED)
+            catalogue.set_placed(self.object['id'], self.destination,
+                                 self.codec.name,
+                                 time.time() + FIRST_HEARTBEAT_DELAY)
+            log.info("scheduling heartbeat...")
+            contract = Contract(self.state, self.destination,
+                                self.tag_hash, object_id=self.object['id'])
+            self.schedule_contract(contract)
+        else:
+            replicas.update(self.object['id'], self.destination,
+                            replication.FAILED, errors=p.get('errors'))
+            catalogue.release(self.object['id'], self.destination)
+
+    def call_later(self, key, delay, func, *args):
+        """
+        call a function on the heartbeat scheduler.
+
+        :param key: key of the job
+        :param float delay: seconds to wait
+        :param func: function to be called
+        :param args: arguments of func
+        """
+        scheduler.schedule(key, delay, func, *args)
+
+    def cancel(self, key):
+        """
+        cancel a job on the heartbeat scheduler.
+
+        :param key: key of the job
+        """
+        scheduler.cancel(key)
+
+    def expire(self):
+        """
+        called when the channel was refused, dropped or not finished in
+        FARMING_TIMEOUT. files being sent give their slots to others,
+        and the object is handed out again.
+        """
+        log.error('farming channel to %s was lost', self.destination)
+        self.stop_sending()
+        replicas.update(self.object['id'], self.destination,
+                        replication.FAILED, error='timeout')
+        catalogue.release(self.object['id'], self.destination)
+
+    def stop_sending(self):
+        """
+        stop the uTP server of the channel once the farmer reported or
+        gave up. files still being sent give their slots to others,
+        temporary files of chunks are removed, and no more files are sent.
+        """
+        self.expired = True
+        while self.sending:
+            try:
+                (hash, (start, fname, slots)) = self.sending.popitem()
+            except KeyError:
+                break
+            if slots is not None:
+                slots.release()
+        for hash in list(self.chunk_files):
+            fname = self.chunk_files.pop(hash, None)
+            if fname is not None:
+                os.remove(fname)
+        if self.utp is not None:
+            self.utp.stop()
+
+    def schedule_contract(self, contract):
+        """
+        schedule the first heartbeat of a new contract, which uses
+        the codec of this channel.
+
+        :param Contract contract: new contract
+        """
+        get_session(self.destination).codec = self.codec
+        UploaderHeartbeatHandler.schedule_heartbeat(FIRST_HEARTBEAT_DELAY,
+                                                    contract)
+
+    def resend_chunks(self, indices):
+        """
+        send chunks of a file, each as a file named by its hash.
+
+        :param list indices: indices of chunks to be sent.
+        :return: list of indices of sent chunks.
+        """
+        log.info("resending %d chunks...", len(indices))
+        sent = []
+        with open(self.filename, 'rb') as f:
+            for i in indices:
+                if not 0 <= i < len(self.leaves):
+                    continue
+                sent.append(i)
+                if self.leaves[i] in self.chunk_files:
+                    continue
+                f.seek(i * merkle.CHUNK_SIZE)
+                (fd, fname) = tempfile.mkstemp()
+                with os.fdopen(fd, 'wb') as chunk:
+                    chunk.write(f.read(merkle.CHUNK_SIZE))
+                self.chunk_files[self.leaves[i]] = fname
+                self.send_file(self.utp, fname, self.leaves[i])
+        return sent
+
+    def send_file(self, utp, filename, hash, wait=None):
+        """
+        send a file over uTP, and remember when it started.
+        if MAX_SENDS files are being sent for wait seconds, try again
+        after SEND_WAIT seconds on the heartbeat scheduler.
+
+        :param utp: uTP server
+        :param str filename: name of the file to be sent
+        :param bytes hash: hash of the file
+        :param float wait: seconds to wait for a free slot,
+                           None for SEND_WAIT
+        """
+        if self.expired:
+            return
+        slots = send_slots
+        if slots is not None and \
+                not slots.acquire(timeout=SEND_WAIT if wait is None else wait):
+            log.info('waiting for a slot to send %s...', Hex(hash))
+            self.call_later(('send', self.destination, hash), SEND_WAIT,
+                            self.send_file, utp, filename, hash, 0)
+            return
+        self.start_send(utp, filename, hash, slots)
+
+    def start_send(self, utp, filename, hash, slots):
+        """
+        send a file over uTP with a slot already taken, which is
+        given back when the transfer finishes or fails.
+
+        :param utp: uTP server
+        :param str filename: name of the file to be sent
+        :param bytes hash: hash of the file
+        :param slots: semaphore of the taken slot, None if not limited
+        """
+        if self.expired:
+            if slots is not None:
+                slots.release()
+            return
+        self.sending[hash] = (time.time(), filename, slots)
+        try:
+            utp.send_file(self.dest_utp_ip, self.dest_utp_port, filename,
+                          hash, self.handler)
+        except Exception as e:
+            log.exception('failed to send %s', Hex(hash))
+            self.handler(hash, e)
+
     def handler(self, hash, error):
         """
-        handler for uTP. For now do nothing.
+        handler for uTP. record the transfer, give the slot to another
+        file, and remove a temporary file of a sent chunk.
+        """
+        sending = self.sending.pop(hash, None)
+        if sending is not None:
+            (start, fname, slots) = sending
+            if slots is not None:
+                slots.release()
+            if hash == self.file_hash:
+                replicas.update(self.object['id'], self.destination,
+                                replication.SENT if error is None
+                                else replication.FAILED, error=error)
+        if sending is not None and error is None and metrics.enabled:
+            metrics.observe_stage('send_file', time.time() - start)
+            metrics.count_bytes('utp', 'sent', os.path.getsize(fname))
+        fname = self.chunk_files.pop(hash, None)
+        if fname is not None:
+            os.remove(fname)
+
+
+class Contract(object):
+
+    """
+    class for a file placed on a farmer, which is audited by heartbeats.
+    """
+
+    def __init__(self, state, destination, tag_hash, interval=None,
+                 object_id=None):
+        """
+        init
+
+        :param object state: heartbeat state
+        :param str destination: telehash destination of the farmer
+        :param bytes tag_hash: hash of the tag, which identifies
+                               the contract on the farmer.
+        :param int interval: wait time between heartbeats,
+                             None for HEARBEAT_INTARVAL.
+        :param int object_id: id of the object in the catalogue,
+                              None if the contract is not saved.
+        """
+        self.object_id = object_id
+        self.state = state
+        self.destination = destination
+        self.tag_hash = tag_hash
+        self.tag_hash_hex = binascii.hexlify(tag_hash).upper().decode()
+        self.key = destination + self.tag_hash_hex
+        self.interval = interval or HEARBEAT_INTARVAL
+
+
+class HeartbeatSession(object):
+
+    """
+    class for sending heartbeats of all contracts on a farmer over
+    one heartbeat channel.
+    due contracts are queued while the channel is in use, and
+    the channel is opened again only when contracts are waiting.
+    queued contracts are challenged together in one packet.
+    a channel which is refused, dropped or not finished in CHANNEL_TIMEOUT
+    is given up, and its contracts are queued again.
+    """
+
+    def __init__(self, destination):
+        """
+        init
+
+        :param str destination: telehash destination of the farmer
+        """
+        self.destination = destination
+        self.codec = wire.JSON
+        self.lock = threading.Lock()
+        self.queue = collections.deque()
+        self.inflight = []
+        self.channel = 0
+        self.opened = None
+
+    def beat(self, contract):
+        """
+        queue a due contract, and open the channel after BATCH_WINDOW
+        if it is not in use, so that contracts due meanwhile are
+        challenged together.
+
+        :param Contract contract: due contract
+        """
+        with self.lock:
+            self.queue.append(contract)
+            if self.opened is not None:
+                return
+            self.opened = time.time()
+        self.call_later(('session', self.destination), BATCH_WINDOW,
+                        self.open)
+
+    def call_later(self, key, delay, func, *args):
+        """
+        call a function on the heartbeat scheduler.
+
+        :param key: key of the job
+        :param float delay: seconds to wait
+        :param func: function to be called
+        :param args: arguments of func
+        """
+        scheduler.schedule(key, delay, func, *args)
+
+    def cancel(self, key):
+        """
+        cancel a job on the heartbeat scheduler.
+
+        :param key: key of the job
+        """
+        scheduler.cancel(key)
+
+    def handler(self, channel):
+        """
+        make a handler of a heartbeat channel.
+
+        :param int channel: number of the channel
+        :return: UploaderHeartbeatHandler
+        """
+        return UploaderHeartbeatHandler(self, channel)
+
+    def open(self):
+        """
+        open a heartbeat channel, which is given up after CHANNEL_TIMEOUT.
         """
-        pass
+        with self.lock:
+            self.channel += 1
+            channel = self.channel
+        self.call_later(('timeout', self.destination), CHANNEL_TIMEOUT,
+                        self.done, channel, True)
+        heartbeat_log.debug('starting heartbeat')
+        telehash.open_channel(self.destination, 'heartbeat',
+                              self.handler(channel))
 
+    def next_contracts(self, n):
+        """
+        take queued contracts, which are in flight until the channel
+        is finished.
+
+        :param int n: max number of contracts to be taken
+        :return: list of Contract
+        """
+        with self.lock:
+            contracts = []
+            while self.queue and len(contracts) < n:
+                contracts.append(self.queue.popleft())
+            self.inflight.extend(contracts)
+            return contracts
+
+    def done(self, channel, lost=False):
+        """
+        called when a channel is finished or given up.
+        open the channel again if contracts are queued.
+        calls for a channel which was already finished are ignored.
+
+        :param int channel: number of the channel
+        :param bool lost: True if contracts in flight were not audited
+                          and should be queued again
+        """
+        with self.lock:
+            if channel != self.channel or self.opened is None:
+                return
+            if lost and self.inflight:
+                heartbeat_log.warning(
+                    'heartbeat channel to %s was lost, %d contracts queued'
+                    ' again', self.destination, len(self.inflight))
+                self.queue.extendleft(reversed(self.inflight))
+            self.inflight = []
+            self.channel += 1
+            self.opened = time.time() if self.queue else None
+            reopen = self.opened is not None
+        self.cancel(('timeout', self.destination))
+        if reopen:
+            self.open()
+
+
+def get_session(destination):
+    """
+    get a heartbeat session for a farmer.
+
+    :param str destination: telehash destination of the farmer
+    :return: HeartbeatSession
+    """
+    with sessions_lock:
+        if destination not in sessions:
+            sessions[destination] = HeartbeatSession(destination)
+        return sessions[destination]
 
+
+@metrics.instrument
+@profiling.instrument
 class UploaderHeartbeatHandler(ChannelHandler):
 
     """
     class for sending heartbeat channel.
     """
 
-    def __init__(self, state, destination):
+    def __init__(self, session, channel):
         """
         init
+
+        :param HeartbeatSession session: session of the farmer
+        :param int channel: number of the channel in the session
         """
         ChannelHandler.__init__(self)
-        self.state = state
-        self.destination = destination
-        pass
+        self.session = session
+        self.channel = channel
+        self.contracts = {}
+        self.chas = {}
 
     @classmethod
-    def schedule_heartbeat(cls, sl, state, destination):
+    def schedule_heartbeat(cls, sl, contract):
         """
-        schedule a heartbeat in a thread.
+        schedule a heartbeat on the heartbeat scheduler.
 
         :param int s1: wait time before starting heartbeat.
-        :param object state: heartbeat state
-        :param str destination: telehash destination
+        :param Contract contract: contract to be audited
         """
-        global telehash
-        logging.debug('starting heartbeat')
-        time.sleep(sl)
-        telehash.open_channel(destination, 'heartbeat',
-                              UploaderHeartbeatHandler(state, destination))
+        session = get_session(contract.destination)
+        scheduler.schedule(contract.key, sl, session.beat, contract)
 
     def seqAA_send_challenge(self, packet):
         """
-        make and send a challenge.
+        make and send challenges for queued contracts.
 
         :param str packet: None
-        :return: sending json packet, including challenge of heartbeat.
+        :return: sending json packet, including challenges of heartbeat
+                 keyed by contracts. None if no contract is queued.
         """
         rpacket = {}
-        self.cha = beat.gen_challenge(self.state)
-        rpacket['challenge'] = self.cha.todict()
-        return json.dumps(rpacket)
+        self.codec = self.session.codec
+        for c in self.session.next_contracts(MAX_BATCH):
+            self.contracts[self.codec.hash(c.tag_hash)] = c
+        if not self.contracts:
+            self.session.done(self.channel)
+            return None
+        try:
+            rpacket['challenges'] = {}
+            for (k, c) in self.contracts.items():
+                self.chas[k] = beat.gen_challenge(c.state)
+                rpacket['challenges'][k] = self.codec.swizzle(self.chas[k])
+            return self.codec.dumps(rpacket)
+        except Exception:
+            self.session.done(self.channel, lost=True)
+            raise
 
     def seqAB_verify(self, packet):
         """
-        verify a proof.
+        verify proofs in bulk.
 
         :param str packet: received json packet, including
-                           proof of heartbeat.
-        :return: sending json packet, including a result of verification.
+                           proofs of heartbeat keyed by contracts.
+        :return: sending json packet, including results of verification
+                 keyed by contracts.
         """
         rpacket = {}
-        p = json.loads(packet)
-        proof = Swizzle.Swizzle.proof_type().fromdict(p['proof'])
-        rpacket['valid'] = \
-            beat.verify(proof, self.cha, self.state)
-        if rpacket['valid']:
-            t = threading.Thread(
-                target=UploaderHeartbeatHandler.schedule_heartbeat,
-                args=(HEARBEAT_INTARVAL, self.state, self.destination))
-            t.start()
-        return json.dumps(rpacket)
+        try:
+            p = self.codec.loads(packet)
+            proofs = p.get('proofs', {})
+            keys = [k for k in self.contracts if proofs.get(k) is not None]
+            argss = [(self.codec.unswizzle(Swizzle.Swizzle.proof_type(),
+                                           proofs[k]),
+                      self.chas[k], self.contracts[k].state) for k in keys]
+            valids = dict(zip(keys, metrics.call('verify', map_swizzle,
+                                                 verify_proof, argss)))
+        except Exception:
+            self.session.done(self.channel, lost=True)
+            raise
+        rpacket['results'] = {}
+        dues = []
+        for (k, c) in self.contracts.items():
+            rpacket['results'][k] = bool(valids.get(k, False))
+            metrics.count_heartbeat('uploader', rpacket['results'][k])
+            if rpacket['results'][k]:
+                self.schedule_heartbeat(c.interval, c)
+                due = time.time() + c.interval
+            else:
+                heartbeat_log.error('proof of %s failed', c.tag_hash_hex)
+                due = None
+            if c.object_id is not None:
+                dues.append((c.object_id, c.destination, due))
+        if dues and catalogue is not None:
+            catalogue.set_due(dues)
+        self.session.done(self.channel)
+        return self.codec.dumps(rpacket)
 
 
 def set_stop_flag(flag):
@@ -243,21 +896,121 @@ def set_stop_flag(flag):
     stop = flag
 
 
-def main(port):
+def set_transport(transport_):
+    """
+    set the factory of telehash nodes and uTP servers.
+
+    :param transport_: UDPTransport or storjdemo.loopback.Network instance
+    """
+    global transport
+    transport = transport_
+
+
+def saved_contracts():
+    """
+    get contracts saved in the catalogue which were encoded by
+    the current heartbeat keys.
+
+    :return: list of tuples of Contract, codec of the farmer and
+             seconds to wait before the next heartbeat
+    """
+    now = time.time()
+    contracts = []
+    for (obj, farmer, codec, due) in catalogue.audited(get_beat_id()):
+        state = Swizzle.Swizzle.state_type().fromdict(
+            json.loads(obj['state']))
+        contract = Contract(state, farmer, obj['tag_hash'],
+                            object_id=obj['id'])
+        contracts.append((contract, wire.CODECS.get(codec, wire.JSON),
+                          max(due - now, 0)))
+    return contracts
+
+
+def resume():
+    """
+    schedule heartbeats of contracts saved in the catalogue,
+    so that they are audited without encoding and sending files again.
+
+    :return: number of resumed contracts
+    """
+    contracts = saved_contracts()
+    for (contract, codec, delay) in contracts:
+        get_session(contract.destination).codec = codec
+        UploaderHeartbeatHandler.schedule_heartbeat(delay, contract)
+    return len(contracts)
+
+
+def init(files=None):
+    """
+    load heartbeat keys, and make the worker pool, the tag store,
+    the cache and the catalogue.
+
+    :param list files: file names to be added to the catalogue
+    """
+    global beat
+    global cache
+    global catalogue
+    global swizzle_pool
+    global tags
+    global send_slots
+
+    metrics.setup()
+    profiling.setup()
+    if KEYS_PATH is not None:
+        beat = load_keys(KEYS_PATH)
+    if SWIZZLE_WORKERS > 0:
+        swizzle_pool = ProcessPool(SWIZZLE_WORKERS, init_worker, (beat,),
+                                   SWIZZLE_QUEUE)
+    tags = BlobStore(TAG_PATH)
+    # listeners added before init() are kept.
+    replicas.replicas = REPLICAS
+    if MAX_SENDS is not None:
+        send_slots = threading.BoundedSemaphore(MAX_SENDS)
+    if CACHE_PATH is not None:
+        cache = HeartbeatCache(CACHE_PATH)
+    catalogue = Catalogue(CATALOGUE_PATH)
+    if files:
+        catalogue.add(files)
+    elif len(catalogue) == 0:
+        catalogue.add([FILENAME])
+
+
+def cleanup():
+    """
+    close the worker pool, and write profiles if profiling.
+    """
+    global swizzle_pool
+
+    profiling.report()
+    if swizzle_pool is not None:
+        swizzle_pool.close()
+        swizzle_pool = None
+
+
+def main(port, files=None):
+    """
+    start the uploader.
+
+    :param int port: port number to listen channels
+    :param list files: file names to be added to the catalogue
+    """
     global telehash
-    global stop
-    global status
 
-    telehash = StorjTelehash(port)
-    logging.info('starting to listen a farming channel at ' +
-                 telehash.get_my_location())
+    init(files)
+    telehash = transport.telehash(port)
+    log.info('starting to listen a farming channel at %s',
+             telehash.get_my_location())
     telehash.add_channel_handler('farming', (lambda: UploaderHandler()))
+    log.info('resumed %d contracts', resume())
+    scheduler.start()
 
     while status == 0 and not stop:
-        time.sleep(10)
+        time.sleep(POLL_INTERVAL)
+    scheduler.stop()
+    cleanup()
 
     if status == ERROR:
-        logging.error("something wrong")
+        log.error("something wrong")
         return 1
 
     return 0
@@ -267,4 +1020,5 @@ if __name__ == '__main__':
         port = sys.argv[1]
     else:
         port = 9999
-    main(port)
+    logger.setup()
+    main(port, sys.argv[2:])
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import base64
+import struct
+import binascii
+
+# first byte of binary packets. JSON packets start with '{'.
+MAGIC = b'\xb5'
+
+NONE = b'\x00'
+FALSE = b'\x01'
+TRUE = b'\x02'
+INT = b'\x03'
+FLOAT = b'\x04'
+BYTES = b'\x05'
+TEXT = b'\x06'
+LIST = b'\x07'
+DICT = b'\x08'
+
+U32 = struct.Struct('>I')
+I64 = struct.Struct('>q')
+F64 = struct.Struct('>d')
+
+text_type = type(u'')
+
+
+def _pack(obj, out):
+    """
+    append packed bytes of an object to a list.
+
+    :param obj: None, bool, int, float, bytes, str, list or dict
+    :param list out: list of bytes
+    """
+    if obj is None:
+        out.append(NONE)
+    elif obj is True:
+        out.append(TRUE)
+    elif obj is False:
+        out.append(FALSE)
+    elif isinstance(obj, bytes):
+        out.append(BYTES + U32.pack(len(obj)))
+        out.append(obj)
+    elif isinstance(obj, text_type):
+        b = obj.encode('utf-8')
+        out.append(TEXT + U32.pack(len(b)))
+        out.append(b)
+    elif isinstance(obj, float):
+        out.append(FLOAT + F64.pack(obj))
+    elif isinstance(obj, (int, type(2 ** 64))):
+        out.append(INT + I64.pack(obj))
+    elif isinstance(obj, (list, tuple)):
+        out.append(LIST + U32.pack(len(obj)))
+        for v in obj:
+            _pack(v, out)
+    elif isinstance(obj, dict):
+        out.append(DICT + U32.pack(len(obj)))
+        for (k, v) in obj.items():
+            _pack(k, out)
+            _pack(v, out)
+    else:
+        raise TypeError('cannot pack %r' % type(obj))
+
+
+def pack(obj):
+    """
+    pack an object into a binary packet.
+
+    :param obj: None, bool, int, float, bytes, str, list or dict
+    :return: bytes
+    """
+    out = [MAGIC]
+    _pack(obj, out)
+    return b''.join(out)
+
+
+def _unpack(b, i):
+    """
+    unpack an object.
+
+    :param bytes b: packed bytes
+    :param int i: offset of the object
+    :return: object and offset of the next object
+    """
+    t = b[i:i + 1]
+    i += 1
+    if t == BYTES:
+        n = U32.unpack_from(b, i)[0]
+        i += 4
+        return (b[i:i + n], i + n)
+    if t == TEXT:
+        n = U32.unpack_from(b, i)[0]
+        i += 4
+        return (b[i:i + n].decode('utf-8'), i + n)
+    if t == DICT:
+        n = U32.unpack_from(b, i)[0]
+        i += 4
+        obj = {}
+        for j in range(n):
+            (k, i) = _unpack(b, i)
+            (obj[k], i) = _unpack(b, i)
+        return (obj, i)
+    if t == LIST:
+        n = U32.unpack_from(b, i)[0]
+        i += 4
+        obj = []
+        for j in range(n):
+            (v, i) = _unpack(b, i)
+            obj.append(v)
+        return (obj, i)
+    if t == INT:
+        return (I64.unpack_from(b, i)[0], i + 8)
+    if t == FLOAT:
+        return (F64.unpack_from(b, i)[0], i + 8)
+    if t == NONE:
+        return (None, i)
+    if t == TRUE:
+        return (True, i)
+    if t == FALSE:
+        return (False, i)
+    raise ValueError('unknown type %r at %d' % (t, i - 1))
+
+
+def unpack(b):
+    """
+    unpack a binary packet.
+
+    :param bytes b: binary packet
+    :return: unpacked object
+    """
+    if b[:1] != MAGIC:
+        raise ValueError('not a binary packet')
+    try:
+        (obj, i) = _unpack(b, 1)
+    except struct.error:
+        raise ValueError('truncated packet')
+    if i != len(b):
+        raise ValueError('packet length mismatch')
+    return obj
+
+
+class JSONCodec(object):
+
+    """
+    class for encoding channel packets in JSON.
+    hashes are sent as uppercase hex, bytes and heartbeat objects as
+    base64.
+    """
+
+    name = 'json'
+
+    def dumps(self, p):
+        return json.dumps(p)
+
+    def loads(self, packet):
+        return json.loads(packet)
+
+    def hash(self, h):
+        return binascii.hexlify(h).upper().decode()
+
+    def unhash(self, v):
+        return binascii.unhexlify(v)
+
+    def blob(self, b):
+        return base64.b64encode(b).decode()
+
+    def unblob(self, v):
+        return base64.b64decode(v)
+
+    def swizzle(self, obj):
+        """
+        :param obj: heartbeat object, e.g. challenge or proof
+        :return: value to be sent
+        """
+        return obj.todict()
+
+    def unswizzle(self, type_, v):
+        """
+        :param type_: type of heartbeat object, e.g. proof_type()
+        :param v: received value
+        :return: heartbeat object
+        """
+        return type_.fromdict(v)
+
+
+class BinaryCodec(JSONCodec):
+
+    """
+    class for encoding channel packets in a length-prefixed binary format.
+    hashes, bytes and heartbeat objects are sent as raw bytes.
+    heartbeat objects are serialized by todict() as base64, which is
+    decoded to be sent.
+    """
+
+    name = 'bin'
+
+    def dumps(self, p):
+        return pack(p)
+
+    def loads(self, packet):
+        if isinstance(packet, text_type):
+            packet = packet.encode('latin-1')
+        return unpack(packet)
+
+    def hash(self, h):
+        return h
+
+    def unhash(self, v):
+        return v
+
+    def blob(self, b):
+        return b
+
+    def unblob(self, v):
+        return v
+
+    def swizzle(self, obj):
+        return base64.b64decode(obj.todict())
+
+    def unswizzle(self, type_, v):
+        return type_.fromdict(base64.b64encode(v).decode())
+
+
+JSON = JSONCodec()
+BINARY = BinaryCodec()
+CODECS = dict((c.name, c) for c in (BINARY, JSON))
+# names of supported codecs, preferred one first.
+SUPPORTED = [BINARY.name, JSON.name]
+
+
+def negotiate(offered):
+    """
+    choose a codec from ones offered by a peer.
+
+    :param list offered: names of codecs supported by the peer
+    :return: codec, JSON if nothing is common
+    """
+    for name in SUPPORTED:
+        if name in offered:
+            return CODECS[name]
+    return JSON
+
+
+def detect(packet):
+    """
+    get a codec of a received packet.
+
+    :param packet: received packet
+    :return: codec
+    """
+    if packet[:1] in (MAGIC, MAGIC.decode('latin-1')):
+        return BINARY
+    return JSON
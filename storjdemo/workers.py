@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import time
+import threading
+import multiprocessing
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger(__name__)
+
+
+class PoolBusy(Exception):
+
+    """
+    raised when a pool has too many functions to run.
+    """
+    pass
+
+
+class ProcessPool(object):
+
+    """
+    class for running CPU-bound functions in worker processes.
+    functions and their arguments and results must be picklable.
+    the number of functions waiting or running in the pool can be
+    bounded, so that callers are held back when workers can't keep up.
+    """
+
+    def __init__(self, size, initializer=None, initargs=(),
+                 max_pending=None, timeout=None):
+        """
+        init
+
+        :param int size: number of worker processes
+        :param initializer: function called once in each worker, or None
+        :param tuple initargs: arguments of initializer
+        :param int max_pending: max number of functions waiting or running
+                                in the pool, None for no limit.
+        :param float timeout: seconds to wait for the pool to have room
+                              before raising PoolBusy, None to wait forever.
+        """
+        self.size = size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.cond = threading.Condition()
+        self.pool = multiprocessing.Pool(size, initializer, initargs)
+
+    def _enter(self, n=1):
+        """
+        wait for the pool to have room for functions.
+        more functions than max_pending wait for the whole pool.
+
+        :param int n: number of functions
+        :return: number of functions charged against max_pending
+        """
+        with self.cond:
+            if self.max_pending is None:
+                self.pending += n
+                return n
+            n = min(n, self.max_pending)
+            deadline = None
+            if self.timeout is not None:
+                deadline = time.time() + self.timeout
+            while self.pending + n > self.max_pending:
+                if deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolBusy('%d functions are pending' % self.pending)
+                self.cond.wait(remaining)
+            self.pending += n
+            return n
+
+    def _leave(self, n=1):
+        """
+        give room for other functions.
+
+        :param int n: number of functions charged by _enter()
+        """
+        with self.cond:
+            self.pending -= n
+            self.cond.notify_all()
+
+    def run(self, func, *args):
+        """
+        run a function in a worker and wait for its result.
+        only the calling thread waits, so calls from different threads
+        run in parallel.
+
+        :param func: function to be called
+        :param args: arguments of func
+        :return: result of func
+        """
+        self._enter()
+        try:
+            return self.pool.apply_async(func, args).get()
+        finally:
+            self._leave()
+
+    def map(self, func, argss):
+        """
+        run a function for each arguments in workers in parallel,
+        and wait for all results.
+
+        :param func: function to be called
+        :param list argss: list of tuples of arguments of func
+        :return: list of results of func
+        """
+        n = self._enter(len(argss))
+        try:
+            results = [self.pool.apply_async(func, args) for args in argss]
+            return [r.get() for r in results]
+        finally:
+            self._leave(n)
+
+    def close(self):
+        """
+        wait for running functions and stop workers.
+        """
+        self.pool.close()
+        self.pool.join()
+
+
+class ThreadPool(object):
+
+    """
+    class for running functions in worker threads without waiting for
+    their results, e.g. hashing files, which releases the GIL.
+    functions wait in a bounded queue, and callers are held back
+    when it is full.
+    """
+
+    def __init__(self, size, max_pending=None):
+        """
+        init
+
+        :param int size: number of worker threads
+        :param int max_pending: max number of functions waiting in
+                                the queue, None for no limit.
+        """
+        self.queue = queue.Queue(max_pending or 0)
+        self.threads = []
+        for i in range(size):
+            t = threading.Thread(target=self._run)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            (func, args) = job
+            try:
+                func(*args)
+            except Exception:
+                log.exception('job failed')
+
+    def submit(self, func, *args):
+        """
+        queue a function to be called in a worker.
+
+        :param func: function to be called
+        :param args: arguments of func
+        """
+        self.queue.put((func, args))
+
+    def depth(self):
+        """
+        :return: number of functions waiting in the queue
+        """
+        return self.queue.qsize()
+
+    def close(self):
+        """
+        wait for queued functions and stop workers.
+        """
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
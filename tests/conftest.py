@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import threading
+import time
+
+import pytest
+
+from storjdemo import farmer
+from storjdemo import uploader
+from storjdemo.loopback import Network
+
+
+@pytest.fixture
+def use_tmpdir(tmpdir, monkeypatch):
+    """
+    point files of the uploader and the farmer to tmpdir.
+    """
+    monkeypatch.setattr(uploader, 'CATALOGUE_PATH',
+                        str(tmpdir.join('catalogue.db')))
+    monkeypatch.setattr(uploader, 'CACHE_PATH',
+                        str(tmpdir.join('heartbeat_cache.db')))
+    monkeypatch.setattr(uploader, 'KEYS_PATH',
+                        str(tmpdir.join('heartbeat_keys.json')))
+    monkeypatch.setattr(uploader, 'TAG_PATH', str(tmpdir.join('tags')) + '/')
+    monkeypatch.setattr(farmer, 'DOWNLOAD_PATH',
+                        str(tmpdir.join('download')) + '/')
+    monkeypatch.setattr(farmer, 'CONTRACTS_PATH',
+                        str(tmpdir.join('contracts.db')))
+    return tmpdir
+
+
+class Loopback(object):
+
+    """
+    the uploader and the farmer running in threads over a loopback
+    network.
+    """
+
+    def __init__(self):
+        self.net = Network(latency=0.001)
+        self.threads = []
+
+    def start_uploader(self, port, files=None):
+        """
+        start uploader.main() and wait for it to listen.
+
+        :param int port: port number of the uploader
+        :param list files: file names to be added to the catalogue
+        :return: location of the uploader
+        """
+        t = threading.Thread(target=uploader.main, args=(port, files))
+        t.start()
+        self.threads.append(t)
+        while port not in self.net.nodes and t.is_alive():
+            time.sleep(0.01)
+        return json.dumps({'paths': [{'type': 'udp4', 'ip': '127.0.0.1',
+                                      'port': port}]})
+
+    def start_farmer(self, destination):
+        """
+        start farmer.main().
+
+        :param str destination: location of the uploader
+        """
+        t = threading.Thread(target=farmer.main, args=(destination,))
+        t.start()
+        self.threads.append(t)
+
+    def stop(self):
+        """
+        stop the uploader and the farmer and wait for them.
+        """
+        uploader.set_stop_flag(True)
+        farmer.set_stop_flag(True)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+
+@pytest.fixture
+def loopback(request, use_tmpdir, monkeypatch):
+    """
+    Loopback whose uploader and farmer are stopped after a test, and
+    whose network is restored to UDP.
+    """
+    lb = Loopback()
+    for m in (uploader, farmer):
+        monkeypatch.setattr(m, 'transport', lb.net)
+        monkeypatch.setattr(m, 'POLL_INTERVAL', 0.1)
+        monkeypatch.setattr(m, 'stop', False)
+    request.addfinalizer(lb.stop)
+    return lb
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import asyncio
+import json
+import os
+import threading
+
+from storjdemo import aio
+from storjdemo import aio_farmer
+from storjdemo import aio_uploader
+from storjdemo import farmer
+from storjdemo import uploader
+
+FARMERS = 20
+
+
+class TestAio(object):
+
+    def test_farming(self, tmpdir):
+        cwd = os.getcwd()
+        os.chdir(str(tmpdir))
+        files = []
+        for i in range(FARMERS):
+            fname = 'obj%d.dat' % i
+            with open(fname, 'wb') as f:
+                f.write(os.urandom(100000 + i))
+            files.append(fname)
+        net = aio.LoopbackNetwork(latency=0.001)
+        aio_uploader.set_transport(net)
+        aio_farmer.set_transport(net)
+        aio_uploader.set_stop_flag(False)
+        aio_farmer.set_stop_flag(False)
+        uploader.FIRST_HEARTBEAT_DELAY = 0
+        uploader.BATCH_WINDOW = 0
+        dest = json.dumps({'paths': [{'type': 'udp4', 'ip': '127.0.0.1',
+                                      'port': 9997}]})
+        results = []
+        threads = []
+        get_result = farmer.FarmerHeartbeatHandler.seqAB_get_result
+
+        def record(self, packet):
+            results.append(packet)
+            return get_result(self, packet)
+
+        async def farmers():
+            while 9997 not in net.nodes:
+                await asyncio.sleep(0.01)
+            for i in range(1, FARMERS):
+                node = net.telehash(0)
+                handler = aio_farmer.AsyncFarmerHandler(node, dest)
+                node.add_channel_handler('heartbeat', handler.factory)
+                node.open_channel(dest, 'farming', handler)
+            for i in range(500):
+                threads.append(threading.active_count())
+                if len(farmer.contracts) == FARMERS and \
+                        len(results) >= FARMERS:
+                    break
+                await asyncio.sleep(0.01)
+            aio_uploader.set_stop_flag(True)
+            aio_farmer.set_stop_flag(True)
+
+        farmer.FarmerHeartbeatHandler.seqAB_get_result = record
+        try:
+            r = aio.run(aio_uploader.serve(9997, files),
+                        aio_farmer.serve(dest), farmers())
+        finally:
+            farmer.FarmerHeartbeatHandler.seqAB_get_result = get_result
+            uploader.FIRST_HEARTBEAT_DELAY = 1
+            uploader.BATCH_WINDOW = 1
+            aio_uploader.set_transport(aio.UDPTransport())
+            aio_farmer.set_transport(aio.UDPTransport())
+            os.chdir(cwd)
+        assert r[:2] == [0, 0]
+        assert len(farmer.contracts) == FARMERS
+        assert len(results) >= FARMERS
+        assert max(threads) <= aio.BLOCKING_WORKERS + 2
+
+    def test_send_slots(self, monkeypatch):
+        sent = []
+
+        class Utp(object):
+
+            def send_file(self, ip, port, filename, hash, handler):
+                sent.append(hash)
+
+        async def send():
+            monkeypatch.setattr(aio_uploader, 'loop',
+                                asyncio.get_event_loop())
+            monkeypatch.setattr(aio_uploader, 'send_slots',
+                                asyncio.BoundedSemaphore(1))
+            h = aio_uploader.AsyncUploaderHandler()
+            h.destination = 'farmer'
+            (h.dest_utp_ip, h.dest_utp_port) = ('127.0.0.1', 9994)
+            h.file_hash = b'file'
+            h.send_file(Utp(), 'tag', b'tag')
+            h.send_file(Utp(), 'chunk', b'chunk')
+            await asyncio.sleep(0.01)
+            # the second file waits for the slot without a thread.
+            assert sent == [b'tag']
+            assert threading.active_count() == threads
+            h.handler(b'tag', None)
+            await asyncio.sleep(0.01)
+            assert sent == [b'tag', b'chunk']
+            h.expired = True
+            h.handler(b'chunk', None)
+            h.send_file(Utp(), 'tag', b'tag')
+            await asyncio.sleep(0.01)
+            assert sent == [b'tag', b'chunk']
+            assert not aio_uploader.send_slots.locked()
+
+        threads = threading.active_count()
+        aio.run(send())
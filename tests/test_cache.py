@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+
+from storjdemo.cache import HeartbeatCache
+
+
+class TestHeartbeatCache(object):
+
+    def test_cache(self, tmpdir):
+        f = tmpdir.join('data')
+        f.write_binary(b'abc')
+        cache = HeartbeatCache(str(tmpdir.join('cache.db')))
+        assert cache.get(str(f), 'key') is None
+        entry = (b'\x01', b'\x02', 'state', b'\x03')
+        cache.put(str(f), *(entry + ('key',)))
+        assert cache.get(str(f), 'key') == entry
+        assert cache.get(str(f), 'other') is None
+
+        cache = HeartbeatCache(str(tmpdir.join('cache.db')))
+        assert cache.get(str(f), 'key') == entry
+        cache.invalidate(str(f))
+        assert cache.get(str(f), 'key') is None
+
+    def test_modified(self, tmpdir):
+        f = tmpdir.join('data')
+        f.write_binary(b'abc')
+        cache = HeartbeatCache(':memory:')
+        cache.put(str(f), b'\x01', b'\x02', 'state')
+        f.write_binary(b'abcd')
+        assert cache.get(str(f)) is None
+        assert len(cache) == 0
+
+    def test_modified_while_read(self, tmpdir):
+        f = tmpdir.join('data')
+        f.write_binary(b'abc')
+        cache = HeartbeatCache(':memory:')
+        identity = cache.identity(str(f))
+        f.write_binary(b'abcd')
+        cache.put(str(f), b'\x01', b'\x02', 'state', identity=identity)
+        assert cache.get(str(f)) is None
+
+    def test_eviction(self, tmpdir):
+        cache = HeartbeatCache(':memory:', max_entries=2)
+        files = []
+        for i in range(3):
+            f = tmpdir.join('data%d' % i)
+            f.write_binary(b'abc')
+            files.append(str(f))
+            cache.put(str(f), b'\x01', b'\x02', 'state')
+        assert len(cache) == 2
+        assert cache.get(files[0]) is None
+        assert cache.get(files[2]) is not None
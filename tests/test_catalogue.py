@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import sqlite3
+
+from storjdemo.catalogue import Catalogue
+
+
+class TestCatalogue(object):
+
+    def test_next_object(self, tmpdir):
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        assert c.next_object() is None
+        c.add(['a', 'b'])
+        c.add(['a', 'c'])
+        assert len(c) == 3
+
+        a = c.next_object()
+        b = c.next_object()
+        assert a['path'].endswith('a')
+        assert b['path'].endswith('b')
+        c.release(b['id'])
+        assert c.next_object()['id'] == b['id']
+        assert c.next_object()['path'].endswith('c')
+        assert c.next_object()['id'] == a['id']
+
+    def test_prepared_and_placed(self, tmpdir):
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        c.add(['a'])
+        obj = c.next_object()
+        assert obj['state'] is None
+        c.set_prepared(obj['id'], b'\x01', b'\x02', 'state', b'\x03', 'key')
+        c.set_placed(obj['id'], 'farmer1')
+        c.set_placed(obj['id'], 'farmer1')
+        c.set_placed(obj['id'], 'farmer2')
+
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        obj = c.get(obj['id'])
+        assert (obj['file_hash'], obj['tag_hash'], obj['state'],
+                obj['leaves'], obj['namespace']) == \
+            (b'\x01', b'\x02', 'state', b'\x03', 'key')
+        assert obj['placed'] == 2
+        assert c.placements(obj['id']) == ['farmer1', 'farmer2']
+
+    def test_audited(self, tmpdir):
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        c.add(['a', 'b'])
+        a = c.next_object()
+        b = c.next_object()
+        c.set_prepared(a['id'], b'\x01', b'\x02', 'state', b'\x03', 'key')
+        c.set_prepared(b['id'], b'\x04', b'\x05', 'state', b'\x06', 'old')
+        c.set_placed(a['id'], 'farmer1', 'bin', 20)
+        c.set_placed(a['id'], 'farmer2', 'json', 10)
+        c.set_placed(a['id'], 'farmer3')
+        c.set_placed(b['id'], 'farmer1', 'bin', 10)
+        c.set_due([(a['id'], 'farmer1', 30), (a['id'], 'farmer2', None)])
+
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        audited = c.audited('key')
+        assert [r[1:] for r in audited] == [('farmer1', 'bin', 30)]
+        assert audited[0][0]['tag_hash'] == b'\x02'
+
+    def test_replicas(self, tmpdir):
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        c.add(['a', 'b'])
+        a = c.next_object(3, 'farmer1')
+        c.set_placed(a['id'], 'farmer1')
+        assert c.next_object(3, 'farmer1')['path'].endswith('b')
+        assert c.next_object(3, 'farmer2')['id'] == a['id']
+        assert c.next_object(3, 'farmer3')['id'] == a['id']
+        assert c.next_object(3, 'farmer4')['path'].endswith('b')
+
+    def test_handouts(self, tmpdir):
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        c.add(['a', 'b'])
+        a = c.next_object(1, 'farmer1')
+        assert c.next_object(1, 'farmer1')['path'].endswith('b')
+        assert c.next_object(1, 'farmer1') is None
+        c.release(a['id'], 'farmer1')
+        c.release(a['id'], 'farmer1')
+        assert c.get(a['id'])['assigned'] == 0
+        assert c.next_object(1, 'farmer1')['id'] == a['id']
+        c.set_placed(a['id'], 'farmer1')
+        assert (c.get(a['id'])['assigned'], c.get(a['id'])['placed']) == \
+            (0, 1)
+
+        # hand-outs are not in flight once the catalogue is reopened.
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        assert c.get(a['id'])['assigned'] == 0
+        assert c.next_object(1, 'farmer2')['path'].endswith('b')
+        assert c.next_object(1, 'farmer1')['path'].endswith('b')
+        assert c.next_object(1, 'farmer1')['id'] == a['id']
+        assert c.next_object(1, 'farmer1') is None
+
+    def test_plan(self, tmpdir):
+        c = Catalogue(str(tmpdir.join('catalogue.db')))
+        plan = ' '.join(r[-1] for r in c.db.execute(
+            'EXPLAIN QUERY PLAN SELECT object FROM placements WHERE farmer=?',
+            ('farmer',)))
+        assert 'placements_farmer' in plan
+
+    def test_copies(self, tmpdir):
+        path = str(tmpdir.join('catalogue.db'))
+        db = sqlite3.connect(path)
+        db.execute(
+            'CREATE TABLE objects ('
+            'id INTEGER PRIMARY KEY, path TEXT UNIQUE, file_hash BLOB, '
+            'tag_hash BLOB, state TEXT, leaves BLOB, namespace TEXT, '
+            'assigned INTEGER DEFAULT 0, placed INTEGER DEFAULT 0)')
+        db.execute("INSERT INTO objects (path, placed) VALUES ('a', 1)")
+        db.execute("INSERT INTO objects (path) VALUES ('b')")
+        db.commit()
+        db.close()
+
+        # copies of a catalogue of an older version are counted.
+        c = Catalogue(path)
+        assert c.next_object(3, 'farmer1')['path'] == 'a'
+        assert c.next_object(3, 'farmer2')['path'] == 'a'
+        assert c.next_object(3, 'farmer3')['path'] == 'b'
+        plan = ' '.join(r[-1] for r in c.db.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM objects '
+            'WHERE copies>0 AND copies<? ORDER BY copies DESC, id', (3,)))
+        assert 'objects_copies' in plan
+        assert 'TEMP B-TREE' not in plan
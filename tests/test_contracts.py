@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from heartbeat import Swizzle
+
+from storjdemo.contracts import ContractIndex
+
+
+class TestContractIndex(object):
+
+    def test_put(self, tmpdir):
+        beat = Swizzle.Swizzle().get_public()
+        index = ContractIndex(str(tmpdir.join('contracts.db')))
+        assert len(index) == 0
+        assert index.find(b'\x02') is None
+        index.put('uploader1', b'\x01', b'\x02', 'tag', 'file', beat)
+        index.put('uploader1', b'\x01', b'\x02', 'tag2', 'file2', beat)
+        index.put('uploader2', b'\x01', b'\x03', 'tag3', 'file3', beat)
+        assert len(index) == 2
+
+        index = ContractIndex(str(tmpdir.join('contracts.db')))
+        assert len(index) == 2
+        c = index.get('uploader1', b'\x01')
+        assert (c['tag_hash'], c['tag'], c['file']) == \
+            (b'\x02', 'tag2', 'file2')
+        assert c['public_beat'].todict() == beat.todict()
+        assert index.find(b'\x03')['uploader'] == 'uploader2'
+        assert index.get('uploader3', b'\x01') is None
+        assert index.find(b'\x03')['public_beat'] is c['public_beat']
+        index.clear()
+        assert len(index) == 0
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import json
+
+from storjdemo import loadgen
+
+
+class TestLoadgen(object):
+
+    def test_main(self, tmpdir, capsys):
+        cwd = os.getcwd()
+        try:
+            assert loadgen.main(['--farmers', '3', '--rate', '100',
+                                 '--duration', '3', '--sample', '0.5',
+                                 '--interval', '0.2', '--objects', '3',
+                                 '--workdir', str(tmpdir)]) == 0
+        finally:
+            os.chdir(cwd)
+            loadgen.uploader.set_stop_flag(False)
+        out = capsys.readouterr()[0]
+        lines = [json.loads(line) for line in out.splitlines()]
+        assert lines[0]['type'] == 'sample'
+        assert 'cpu_percent' in lines[0]
+        summary = lines[-1]
+        assert summary['type'] == 'summary'
+        assert summary['placed'] == 3
+        assert summary['heartbeat_success'] == 1.0
+        assert 'p99' in summary['farming_latency']
+        for i in range(3):
+            assert tmpdir.join('farmer%d' % i, 'download').listdir()
+
+    def test_temporary_workdir(self, tmpdir, monkeypatch, capsys):
+        workdir = tmpdir.join('work')
+        monkeypatch.setattr(loadgen.tempfile, 'mkdtemp',
+                            lambda: str(workdir.mkdir()))
+        cwd = os.getcwd()
+        try:
+            assert loadgen.main(['--farmers', '1', '--duration', '0.5',
+                                 '--objects', '1']) == 0
+        finally:
+            loadgen.uploader.set_stop_flag(False)
+        assert os.getcwd() == cwd
+        assert not workdir.exists()
+        assert loadgen.farmer.verify_pool is None
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from storjdemo import logger
+
+
+class TestLogger(object):
+
+    def setup_method(self, method):
+        self.stream = StringIO()
+        self.log = logging.getLogger('storjdemo.test')
+
+    def teardown_method(self, method):
+        logger.shutdown()
+        logging.getLogger().setLevel(logging.WARNING)
+        logger.setup(level='INFO', sample=1, stream=self.stream)
+        logger.shutdown()
+
+    def test_import(self):
+        assert logger.writer is None
+
+    def test_level(self):
+        logger.setup(level='INFO', stream=self.stream)
+        self.log.debug('debug %s', 1)
+        self.log.info('info %s', 2)
+        logger.shutdown()
+        out = self.stream.getvalue()
+        assert 'debug 1' not in out
+        assert 'info 2' in out
+
+    def test_sample(self):
+        logger.setup(level='DEBUG', sample=3, stream=self.stream)
+        for i in range(9):
+            logger.heartbeat_log.info('beat %d', i)
+        logger.heartbeat_log.error('failed')
+        self.log.info('other')
+        logger.shutdown()
+        lines = self.stream.getvalue().splitlines()
+        assert len([line for line in lines if 'beat' in line]) == 3
+        assert any('failed' in line for line in lines)
+        assert any('other' in line for line in lines)
+
+    def test_lazy(self):
+        class Arg(object):
+            formatted = 0
+
+            def __str__(self):
+                Arg.formatted += 1
+                return 'arg'
+
+        logger.setup(level='INFO', stream=self.stream)
+        self.log.debug('%s', Arg())
+        logger.shutdown()
+        assert Arg.formatted == 0
+        logger.setup(level='INFO', stream=self.stream)
+        self.log.info('%s', Arg())
+        logger.shutdown()
+        assert 'arg' in self.stream.getvalue()
+
+    def test_drop(self):
+        handler = logger.QueueHandler(logger.queue.Queue(1))
+        handler.setLevel(logging.DEBUG)
+        record = logging.makeLogRecord({'levelno': logging.INFO,
+                                        'msg': 'info'})
+        handler.emit(record)
+        handler.emit(record)
+        assert handler.dropped == 1
+        assert handler.queue.qsize() == 1
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import time
+import threading
+import binascii
+import hashlib
+
+import pytest
+
+from storjdemo import loopback
+from storjdemo.loopback import Network, Link, Dropped
+
+
+class Ping(object):
+
+    def __init__(self, count):
+        self.count = count
+        self.got = []
+        self.done = threading.Event()
+
+    def seqAA_ping(self, packet):
+        return 'ping'
+
+    def seqAB_ping(self, packet):
+        self.got.append(packet)
+        self.done.set()
+        return None
+
+
+class Pong(object):
+
+    def __init__(self):
+        self.got = []
+
+    def seqAA_pong(self, packet):
+        self.got.append(packet)
+        return 'pong'
+
+    def seqAB_pong(self, packet):
+        return None
+
+
+class TestLoopback(object):
+
+    def test_link(self):
+        link = Link(latency=0.01, bandwidth=1000)
+        assert link.delay(10) == pytest.approx(0.02)
+        assert link.stats() == {'packets': 1, 'bytes': 10, 'lost': 0}
+        link = Link(loss=0.2, seed=1)
+        delays = [link.delay(1) for i in range(100)]
+        assert link.stats()['lost'] > 0
+        assert max(delays) >= loopback.RETRANSMIT_TIMEOUT
+        with pytest.raises(Dropped):
+            Link(loss=1).delay(1)
+
+    def test_channel(self):
+        net = Network(latency=0.05)
+        uploader = net.telehash(9999)
+        farmer = net.telehash(-9999)
+        assert uploader.port == 9999
+        assert farmer.port != 9999
+        pong = Pong()
+        uploader.add_channel_handler('ping', lambda: pong)
+        ping = Ping(1)
+        start = time.time()
+        farmer.open_channel(uploader.get_my_location(), 'ping', ping)
+        assert ping.done.wait(5)
+        assert time.time() - start >= 0.1
+        assert pong.got == ['ping']
+        assert ping.got == ['pong']
+        assert net.stats()['bytes'] == 8
+
+    def test_send_file(self, tmpdir):
+        net = Network(bandwidth=10 * 1024 * 1024, loss=0.1, seed=0)
+        data = os.urandom(loopback.BLOCK_SIZE * 3 + 10)
+        src = str(tmpdir.join('src'))
+        with open(src, 'wb') as f:
+            f.write(data)
+        h = hashlib.sha256(data).digest()
+        results = []
+        done = threading.Event()
+
+        def handler(hash, error):
+            results.append((hash, error))
+            if len(results) == 2:
+                done.set()
+
+        server = net.utp()
+        server.regist_hash(h, handler, str(tmpdir))
+        net.utp().send_file('127.0.0.1', server.get_serverport(), src, h,
+                            handler)
+        assert done.wait(10)
+        assert results == [(h, None), (h, None)]
+        dest = tmpdir.join(binascii.hexlify(h).decode().upper())
+        assert dest.read_binary() == data
+        assert net.stats()['bytes'] == len(data)
+
+    def test_send_file_error(self, tmpdir):
+        net = Network(loss=1)
+        src = str(tmpdir.join('src'))
+        with open(src, 'wb') as f:
+            f.write(b'data')
+        errors = []
+        done = threading.Event()
+
+        def handler(hash, error):
+            errors.append(error)
+            done.set()
+
+        server = net.utp()
+        net.utp().send_file('127.0.0.1', server.get_serverport(), src,
+                            b'x', handler)
+        assert done.wait(5)
+        assert errors[0] is not None
+        done.clear()
+        server.regist_hash(b'x', handler, str(tmpdir))
+        net.utp().send_file('127.0.0.1', server.get_serverport(), src,
+                            b'x', handler)
+        assert done.wait(5)
+        assert errors[1] is not None
+        assert tmpdir.listdir() == [tmpdir.join('src')]
+
+    def test_stop(self, tmpdir):
+        net = Network()
+        server = net.utp()
+        port = server.get_serverport()
+        server.regist_hash(b'x', None, str(tmpdir))
+        assert net.server(port) is server
+        server.stop()
+        assert port not in net.servers
+        assert server.hashes == {}
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+from storjdemo.lru import LRUCache
+
+
+class TestLRUCache(object):
+
+    def test_lru(self):
+        evicted = []
+        c = LRUCache(3, lambda k, v: evicted.append(k))
+        c.put('a', 1)
+        c.put('b', 2, 2)
+        assert c.get('a') == 1
+        c.put('c', 3)
+        assert evicted == ['b']
+        assert c.get('b') is None
+        assert c.stats()['hits'] == 1
+        assert c.stats()['misses'] == 1
+        assert c.stats()['hit_rate'] == 0.5
+        assert c.stats()['weight'] == 2
+        assert c.pop('a') == 1
+        assert evicted == ['b', 'a']
+        c.clear()
+        assert len(c) == 0
+        assert evicted == ['b', 'a', 'c']
+
+    def test_oversized(self):
+        c = LRUCache(1)
+        c.put('a', 1, 5)
+        assert c.get('a') == 1
+        c.put('b', 2)
+        assert c.get('a') is None
+        assert c.get('b') == 2
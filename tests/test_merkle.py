@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import io
+import os
+import hashlib
+
+from storjdemo import merkle
+from storjdemo.stream import HashingReader
+
+
+class TestMerkle(object):
+
+    def test_root(self):
+        a, b, c = [hashlib.sha256(x).digest() for x in (b'a', b'b', b'c')]
+        ab = hashlib.sha256(a + b).digest()
+        assert merkle.merkle_root([a]) == a
+        assert merkle.merkle_root([a, b]) == ab
+        assert merkle.merkle_root([a, b, c]) == \
+            hashlib.sha256(ab + c).digest()
+        assert merkle.unpack_leaves(merkle.pack_leaves([a, b, c])) == \
+            [a, b, c]
+
+    def test_verify_chunks(self):
+        data = os.urandom(1000)
+        reader = HashingReader(io.BytesIO(data), chunk_size=300)
+        reader.read(123)
+        reader.digest()
+        leaves = reader.leaves
+        assert len(leaves) == 4
+        assert leaves[3] == hashlib.sha256(data[900:]).digest()
+        digest = hashlib.sha256()
+        assert merkle.verify_chunks(io.BytesIO(data + b'extra'), leaves,
+                                    1000, 300, digest) == []
+        assert digest.digest() == hashlib.sha256(data).digest()
+
+        broken = data[:310] + b'x' + data[311:950]
+        assert merkle.verify_chunks(io.BytesIO(broken), leaves, 1000,
+                                    300) == [1, 3]
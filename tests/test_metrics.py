@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+from storjdemo import metrics
+
+
+class Handler(object):
+
+    def seqAA_echo(self, packet):
+        return packet
+
+    def seqAB_fail(self, packet):
+        raise ValueError(packet)
+
+
+class TestMetrics(object):
+
+    def setup_method(self, method):
+        metrics.reset()
+
+    def teardown_method(self, method):
+        metrics.enable(False)
+        metrics.reset()
+
+    def test_disabled(self):
+        f = metrics.timed('stage')(lambda x: x * 2)
+        assert f(2) == 4
+        assert metrics.call('stage', f, 3) == 6
+        metrics.count_heartbeat('uploader', True)
+        assert metrics.stage_seconds.count('stage') == 0
+        assert metrics.heartbeats.get('uploader', 'pass') == 0
+
+    def test_enabled(self):
+        metrics.enable()
+        f = metrics.timed('stage')(lambda x: x * 2)
+        assert f(2) == 4
+        assert metrics.call('other', f, 3) == 6
+        metrics.count_heartbeat('farmer', False)
+        metrics.count_bytes('utp', 'sent', 10)
+        metrics.count_bytes('utp', 'sent', 5)
+        assert metrics.stage_seconds.count('stage') == 2
+        assert metrics.stage_seconds.count('other') == 1
+        assert metrics.heartbeats.get('farmer', 'fail') == 1
+        assert metrics.bytes_total.get('utp', 'sent') == 15
+        text = metrics.render()
+        assert 'storjdemo_bytes_total{transport="utp",direction="sent"} 15' \
+            in text
+        assert 'storjdemo_stage_seconds_count{stage="stage"} 2' in text
+        assert '# TYPE storjdemo_stage_seconds histogram' in text
+
+    def test_gauge(self):
+        depth = [3]
+        gauge = metrics.Gauge('demo_depth', 'demo depth', ['queue'])
+        gauge.set(1, 'a')
+        gauge.set_function(lambda: depth[0], 'b')
+        depth[0] = 4
+        assert gauge.render() == '\n'.join([
+            '# HELP demo_depth demo depth',
+            '# TYPE demo_depth gauge',
+            'demo_depth{queue="a"} 1',
+            'demo_depth{queue="b"} 4'])
+
+    def test_counter_function(self):
+        hits = [3]
+        counter = metrics.Counter('demo_hits_total', 'demo hits', ['cache'])
+        counter.set_function(lambda: hits[0], 'a')
+        hits[0] = 5
+        assert counter.render() == '\n'.join([
+            '# HELP demo_hits_total demo hits',
+            '# TYPE demo_hits_total counter',
+            'demo_hits_total{cache="a"} 5'])
+        assert '# TYPE storjdemo_cache_lookups_total counter' in \
+            metrics.render()
+
+    def test_instrument(self):
+        metrics.enable()
+        cls = metrics.instrument(Handler)
+        h = cls()
+        assert h.seqAA_echo('abc') == 'abc'
+        try:
+            h.seqAB_fail('x')
+        except ValueError:
+            pass
+        assert metrics.handler_seconds.count('Handler.seqAA_echo') == 1
+        assert metrics.handler_errors.get('Handler.seqAB_fail') == 1
+        assert metrics.bytes_total.get('channel', 'received') == 4
+        assert metrics.bytes_total.get('channel', 'sent') == 3
+
+    def test_export(self, tmpdir):
+        server = metrics.serve(0)
+        try:
+            assert metrics.enabled
+            metrics.count_bytes('channel', 'sent', 7)
+            port = server.server_address[1]
+            body = urlopen('http://127.0.0.1:%d/metrics' % port).read()
+            assert b'storjdemo_bytes_total{transport="channel",' \
+                b'direction="sent"} 7' in body
+        finally:
+            server.shutdown()
+            server.server_close()
+        path = str(tmpdir.join('metrics.prom'))
+        metrics.write(path)
+        with open(path) as f:
+            assert f.read() == metrics.render()
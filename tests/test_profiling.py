@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import pstats
+import time
+
+from storjdemo import profiling
+
+
+def busy(secs):
+    end = time.time() + secs
+    n = 0
+    while time.time() < end:
+        n += 1
+    return n
+
+
+class Handler(object):
+
+    def seqAA_busy(self, packet):
+        busy(0.2)
+        return packet
+
+
+profiling.instrument(Handler)
+
+
+class BusyProfile(object):
+
+    """
+    cProfile.Profile of python 3.12+ while another profiler is active.
+    """
+
+    def enable(self):
+        raise ValueError('Another profiling tool is already active')
+
+
+class TestProfiling(object):
+
+    def teardown_method(self, method):
+        profiling.disable()
+        profiling.reset()
+
+    def test_disabled(self, tmpdir):
+        assert Handler().seqAA_busy('a') == 'a'
+        assert not profiling.stats
+        profiling.report()
+        assert not tmpdir.listdir()
+
+    def test_cprofile(self, tmpdir):
+        profiling.enable(str(tmpdir), profiling.CPROFILE, top_=5)
+        assert Handler().seqAA_busy('a') == 'a'
+        assert Handler().seqAA_busy('b') == 'b'
+        profiling.report()
+        prof = str(tmpdir.join('Handler.seqAA_busy.prof'))
+        s = pstats.Stats(prof)
+        assert any(f[2] == 'busy' for f in s.stats)
+        text = tmpdir.join('summary.txt').read()
+        assert 'Handler.seqAA_busy' in text
+        assert 'busy' in text
+
+    def test_cprofile_busy(self, tmpdir, monkeypatch):
+        profiling.enable(str(tmpdir), profiling.CPROFILE)
+        monkeypatch.setattr(profiling.cProfile, 'Profile', BusyProfile)
+        assert Handler().seqAA_busy('a') == 'a'
+        assert profiling.skipped['Handler.seqAA_busy'] == 1
+        profiling.report()
+        assert '1 calls of Handler.seqAA_busy were not profiled' in \
+            tmpdir.join('summary.txt').read()
+
+    def test_sampling(self, tmpdir):
+        profiling.enable(str(tmpdir), profiling.SAMPLING, 0.001)
+        assert Handler().seqAA_busy('a') == 'a'
+        profiling.report()
+        with open(str(tmpdir.join('Handler.seqAA_busy.folded'))) as f:
+            lines = f.read().splitlines()
+        assert lines
+        for line in lines:
+            (stack, n) = line.rsplit(' ', 1)
+            assert stack.startswith('seqAA_busy (test_profiling.py:')
+            assert int(n) > 0
+        assert any(';busy (' in line for line in lines)
+        assert 'samples of Handler.seqAA_busy' in \
+            tmpdir.join('summary.txt').read()
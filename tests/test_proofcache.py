@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import base64
+import hashlib
+import json
+import os
+
+from heartbeat import Swizzle
+
+from storjdemo import farmer
+from storjdemo import proofcache
+from storjdemo import wire
+from storjdemo.contracts import ContractIndex
+from storjdemo.proofcache import OpenFile, ProofCache
+from storjdemo.workers import ProcessPool
+
+
+def write(tmpdir, name, data):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def contract(tmpdir):
+    """
+    encode a file, and get a heartbeat and a contract of it.
+    """
+    path = write(tmpdir, 'file', os.urandom(10000))
+    beat = Swizzle.Swizzle()
+    with open(path, 'rb') as f:
+        (tag, state) = beat.encode(f)
+    tag_path = write(tmpdir, 'tag', base64.b64decode(tag.todict()))
+    return (beat, state, {'public_beat': beat.get_public(), 'tag': tag_path,
+                          'file': path})
+
+
+class TestOpenFile(object):
+
+    def test_open(self, tmpdir):
+        f = OpenFile(write(tmpdir, 'a', b'data'))
+        with f as file:
+            assert file.read(2) == b'da'
+        with f as file:
+            assert file.read() == b'data'
+        f.close()
+        assert f.file is None
+        with f as file:
+            assert file.read() == b'data'
+        f.close()
+
+    def test_empty(self, tmpdir):
+        f = OpenFile(write(tmpdir, 'a', b''))
+        with f as file:
+            assert f.map is None
+            assert file.read() == b''
+        f.close()
+
+    def test_evict(self, tmpdir):
+        f = OpenFile(write(tmpdir, 'a', b'data'))
+        assert f.acquire()
+        with f as file:
+            f.evict()
+            assert file.read() == b'data'
+        assert f.file is not None
+        assert not f.acquire()
+        f.release()
+        assert f.file is None
+
+
+class TestProofCache(object):
+
+    def test_prove(self, tmpdir):
+        (beat, state, file_info) = contract(tmpdir)
+        cache = ProofCache()
+        for i in range(2):
+            cha = beat.gen_challenge(state)
+            assert beat.verify(cache.prove(file_info, cha), cha, state)
+        stats = cache.stats()
+        assert (stats['tags']['hits'], stats['tags']['misses']) == (1, 1)
+        assert (stats['files']['hits'], stats['files']['misses']) == (1, 1)
+        cache.forget(file_info)
+        assert cache.stats()['files']['entries'] == 0
+
+    def test_evict_in_use(self, tmpdir):
+        cache = ProofCache(open_files=1)
+        (a, b) = (write(tmpdir, 'a', b'a'), write(tmpdir, 'b', b'b'))
+        fa = cache.get_file(a)
+        with fa as file:
+            fb = cache.get_file(b)
+            assert file.read() == b'a'
+        with fb as file:
+            assert file.read() == b'b'
+        fb.release()
+        assert fb.file is not None
+        assert fa.file is not None
+        fa.release()
+        assert fa.file is None
+
+        # an evicted file is not opened again outside of the cache.
+        fa2 = cache.get_file(a)
+        assert fa2 is not fa
+        with fa2 as file:
+            assert file.read() == b'a'
+        fa2.release()
+        assert fb.file is None
+        assert len(cache.files) == 1
+
+
+class TestProofPool(object):
+
+    def test_make_proof(self, tmpdir, monkeypatch):
+        (beat, state, file_info) = contract(tmpdir)
+        tag_hash = hashlib.sha256(b'tag').digest()
+        index = ContractIndex(':memory:')
+        index.put('uploader', b'file', tag_hash, file_info['tag'],
+                  file_info['file'], file_info['public_beat'])
+        pool = ProcessPool(2, proofcache.init_worker)
+        monkeypatch.setattr(farmer, 'proof_pool', pool)
+        try:
+            chas = [beat.gen_challenge(state) for i in range(2)]
+            for cha in chas:
+                k = wire.JSON.hash(tag_hash)
+                packet = json.dumps({'challenges': {
+                    k: cha.todict(), 'FF': cha.todict()}})
+                p = json.loads(farmer.FarmerHeartbeatHandler(
+                    index).seqAA_make_proof(packet))
+                assert p['proofs']['FF'] is None
+                proof = Swizzle.Swizzle.proof_type().fromdict(p['proofs'][k])
+                assert beat.verify(proof, cha, state)
+        finally:
+            pool.close()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import time
+
+from storjdemo import farmer
+from storjdemo import replication
+from storjdemo import uploader
+from storjdemo.replication import Replicas
+
+FILENAME = 'storjdemo/rand.dat'
+REPLICAS = 3
+
+
+class TestReplicas(object):
+
+    def test_update(self):
+        r = Replicas(2)
+        events = []
+        r.add_listener(events.append)
+        r.update(1, 'farmer1', replication.SENDING, size=10)
+        r.update(1, 'farmer1', replication.PLACED)
+        r.update(1, 'farmer2', replication.FAILED, error='timeout')
+        assert not r.wait(1, 0)
+        assert r.progress(1) == {'farmer1': replication.PLACED,
+                                 'farmer2': replication.FAILED}
+        results = []
+        t = threading.Thread(target=lambda: results.append(r.wait(1, 5)))
+        t.start()
+        while 1 not in r.done:
+            time.sleep(0.01)
+        r.update(1, 'farmer3', replication.PLACED)
+        t.join()
+        assert results == [True]
+        assert [e['state'] for e in events].count(replication.COMPLETE) == 1
+        assert events[0]['size'] == 10
+        assert events[2]['error'] == 'timeout'
+
+        # replicas of placed or failed objects are forgotten.
+        r.update(2, 'farmer1', replication.SENDING)
+        r.update(2, 'farmer1', replication.FAILED)
+        assert (r.states, r.done) == ({}, {})
+
+    def test_fan_out(self, loopback, monkeypatch):
+        monkeypatch.setattr(uploader, 'REPLICAS', REPLICAS)
+        encode_file = uploader.encode_file
+        encoded = []
+
+        def encode(filename):
+            encoded.append(filename)
+            return encode_file(filename)
+        monkeypatch.setattr(uploader, 'encode_file', encode)
+        # a listener added before main() gets events.
+        monkeypatch.setattr(uploader, 'replicas', Replicas())
+        events = []
+        complete = threading.Event()
+
+        def listen(event):
+            events.append(event)
+            if event['state'] == replication.COMPLETE:
+                complete.set()
+        uploader.replicas.add_listener(listen)
+
+        dest = loopback.start_uploader(9995, [FILENAME])
+        farmer.init()
+        try:
+            for i in range(REPLICAS):
+                node = loopback.net.telehash(0)
+                handler = farmer.FarmerHandler(node, dest)
+                node.add_channel_handler('heartbeat', handler.factory)
+                node.open_channel(dest, 'farming', handler)
+            assert complete.wait(10)
+        finally:
+            loopback.stop()
+            farmer.cleanup()
+
+        placed = [e['farmer'] for e in events
+                  if e['state'] == replication.PLACED]
+        assert len(set(placed)) == REPLICAS
+        assert uploader.replicas.progress(1) == {}
+        assert len(encoded) <= 1
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+import threading
+
+from storjdemo import scheduler
+from storjdemo.scheduler import HeartbeatScheduler
+
+
+class TestHeartbeatScheduler(object):
+
+    def test_order_and_cancel(self):
+        done = []
+        event = threading.Event()
+        s = HeartbeatScheduler()
+        s.start()
+        try:
+            s.schedule('b', 0.2, done.append, 'b')
+            s.schedule('a', 0.1, done.append, 'a')
+            s.schedule('c', 0.15, done.append, 'c')
+            s.schedule('d', 0.3, event.set)
+            assert [k for (k, w) in s.pending()] == ['a', 'c', 'b', 'd']
+            assert s.cancel('c')
+            assert not s.cancel('x')
+            assert event.wait(5)
+        finally:
+            s.stop()
+        assert done == ['a', 'b']
+        assert len(s) == 0
+
+    def test_pending_ties(self, monkeypatch):
+        monkeypatch.setattr(scheduler.time, 'time', lambda: 100.0)
+        s = HeartbeatScheduler()
+        s.schedule(('session', 'farmer'), 1, len)
+        s.schedule('farmerABCD', 1, len)
+        s.schedule(3, 1, len)
+        assert s.pending() == [(('session', 'farmer'), 1),
+                               ('farmerABCD', 1), (3, 1)]
+
+    def test_reschedule(self):
+        done = []
+        s = HeartbeatScheduler()
+        s.start()
+        try:
+            s.schedule('a', 10, done.append, 1)
+            s.schedule('a', 0, done.append, 2)
+            assert len(s) == 1
+            for i in range(50):
+                if done:
+                    break
+                time.sleep(0.1)
+        finally:
+            s.stop()
+        assert done == [2]
@@ -36,8 +36,21 @@ import os
 import threading
 import hashlib
 import binascii
+import json
+
+from heartbeat import Swizzle
 
 import storjdemo
+import storjdemo.uploader
+import storjdemo.farmer
+import storjdemo.wire
+import storjdemo.blobstore
+from storjdemo.catalogue import Catalogue
+from storjdemo.contracts import ContractIndex
+from storjdemo.replication import FAILED
+from storjdemo.replication import Replicas
+from storjdemo.scheduler import HeartbeatScheduler
+from storjdemo.stream import get_file_hash
 
 log_fmt = '%(filename)s:%(lineno)d %(funcName)s() %(message)s'
 logging.basicConfig(level=logging.DEBUG, format=log_fmt)
@@ -45,6 +58,84 @@ logging.basicConfig(level=logging.DEBUG, format=log_fmt)
 FILENAME = 'storjdemo/rand.dat'
 
 
+class ChannelRecorder(object):
+
+    """
+    telehash node recording handlers of opened channels.
+    """
+
+    def __init__(self):
+        self.handlers = []
+
+    def open_channel(self, destination, type_, handler):
+        self.handlers.append(handler)
+
+
+class BrokenUtp(object):
+
+    """
+    uTP server failing to send files.
+    """
+
+    def send_file(self, ip, port, filename, hash, handler):
+        raise IOError('broken')
+
+
+class SilentUtp(object):
+
+    """
+    uTP server whose transfers never finish.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send_file(self, ip, port, filename, hash, handler):
+        self.sent.append(hash)
+
+
+class StoppedUtp(object):
+
+    """
+    uTP server recording downloads which were registered or stopped.
+    """
+
+    def __init__(self):
+        self.dirs = {}
+        self.stopped = []
+        self.closed = False
+
+    def regist_hash(self, hash, handler, dir):
+        self.dirs[hash] = dir
+
+    def stop(self):
+        self.closed = True
+
+    def stop_hash(self, hash):
+        self.stopped.append(hash)
+
+
+class ManualSession(storjdemo.uploader.HeartbeatSession):
+
+    """
+    HeartbeatSession whose jobs are run by tests.
+    """
+
+    def __init__(self, destination):
+        storjdemo.uploader.HeartbeatSession.__init__(self, destination)
+        self.jobs = {}
+
+    def call_later(self, key, delay, func, *args):
+        self.jobs[key[0]] = (func, args)
+
+    def cancel(self, key):
+        self.jobs.pop(key[0], None)
+
+    def run(self, name):
+        (func, args) = self.jobs.pop(name)
+        func(*args)
+
+
 class TestStorjDemo(object):
 
     def test_storjutp(self):
@@ -69,8 +160,7 @@ class TestStorjDemo(object):
         with open(FILENAME, 'rb') as file:
             m = hashlib.sha256()
             m.update(file.read())
-            downloaded_file = 'download/' +\
-                binascii.hexlify(m.digest()).decode().upper()
+            downloaded_file = storjdemo.farmer.blobs.path(m.digest())
 
         f = threading.Thread(
             target=storjdemo.uploader.main, args=(9999,))
@@ -89,3 +179,392 @@ class TestStorjDemo(object):
         assert storjdemo.farmer.status == 0
         assert storjdemo.uploader.status == 0
         assert filecmp.cmp(FILENAME, downloaded_file)
+
+    def test_loopback(self, loopback):
+        file_hash = get_file_hash(FILENAME)
+        dest = loopback.start_uploader(9998)
+        loopback.start_farmer(dest)
+        for i in range(500):
+            if storjdemo.farmer.contracts.get(dest, file_hash):
+                break
+            time.sleep(0.01)
+        loopback.stop()
+
+        assert storjdemo.farmer.contracts.get(dest, file_hash)
+        assert storjdemo.farmer.status == 0
+        assert storjdemo.uploader.status == 0
+        assert filecmp.cmp(FILENAME,
+                           storjdemo.farmer.blobs.path(file_hash))
+
+    def test_resume(self, use_tmpdir, monkeypatch):
+        u = storjdemo.uploader
+        monkeypatch.setattr(u, 'CACHE_PATH', None)
+        u.init([FILENAME])
+        beat_id = u.get_beat_id()
+        obj = u.catalogue.next_object()
+        tag_hash = u.prepare_object(obj)[2]
+        u.catalogue.set_placed(obj['id'], 'farmer', 'bin',
+                               time.time() + 100)
+        u.cleanup()
+
+        u.init()
+        assert u.get_beat_id() == beat_id
+        [(contract, codec, delay)] = u.saved_contracts()
+        assert contract.tag_hash == tag_hash
+        assert contract.destination == 'farmer'
+        assert codec is storjdemo.wire.BINARY
+        assert 90 < delay <= 100
+        u.cleanup()
+
+    def test_have(self, loopback):
+        f = storjdemo.farmer
+        file_hash = get_file_hash(FILENAME)
+        with open(FILENAME, 'rb') as file:
+            storjdemo.blobstore.BlobStore(f.DOWNLOAD_PATH).put(file_hash,
+                                                               file.read())
+        dest = loopback.start_uploader(9996)
+        loopback.start_farmer(dest)
+        for i in range(500):
+            if f.contracts.get(dest, file_hash):
+                break
+            time.sleep(0.01)
+        loopback.stop()
+
+        assert f.contracts.get(dest, file_hash)
+        assert loopback.net.stats()['bytes'] < os.path.getsize(FILENAME)
+
+
+class TestHeartbeatSession(object):
+
+    @pytest.fixture
+    def session(self, tmpdir, monkeypatch):
+        u = storjdemo.uploader
+        path = str(tmpdir.join('file'))
+        with open(path, 'wb') as file:
+            file.write(os.urandom(4096))
+        monkeypatch.setattr(u, 'beat', Swizzle.Swizzle())
+        monkeypatch.setattr(u, 'telehash', ChannelRecorder())
+        monkeypatch.setattr(u, 'scheduler', HeartbeatScheduler())
+        monkeypatch.setattr(u, 'catalogue', None)
+        monkeypatch.setattr(u, 'swizzle_pool', None)
+        session = ManualSession('farmer')
+        monkeypatch.setattr(u, 'sessions', {'farmer': session})
+        (file_hash, self.tag, self.state, leaves) = u.encode_file(path)
+        self.path = path
+        return session
+
+    def contract(self, i):
+        tag_hash = hashlib.sha256(str(i).encode()).digest()
+        return storjdemo.uploader.Contract(self.state, 'farmer', tag_hash)
+
+    def prove(self, packet, swap=False):
+        chas = json.loads(packet)['challenges']
+        keys = sorted(chas)
+        proofs = {}
+        for (k, c) in zip(keys, keys[::-1] if swap else keys):
+            cha = Swizzle.Swizzle.challenge_type().fromdict(chas[c])
+            with open(self.path, 'rb') as file:
+                proof = storjdemo.uploader.beat.get_public().prove(
+                    file, cha, self.tag)
+            proofs[k] = proof.todict()
+        return json.dumps({'proofs': proofs})
+
+    def test_batch(self, session, monkeypatch):
+        u = storjdemo.uploader
+        monkeypatch.setattr(u, 'MAX_BATCH', 2)
+        contracts = [self.contract(i) for i in range(3)]
+        for c in contracts:
+            session.beat(c)
+        assert list(session.jobs) == ['session']
+        session.run('session')
+        assert len(u.telehash.handlers) == 1
+        assert list(session.jobs) == ['timeout']
+
+        h = u.telehash.handlers[0]
+        packet = h.seqAA_send_challenge(None)
+        assert len(json.loads(packet)['challenges']) == 2
+        results = json.loads(h.seqAB_verify(self.prove(packet)))['results']
+        assert list(results.values()) == [True, True]
+
+        # the third contract is challenged on a new channel.
+        assert len(u.telehash.handlers) == 2
+        h = u.telehash.handlers[1]
+        packet = h.seqAA_send_challenge(None)
+        assert len(json.loads(packet)['challenges']) == 1
+        h.seqAB_verify(self.prove(packet))
+        assert session.opened is None
+        assert session.jobs == {}
+        assert len(u.telehash.handlers) == 2
+        assert sorted(k for (k, due) in u.scheduler.pending()) == \
+            sorted(c.key for c in contracts)
+
+    def test_timeout(self, session):
+        u = storjdemo.uploader
+        contracts = [self.contract(i) for i in range(2)]
+        for c in contracts:
+            session.beat(c)
+        session.run('session')
+
+        # a refused channel.
+        session.run('timeout')
+        assert len(u.telehash.handlers) == 2
+
+        # a channel dropped after challenges were sent.
+        dropped = u.telehash.handlers[1].seqAA_send_challenge(None)
+        assert not session.queue
+        session.run('timeout')
+        assert len(u.telehash.handlers) == 3
+        assert list(session.queue) == contracts
+
+        h = u.telehash.handlers[2]
+        packet = h.seqAA_send_challenge(None)
+        assert len(json.loads(packet)['challenges']) == 2
+
+        # a late reply on the dropped channel is ignored.
+        u.telehash.handlers[1].seqAB_verify(self.prove(dropped))
+        assert 'timeout' in session.jobs
+
+        h.seqAB_verify(self.prove(packet))
+        assert session.opened is None
+        assert session.jobs == {}
+        assert len(u.telehash.handlers) == 3
+
+    def test_error(self, session):
+        u = storjdemo.uploader
+        session.beat(self.contract(0))
+        session.run('session')
+        h = u.telehash.handlers[0]
+        h.seqAA_send_challenge(None)
+        with pytest.raises(ValueError):
+            h.seqAB_verify('broken')
+        assert len(u.telehash.handlers) == 2
+        packet = u.telehash.handlers[1].seqAA_send_challenge(None)
+        assert len(json.loads(packet)['challenges']) == 1
+
+    def test_valid_per_contract(self, session):
+        u = storjdemo.uploader
+        contracts = [self.contract(i) for i in range(2)]
+        for c in contracts:
+            session.beat(c)
+        session.run('session')
+        h = u.telehash.handlers[0]
+        packet = h.seqAA_send_challenge(None)
+        keys = sorted(json.loads(packet)['challenges'])
+        proofs = json.loads(self.prove(packet, swap=True))['proofs']
+        proofs[keys[0]] = json.loads(self.prove(packet))['proofs'][keys[0]]
+        results = json.loads(h.seqAB_verify(
+            json.dumps({'proofs': proofs})))['results']
+        assert results == {keys[0]: True, keys[1]: False}
+        assert [k for (k, due) in u.scheduler.pending()] == \
+            [h.contracts[keys[0]].key]
+
+
+class TestUploaderHandler(object):
+
+    @pytest.fixture
+    def handler(self, monkeypatch):
+        u = storjdemo.uploader
+        monkeypatch.setattr(u, 'send_slots', threading.BoundedSemaphore(1))
+        monkeypatch.setattr(u, 'replicas', Replicas(1))
+        self.events = []
+        u.replicas.add_listener(self.events.append)
+        monkeypatch.setattr(u, 'catalogue', Catalogue(':memory:'))
+        monkeypatch.setattr(u, 'scheduler', HeartbeatScheduler())
+        monkeypatch.setattr(u, 'SEND_WAIT', 0.01)
+        u.catalogue.add([FILENAME])
+        h = u.UploaderHandler()
+        h.destination = 'farmer'
+        (h.dest_utp_ip, h.dest_utp_port) = ('127.0.0.1', 9995)
+        h.object = u.catalogue.next_object(1, h.destination)
+        h.file_hash = b'file'
+        return h
+
+    def test_send_error(self, handler):
+        u = storjdemo.uploader
+        handler.send_file(BrokenUtp(), FILENAME, b'file')
+        assert handler.sending == {}
+        assert u.send_slots.acquire(False)
+        assert self.events[-1]['state'] == FAILED
+
+    def test_send_later(self, handler):
+        u = storjdemo.uploader
+        utp = SilentUtp()
+        handler.send_file(utp, FILENAME, b'tag')
+        handler.send_file(utp, FILENAME, b'file')
+        assert utp.sent == [b'tag']
+        assert [k for (k, due) in u.scheduler.pending()] == \
+            [('send', 'farmer', b'file')]
+
+        handler.handler(b'tag', None)
+        (func, args) = u.scheduler.jobs[('send', 'farmer', b'file')][2:]
+        func(*args)
+        assert utp.sent == [b'tag', b'file']
+        assert not u.send_slots.acquire(False)
+
+    def test_transfer_error(self, handler):
+        u = storjdemo.uploader
+        utp = SilentUtp()
+        handler.send_file(utp, FILENAME, b'file')
+        handler.handler(b'file', 'connection reset')
+        assert handler.sending == {}
+        assert u.send_slots.acquire(False)
+        assert self.events[-1]['state'] == FAILED
+
+        # the farmer reports the failed download.
+        handler.codec = storjdemo.wire.JSON
+        assert handler.seqAC_first_heartbeat(json.dumps(
+            {'success': 0, 'errors': {'66696C65': 'connection reset'}})) \
+            is None
+        assert u.catalogue.get(handler.object['id'])['assigned'] == 0
+        assert u.catalogue.placements(handler.object['id']) == []
+        assert u.scheduler.pending() == []
+
+    def test_farming_timeout(self):
+        # transfers are given up by the farmer before their slots.
+        assert storjdemo.uploader.FARMING_TIMEOUT > \
+            2 * storjdemo.farmer.DOWNLOAD_TIMEOUT
+
+    def test_expire(self, handler):
+        u = storjdemo.uploader
+        utp = SilentUtp()
+        handler.send_file(utp, FILENAME, b'file')
+        handler.expire()
+        assert handler.sending == {}
+        assert u.send_slots.acquire(False)
+        assert u.catalogue.get(handler.object['id'])['assigned'] == 0
+        assert self.events[-1]['state'] == FAILED
+        handler.send_file(utp, FILENAME, b'tag', 0)
+        assert utp.sent == [b'file']
+
+
+class TestFarmerHandler(object):
+
+    @pytest.fixture
+    def handler(self, tmpdir, monkeypatch):
+        f = storjdemo.farmer
+        monkeypatch.setattr(f, 'blobs', storjdemo.blobstore.BlobStore(
+            str(tmpdir.join('download'))))
+        monkeypatch.setattr(f, 'contracts', ContractIndex(':memory:'))
+        self.data = os.urandom(3000)
+        h = f.FarmerHandler(uploader='uploader')
+        h.file_hash = hashlib.sha256(self.data).digest()
+        h.tag_hash = hashlib.sha256(b'tag').digest()
+        h.leaves = [hashlib.sha256(self.data[i:i + 1024]).digest()
+                    for i in range(0, 3000, 1024)]
+        (h.file_size, h.chunk_size) = (3000, 1024)
+        (h.have, h.bad_chunks, h.verified) = (set(), [], set())
+        h.repairs = None
+        h.tmp = f.blobs.mkdtemp()
+        return h
+
+    def download(self, h, hash, data):
+        fname = storjdemo.farmer.blobs.temp_path(hash, h.tmp)
+        with open(fname, 'wb') as file:
+            file.write(data)
+        downloads = storjdemo.farmer.Downloads([hash])
+        h.verify_download(hash, fname, downloads)
+        return downloads.wait(0)
+
+    def report(self, h, error=None, data=None):
+        h.codec = storjdemo.wire.JSON
+        h.utp = StoppedUtp()
+        h.downloads = storjdemo.farmer.Downloads([h.file_hash])
+        if data is not None:
+            with open(storjdemo.farmer.blobs.temp_path(h.file_hash, h.tmp),
+                      'wb') as file:
+                file.write(data)
+        if error is not None or data is not None:
+            h.handler(h.file_hash, error)
+        public = h.codec.swizzle(Swizzle.Swizzle().get_public())
+        return json.loads(h.seqAC_report_downloaded(
+            json.dumps({'public_beat': public})))
+
+    def test_download_timeout(self, handler, monkeypatch):
+        monkeypatch.setattr(storjdemo.farmer, 'DOWNLOAD_TIMEOUT', 0.01)
+        hex = binascii.hexlify(handler.file_hash).upper().decode()
+        assert self.report(handler) == \
+            {'success': 0, 'errors': {hex: 'timeout'}}
+        assert handler.utp.stopped == [handler.file_hash]
+        assert handler.utp.closed
+        assert not os.path.exists(handler.tmp)
+        assert len(storjdemo.farmer.contracts) == 0
+
+    def test_download_error(self, handler):
+        hex = binascii.hexlify(handler.file_hash).upper().decode()
+        start = time.time()
+        assert self.report(handler, 'connection reset') == \
+            {'success': 0, 'errors': {hex: 'connection reset'}}
+        assert time.time() - start < storjdemo.farmer.DOWNLOAD_TIMEOUT
+        assert handler.utp.stopped == [handler.file_hash]
+        assert not os.path.exists(handler.tmp)
+        assert len(storjdemo.farmer.contracts) == 0
+
+    def test_verify_file_hash(self, handler):
+        assert self.download(handler, handler.file_hash, self.data) == {}
+        assert handler.verified == set([handler.file_hash])
+
+        # hashes of chunks matching a file of another hash.
+        handler.verified.clear()
+        handler.have.add(handler.tag_hash)
+        handler.file_hash = hashlib.sha256(b'other').digest()
+        hex = binascii.hexlify(handler.file_hash).upper().decode()
+        assert self.download(handler, handler.file_hash, self.data) == \
+            {hex: 'corrupted'}
+        assert handler.verified == set()
+        assert handler.accept_contract() == {hex: 'corrupted'}
+        assert handler.file_hash not in storjdemo.farmer.blobs
+        assert len(storjdemo.farmer.contracts) == 0
+
+    def test_repair(self, handler):
+        broken = self.data[:1500] + b'x' + self.data[1501:]
+        assert self.download(handler, handler.file_hash, broken) == {}
+        assert handler.bad_chunks == [1]
+        assert handler.verified == set()
+
+        leaf = handler.leaves[1]
+        os.mkdir(os.path.join(handler.tmp, storjdemo.farmer.CHUNK_DIR))
+        with open(handler.chunk_path(leaf), 'wb') as file:
+            file.write(self.data[1024:2048])
+        handler.repairs = storjdemo.farmer.Downloads([leaf])
+        handler.repair([1])
+        assert handler.verified == set([handler.file_hash])
+        assert not os.path.exists(handler.chunk_path(leaf))
+
+    def test_repair_timeout(self, handler, monkeypatch):
+        monkeypatch.setattr(storjdemo.farmer, 'DOWNLOAD_TIMEOUT', 0.01)
+        handler.have.add(handler.tag_hash)
+        broken = self.data[:1500] + b'x' + self.data[1501:]
+        assert self.report(handler, data=broken)['bad_chunks'] == [1]
+        dir = handler.utp.dirs[handler.leaves[1]]
+        assert dir.startswith(handler.tmp)
+
+        # a chunk downloaded partly when the repair times out.
+        with open(handler.chunk_path(handler.leaves[1]), 'wb') as file:
+            file.write(self.data[1024:1500])
+        hex = binascii.hexlify(handler.leaves[1]).upper().decode()
+        assert json.loads(handler.seqAD_report_repaired(
+            json.dumps({'resent': [1]}))) == \
+            {'success': 0, 'errors': {hex: 'timeout'}}
+        assert not os.path.exists(handler.tmp)
+
+    def test_repair_one_chunk(self, handler, monkeypatch):
+        monkeypatch.setattr(storjdemo.farmer, 'DOWNLOAD_TIMEOUT', 0.5)
+        data = self.data[:1000]
+        handler.file_hash = hashlib.sha256(data).digest()
+        handler.leaves = [handler.file_hash]
+        handler.file_size = 1000
+        handler.have.add(handler.tag_hash)
+        assert self.report(handler, data=b'x' + data[1:]) == \
+            {'success': 0, 'errors': {}, 'bad_chunks': [0]}
+
+        dir = handler.utp.dirs[handler.file_hash]
+        with open(os.path.join(dir, binascii.hexlify(
+                handler.file_hash).upper().decode()), 'wb') as file:
+            file.write(data)
+        handler.handler(handler.file_hash, None)
+        assert json.loads(handler.seqAD_report_repaired(
+            json.dumps({'resent': [0]}))) == {'success': 1}
+        assert storjdemo.farmer.contracts.get('uploader', handler.file_hash)
+        with storjdemo.farmer.blobs.open(handler.file_hash) as file:
+            assert file.read() == data
+        assert not os.path.exists(handler.tmp)
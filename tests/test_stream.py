@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import io
+import os
+import hashlib
+
+from storjdemo.stream import HashingReader, get_file_hash
+
+
+def encode_like(file, sector=100):
+    """
+    read a file the way Swizzle.encode() does.
+    """
+    file.seek(0, 2)
+    file.tell()
+    file.seek(0)
+    while file.read(sector):
+        pass
+
+
+class TestStream(object):
+
+    def test_one_pass(self):
+        data = os.urandom(12345)
+        reader = HashingReader(io.BytesIO(data), chunk_size=1000)
+        encode_like(reader)
+        assert reader.digest() == hashlib.sha256(data).digest()
+        assert reader.bytes_read == len(data)
+
+    def test_partial_and_unordered_read(self):
+        data = os.urandom(12345)
+        reader = HashingReader(io.BytesIO(data), chunk_size=1000)
+        reader.seek(5000)
+        reader.read(100)
+        reader.seek(0)
+        reader.read(300)
+        assert reader.digest() == hashlib.sha256(data).digest()
+
+    def test_get_file_hash(self, tmpdir):
+        data = os.urandom(12345)
+        f = tmpdir.join('data')
+        f.write_binary(data)
+        assert get_file_hash(str(f), 1000) == hashlib.sha256(data).digest()
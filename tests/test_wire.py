@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import json
+
+import pytest
+
+from storjdemo import wire
+
+
+class Blob(object):
+
+    def __init__(self, b):
+        self.b = b
+
+    def todict(self):
+        return wire.JSON.blob(self.b)
+
+    @staticmethod
+    def fromdict(d):
+        return Blob(wire.JSON.unblob(d))
+
+
+class TestWire(object):
+
+    def test_pack(self):
+        obj = {u'a': [1, -2, 2 ** 40, 1.5, True, False, None],
+               u'b': os.urandom(32), os.urandom(4): {u'c': u'あ'}}
+        b = wire.pack(obj)
+        assert wire.unpack(b) == obj
+        with pytest.raises(ValueError):
+            wire.unpack(b + b'\x00')
+        with pytest.raises(ValueError):
+            wire.unpack(b[:-3])
+        with pytest.raises(TypeError):
+            wire.pack(object())
+
+    def test_codecs(self):
+        h = os.urandom(32)
+        proof = Blob(os.urandom(100))
+        for codec in (wire.JSON, wire.BINARY):
+            packet = codec.dumps({'hash': codec.hash(h),
+                                  'proof': codec.swizzle(proof),
+                                  'chunks': codec.blob(h + h)})
+            assert wire.detect(packet) is codec
+            p = codec.loads(packet)
+            assert codec.unhash(p['hash']) == h
+            assert codec.unswizzle(Blob, p['proof']).b == proof.b
+            assert codec.unblob(p['chunks']) == h + h
+
+    def test_negotiate(self):
+        assert wire.negotiate(['json', 'bin']) is wire.BINARY
+        assert wire.negotiate(['json']) is wire.JSON
+        assert wire.negotiate([]) is wire.JSON
+        assert wire.detect(json.dumps({})) is wire.JSON
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015, Shinya Yagyu
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import time
+import threading
+
+import pytest
+from heartbeat import Swizzle
+
+from storjdemo import uploader
+from storjdemo.workers import ProcessPool, PoolBusy, ThreadPool
+
+
+class TestProcessPool(object):
+
+    def test_run(self):
+        pool = ProcessPool(2)
+        try:
+            assert pool.run(pow, 2, 10) == 1024
+            assert pool.map(pow, [(2, 1), (2, 2), (2, 3)]) == [2, 4, 8]
+        finally:
+            pool.close()
+
+    def test_busy(self):
+        pool = ProcessPool(1, max_pending=1, timeout=0.2)
+        try:
+            t = threading.Thread(target=pool.run, args=(time.sleep, 1))
+            t.start()
+            time.sleep(0.2)
+            with pytest.raises(PoolBusy):
+                pool.run(pow, 2, 10)
+            t.join()
+            assert pool.run(pow, 2, 10) == 1024
+        finally:
+            pool.close()
+
+    def test_map_busy(self):
+        pool = ProcessPool(2, max_pending=2, timeout=0.2)
+        try:
+            t = threading.Thread(target=pool.map,
+                                 args=(time.sleep, [(1,), (1,)]))
+            t.start()
+            time.sleep(0.2)
+            with pytest.raises(PoolBusy):
+                pool.run(pow, 2, 10)
+            t.join()
+            assert pool.map(pow, [(2, i) for i in range(5)]) == \
+                [1, 2, 4, 8, 16]
+            assert pool.pending == 0
+        finally:
+            pool.close()
+
+    def test_swizzle(self, tmpdir):
+        path = str(tmpdir.join('file'))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(10000))
+        beat = Swizzle.Swizzle()
+        pool = ProcessPool(2, uploader.init_worker, (beat,))
+        try:
+            (file_hash, tag, state, leaves) = pool.run(uploader.encode_file,
+                                                       path)
+            chas = [beat.gen_challenge(state) for i in range(3)]
+            proofs = []
+            for cha in chas:
+                with open(path, 'rb') as f:
+                    proofs.append(beat.get_public().prove(f, cha, tag))
+            argss = [(proof, cha, state) for (proof, cha)
+                     in zip(proofs, chas)]
+            argss.append((proofs[0], chas[1], state))
+            assert pool.map(uploader.verify_proof, argss) == \
+                [True, True, True, False]
+        finally:
+            pool.close()
+
+
+class TestThreadPool(object):
+
+    def test_submit(self):
+        pool = ThreadPool(2, max_pending=1)
+        event = threading.Event()
+        results = []
+        pool.submit(event.wait)
+        pool.submit(event.wait)
+        pool.submit(results.append, 1)
+        time.sleep(0.1)
+        assert pool.depth() == 1
+        event.set()
+        pool.submit(results.append, 2)
+        pool.close()
+        assert sorted(results) == [1, 2]
+        assert pool.depth() == 0